@@ -1,13 +1,28 @@
-from abb_robot_client.egm import EGM
-import abb_motion_program_exec as abb
+import os
 import time
 import numpy as np
 import copy
-import socket
-import json
-import pygame
 import sys
 
+# abb_motion_program_exec y abb_robot_client.egm (requests, protobuf) se importan dentro de
+# cada egm_*_target: importar este modulo no los carga
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from teleop.frames import JogFrames
+from teleop.log_stream import LogStreamer, plot_log
+from teleop.mapping import load_mapping
+from teleop.realtime import RealtimeSession
+from teleop.stream import ReconnectingReader
+from teleop.telemetry import TelemetryPublisher
+from teleop.watchdog import InputWatchdog, feedback_pose, poll_input
+
+# telemetria para los displays (pose, articulaciones, gain y latencia del bucle)
+telemetry = TelemetryPublisher()
+# modo tiempo real opcional: TELEOP_REALTIME=1, TELEOP_REALTIME_CPU=<n> (ver teleop.realtime)
+realtime = RealtimeSession.from_env()
+# espera maxima entre intentos de reconexion con el servidor del mando: un ciclo EGM (4 ms)
+INPUT_RETRY = 0.004
+
 
 def clamp(value, min_value, max_value):
     return max(min_value, min(value, max_value))
@@ -18,20 +33,22 @@ def normalize_quaternion(q):
     return [q[0] / norm, q[1] / norm, q[2] / norm, q[3] / norm]
 
 
-def apply_deadzone(value, threshold):
-    if abs(value) < threshold:
-        return 0
-    return value
-
-
-def egm_pose_target(gain=1):
+def egm_pose_target(gain=1, profile='spacenav_pose', input_timeout=0.1):
+    import abb_motion_program_exec as abb
+    from abb_robot_client.egm import EGM
+    # asignacion de ejes, curvas de respuesta, botones y limites (teleop/profiles/spacenav_pose.json),
+    # compilada una vez: la traslacion conserva la zona muerta de 0.5 (sin salto al salir de ella)
+    # con expo para el posicionado fino
+    mapping = load_mapping(profile)
+    # marco de jog del perfil (wobj, base, tool, custom); el wobj es el marco de correccion
+    frames = JogFrames.from_profile(mapping.profile)
     # config de limites de correccion
     mm = abb.egm_minmax(-1e-3, 1e-3)
 
     # config de los marcos de referencia
-    corr_frame = abb.pose([0, 0, 0], [1, 0, 0, 0])
+    corr_frame = abb.pose(*frames.corr_frame)
     corr_fr_type = abb.egmframetype.EGM_FRAME_WOBJ
-    sense_frame = abb.pose([0, 0, 0], [1, 0, 0, 0])
+    sense_frame = abb.pose(*frames.corr_frame)
     sense_fr_type = abb.egmframetype.EGM_FRAME_WOBJ
     egm_offset = abb.pose([0, 0, 0], [1, 0, 0, 0])
 
@@ -52,112 +69,126 @@ def egm_pose_target(gain=1):
     # envio de datos al robot
     client = abb.MotionProgramExecClient(base_url="http://127.0.0.1:80")
     lognum = client.execute_motion_program(mp, wait=False)
+    # el log de motion_program_logger se va bajando por trozos mientras corre el programa
+    log_stream = LogStreamer.for_program(client, mp).start()
 
     # conexion con mando
-    xinput_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    xinput_socket.connect(('localhost', 65433))
-    buffer = ""
+    # lectura sin bloquear: el bucle contesta al robot en cada ciclo aunque el mando no envie,
+    # y si el servidor se cae o se reinicia se reconecta solo (reintentos cada ciclo EGM como mucho)
+    reader = ReconnectingReader('localhost', 65433, max_delay=INPUT_RETRY, name="Servidor del mando")
+    telemetry.add_source('input_link', reader.stats.telemetry)
+    # si la entrada deja de llegar (o se suelta el hombre muerto de teleop.multi_input)
+    # se mantiene la pose actual del robot (ver teleop.watchdog)
+    watchdog = InputWatchdog(timeout=input_timeout)
+    watchdog.feed(time.perf_counter())
+    telemetry.add_source('watchdog', watchdog.telemetry)
+    telemetry.add_source('frame', frames.telemetry)
 
     # recepción y envio de correcciones en bucle
     t1 = time.perf_counter()
 
     r2 = copy.copy(r1)
     # r4 = copy.copy(r3)
-
-    egm = EGM()
+    # el objetivo EGM va en el wobj de correccion (r1 esta en la base)
+    r2.trans[:], r2.rot[:] = frames.target_from_base(r1.trans, r1.rot)
+    # objetivo [x, y, z, q1, q2, q3] en el orden de las salidas del perfil
+    target = np.array(r2.trans[:3] + r2.rot[:3], dtype=float)
+    # salidas en un limite del perfil, evaluado en el hilo de la telemetria (avisos de teleop.feedback)
+    telemetry.add_source('limit', lambda: mapping.at_limit(target))
+
+    # espera hibrida si el modo tiempo real esta activo (TELEOP_REALTIME=1)
+    egm = realtime.wrap(EGM())
+    realtime.start()
     t2 = t1
     while True:
         t2 = time.perf_counter()
         res, feedback = egm.receive_from_robot(timeout=0.05)
         if res:
-            data = xinput_socket.recv(4096).decode('utf-8')
-            buffer += data
-            if '\n' in buffer:
-                message, buffer = buffer.split('\n', 1)
-                state = json.loads(message)
-
-                if state['buttons'][0] == 1:  # Botón X para disminuir ganancia
-                    gain = max(0.5, gain - 0.5)
-                    print(f"Gain disminuido a: {gain}")
-                if state['buttons'][1] == 1:  # Botón Y para aumentar ganancia
-                    gain += 0.5
-                    print(f"Gain aumentado a: {gain}")
-
-                x = apply_deadzone(state['x'], 0.5)
-                y = apply_deadzone(state['y'], 0.5)
-                z = apply_deadzone(state['z'], 0.5)
-
-                r2.trans[0] += x * gain
-                r2.trans[1] += y * gain
-                r2.trans[2] += z * gain
-                '''
-                r2.rot[0] += state['r_thumb_x'] * gain  # Q1
-                r2.rot[1] += state['r_thumb_y'] * gain  # Q2
-
-                # Usar los botones PAD_LEFT y PAD_RIGHT para ajustar Q3
-                if state['buttons'] & 0x0004:  # PAD_LEFT
-                    r2.rot[2] -= gain * 0.01  # Q3 disminuye
-                if state['buttons'] & 0x0008:  # PAD_RIGHT
-                    r2.rot[2] += gain * 0.01  # Q3 aumenta
-
-                r2.rot[0] = clamp(r2.rot[0], -1, 1)
-                r2.rot[1] = clamp(r2.rot[1], -1, 1)
-                r2.rot[2] = clamp(r2.rot[2], -1, 1)
-                r2.rot[3] = clamp(r2.rot[3], -1, 1)
-
-                r2.rot = normalize_quaternion(r2.rot)
-                '''
-                # Actualización de la orientación del robot
-                q1 = clamp(r2.rot[0] + state['roll'] * 0.01, -0.7071068, 0.7071068)  # Q1
-                q2 = clamp(r2.rot[1] + state['pitch'] * 0.01, -0.7071068, 0.7071068)  # Q2
-                q3 = clamp(r2.rot[2] + state['yaw'] * 0.01, -0.7071068,
-                           0.7071068)  # Q3
-
-                # Recalcular el cuarto componente del cuaternión (Q4) para mantenerlo unitario
-                #q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
-
-                # Asegurar que Q1^2 + Q2^2 + Q3^2 <= 1 para evitar valores inválidos
-                if q1 ** 2 + q2 ** 2 + q3 ** 2 <= 1.0:
-                    q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
-                else:
-                    q4 = r2.rot[3]  # Mantener el valor anterior de Q4 si los otros valores son inválidos
-
-                r2.rot[0] = q1
-                r2.rot[1] = q2
-                r2.rot[2] = q3
-                r2.rot[3] = q4
-
-                if state['buttons'][0] == 1 and state['buttons'][1] == 1:
-                    print("Ambos botones presionados, saliendo...")
-                    break
+            t_rx = time.perf_counter()
+            telemetry.update(feedback, gain=gain, mode='pose')
+            state = poll_input(reader)
+            events = ()
+            if state is not None:
+                watchdog.feed(t_rx, live=state.get('deadman', True))
+                axes, buttons = mapping.read(state)
+
+                # eventos por flanco de subida: boton 1 baja el gain, boton 2 lo sube, los dos salen
+                events = mapping.events(buttons)
+                if events:
+                    if 'gain_down' in events:
+                        gain = max(0.5, gain - 0.5)
+                        print(f"Gain disminuido a: {gain}")
+                    if 'gain_up' in events:
+                        gain += 0.5
+                        print(f"Gain aumentado a: {gain}")
+
+            if watchdog.update(t_rx):
+                # entrada perdida: rampa hasta la pose actual del robot y mantenerla
+                target = mapping.clip(watchdog.hold(target, feedback_pose(feedback, r2.rot), t_rx))
+            elif state is not None:
+                # traslacion en el marco de jog del perfil y Q1-Q3, con los limites del perfil
+                target = mapping.clip(target + frames.apply(mapping.delta(axes, buttons, gain), r2.rot))
+            r2.trans[0], r2.trans[1], r2.trans[2] = target[:3].tolist()
+            '''
+            r2.rot[0] += state['r_thumb_x'] * gain  # Q1
+            r2.rot[1] += state['r_thumb_y'] * gain  # Q2
+
+            # Usar los botones PAD_LEFT y PAD_RIGHT para ajustar Q3
+            if state['buttons'] & 0x0004:  # PAD_LEFT
+                r2.rot[2] -= gain * 0.01  # Q3 disminuye
+            if state['buttons'] & 0x0008:  # PAD_RIGHT
+                r2.rot[2] += gain * 0.01  # Q3 aumenta
+
+            r2.rot[0] = clamp(r2.rot[0], -1, 1)
+            r2.rot[1] = clamp(r2.rot[1], -1, 1)
+            r2.rot[2] = clamp(r2.rot[2], -1, 1)
+            r2.rot[3] = clamp(r2.rot[3], -1, 1)
+
+            r2.rot = normalize_quaternion(r2.rot)
+            '''
+            # Actualización de la orientación del robot
+            q1, q2, q3 = target[3:].tolist()
+
+            # Recalcular el cuarto componente del cuaternión (Q4) para mantenerlo unitario
+            #q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
+
+            # Asegurar que Q1^2 + Q2^2 + Q3^2 <= 1 para evitar valores inválidos
+            if q1 ** 2 + q2 ** 2 + q3 ** 2 <= 1.0:
+                q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
+            else:
+                q4 = r2.rot[3]  # Mantener el valor anterior de Q4 si los otros valores son inválidos
+
+            r2.rot[0] = q1
+            r2.rot[1] = q2
+            r2.rot[2] = q3
+            r2.rot[3] = q4
+
+            if 'exit' in events:
+                print("Ambos botones presionados, saliendo...")
+                break
 
             egm.send_to_robot_cart(r2.trans, r2.rot)
+            telemetry.add_latency(time.perf_counter() - t_rx)
             # r4.trans[1] = (t2 - t1) * 100.
             # egm.send_to_robot_cart(r4.trans, r4.rot)
 
     # detención de EGM y graficar datos botenidos
+    realtime.stop()
+    # las fuentes de este bucle no siguen publicandose con el bucle ya parado
+    telemetry.remove_source('input_link', 'watchdog', 'frame', 'limit')
+    reader.close()
     client.stop_egm()
 
     while client.is_motion_program_running():
         time.sleep(0.05)
 
-    log_results = client.read_motion_program_result_log(lognum)
-
-    # log_results.data is a numpy array
-    import matplotlib.pyplot as plt
-    fig, ax1 = plt.subplots()
-    lns1 = ax1.plot(log_results.data[:, 0], log_results.data[:, 2:])
-    ax1.set_xlabel("Time (s)")
-    ax1.set_ylabel("Joint angle (deg)")
-    ax2 = ax1.twinx()
-    lns2 = ax2.plot(log_results.data[:, 0], log_results.data[:, 1], '-k')
-    ax2.set_ylabel("Command number")
-    ax2.set_yticks(range(-1, int(max(log_results.data[:, 1])) + 1))
-    ax1.legend(lns1 + lns2, log_results.column_headers[2:] + ["cmdnum"])
-    ax1.set_title("Joint motion")
-    plt.show()
+    log_results = log_stream.close(client, lognum)
+    plot_log(log_results)
     print("Operación terminada")
 
 
 if __name__ == "__main__":
+    if realtime.enabled:
+        telemetry.add_source('realtime', lambda: realtime.report)
+    telemetry.start()
     egm_pose_target()
\ No newline at end of file
@@ -1,8 +1,12 @@
-import socket
-import json
+import os
 import pygame
 import sys
-import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from teleop import display
+from teleop.display import FrameTimer, StaticLayer, TelemetryOverlay
+from teleop.stream import ReconnectingReader
+from teleop.telemetry import TelemetrySubscriber
 
 # /////////////////////////////////////////////
 BUTTON_MAP = {
@@ -17,108 +21,127 @@ YAW_TRIGGER_POS = (385, 175)
 LEFT_JOYSTICK_POS = (100, 500)
 RIGHT_JOYSTICK_POS = (300, 500)
 
+MAX_FPS = 60  # frames por segundo maximos del display
+
 # ////////////////////////////////////////////
 
 
 def run_display_client(address='localhost', port=65432):
-    # pygame.init()
-    # screen_width, screen_height = 800, 600
-    # screen = pygame.display.set_mode((screen_width, screen_height))
-    # pygame.display.set_caption("Display de Controlador Xbox")
-
-    # Establecer la conexión
-    client_socket_ = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket_.connect((address, port))
-    print("conexión de servidor")
-    return client_socket_
+    """
+    Lector del servidor del mando: no bloquea y, si el servidor se cae o se reinicia,
+    se reconecta solo y el display sigue con el ultimo estado hasta que vuelve.
+    """
+    return ReconnectingReader(address, port, name="Servidor del mando")
 
 
 # //////////////////////////////////////////
+def draw_static(surface):
+    """Parte fija del display: fondo, contornos de las barras, ejes, etiquetas y aros"""
+    surface.fill((0, 0, 0))
+
+    # contornos y etiquetas de las barras
+    pygame.draw.rect(surface, (255, 255, 255), (*Z_TRIGGER_POS, 20, 220), 1)
+    surface.blit(font.render("Z", True, (255, 255, 255)), (Z_TRIGGER_POS[0] - 20, Z_TRIGGER_POS[1]))
+    pygame.draw.rect(surface, (255, 255, 255), (*YAW_TRIGGER_POS, 200, 20), 1)
+    surface.blit(font.render("YAW", True, (255, 255, 255)), (YAW_TRIGGER_POS[0] + 200, YAW_TRIGGER_POS[1] + 25))
+
+    # dibujo de etiquetas
+    pygame.draw.line(surface, (255, 255, 255), (265 - 40, 300), (265 + 40, 300))
+    pygame.draw.line(surface, (255, 255, 255), (265, 300 - 40), (265, 300 + 40))
+    pygame.draw.line(surface, (255, 255, 255), (485 - 40, 300), (485 + 40, 300))
+    pygame.draw.line(surface, (255, 255, 255), (485, 300 - 40), (485, 300 + 40))
+    x_label = font.render("X", True, (255, 255, 255))
+    y_label = font.render("Y", True, (255, 255, 255))
+    surface.blit(x_label, (265 + 50, 300))
+    surface.blit(y_label, (265, 300 - 50))
+    pitch_label = font.render("ROLL", True, (255, 255, 255))
+    roll_label = font.render("PITCH", True, (255, 255, 255))
+    surface.blit(pitch_label, (485 + 50, 300))
+    surface.blit(roll_label, (485, 300 - 50))
+
+    # aros de los joysticks
+    pygame.draw.circle(surface, (255, 255, 255), (265, 300), 100, 1)
+    pygame.draw.circle(surface, (255, 255, 255), (485, 300), 100, 1)
+
+
 def update_display(screen_, joystick_state):
+    """
+    Dibuja el estado del SpaceNavigator en screen_ (sin actualizar la ventana):
+    copia la capa fija cacheada y dibuja encima solo los marcadores.
+
+    Devuelve un dict elemento -> (valor, rect) para actualizar solo las zonas que cambian.
+    """
     # Lógica para dibujar los botones y joysticks basada en el estado recibido
-    screen.fill((0, 0, 0))
+    static_layer.blit(screen_)
+    elements = {}
 
     # dibujar botones
-    for i, button in enumerate(state['buttons']):
+    for i, button in enumerate(joystick_state['buttons']):
         # el grupo BUTTON_POSITIONS tiene dos elementos en un orden y en el for establezco que representan en ese orden
         color = (0, 0, 255) if button else (255, 255, 255)
-        pygame.draw.circle(screen_, color, (250 * (1 + i), 100), 20)
+        rect = pygame.draw.circle(screen_, color, (250 * (1 + i), 100), 20)
         # draw_text(screen_, BUTTON_MAP[button], (250 * (1 + i) - 10, 100 - 10), font)
+        elements[('button', i)] = (button, rect)
 
     # dibujo de barras
-    draw_bar(screen_, joystick_state['z'], Z_TRIGGER_POS, "Z", horizontal=False)
-    draw_bar(screen_, joystick_state['yaw'], YAW_TRIGGER_POS, "YAW", horizontal=True)
+    elements['z'] = (joystick_state['z'], draw_bar(screen_, joystick_state['z'], Z_TRIGGER_POS, "Z", horizontal=False))
+    elements['yaw'] = (joystick_state['yaw'], draw_bar(screen_, joystick_state['yaw'], YAW_TRIGGER_POS, "YAW", horizontal=True))
 
-    # dibujo de etiquetas
-    pygame.draw.line(screen_, (255, 255, 255), (265 - 40, 300), (265 + 40, 300))
-    pygame.draw.line(screen_, (255, 255, 255), (265, 300 - 40), (265, 300 + 40))
-    pygame.draw.line(screen_, (255, 255, 255), (485 - 40, 300), (485 + 40, 300))
-    pygame.draw.line(screen_, (255, 255, 255), (485, 300 - 40), (485, 300 + 40))
-    x_label = font.render("X", True, (255, 255, 255))
-    y_label = font.render("Y", True, (255, 255, 255))
-    screen_.blit(x_label, (265 + 50, 300))
-    screen_.blit(y_label, (265, 300 - 50))
-    pitch_label = font.render("ROLL", True, (255, 255, 255))
-    roll_label = font.render("PITCH", True, (255, 255, 255))
-    screen_.blit(pitch_label, (485 + 50, 300))
-    screen_.blit(roll_label, (485, 300 - 50))
-
-    #joysticks
-    pygame.draw.circle(screen_, (255, 255, 255), (265, 300), 100, 1)
-    pygame.draw.circle(screen_, (0, 0, 200), (int(265 + state['x'] * 80), int(300 - state['y'] * 80)), 10)
+    #joysticks (los aros estan en la capa fija)
+    rect = pygame.draw.circle(screen_, (0, 0, 200), (int(265 + joystick_state['x'] * 80), int(300 - joystick_state['y'] * 80)), 10)
+    elements['xy'] = ((joystick_state['x'], joystick_state['y']), rect)
 
-    pygame.draw.circle(screen_, (255, 255, 255), (485, 300), 100, 1)
-    pygame.draw.circle(screen_, (0, 0, 200), (int(485 + state['roll'] * 80), int(300 - state['pitch'] * 80)), 10)
+    rect = pygame.draw.circle(screen_, (0, 0, 200), (int(485 + joystick_state['roll'] * 80), int(300 - joystick_state['pitch'] * 80)), 10)
+    elements['roll_pitch'] = ((joystick_state['roll'], joystick_state['pitch']), rect)
 
-    pygame.display.update()
+    elements['telemetry'] = telemetry_overlay.draw(screen_)
+    elements['frame_time'] = frame_timer.draw(screen_)
+    return elements
 
 
 def draw_bar(screen_, value, position, label, horizontal=False):
-    label_text = font.render(label, True, (255, 255, 255))
+    # el contorno y la etiqueta ('label') estan en la capa fija
     if horizontal:
-        pygame.draw.rect(screen_, (255, 255, 255), (*position, 200, 20), 1)
+        rect = pygame.Rect(*position, 200, 20)
         if value >= 0:
-            pygame.draw.rect(screen_, (0, 0, 255), (position[0] + 100, position[1], int(value * 100), 20))
+            bar = pygame.draw.rect(screen_, (0, 0, 255), (position[0] + 100, position[1], int(value * 100), 20))
         else:
-            pygame.draw.rect(screen_, (255, 0, 255), (position[0] + 100 + int(value * 100), position[1], -int(value * 100), 20))
-        screen_.blit(label_text, (position[0] + 200, position[1] + 25))
+            bar = pygame.draw.rect(screen_, (255, 0, 255), (position[0] + 100 + int(value * 100), position[1], -int(value * 100), 20))
     else:
-        pygame.draw.rect(screen_, (255, 255, 255), (*position, 20, 220), 1)
+        rect = pygame.Rect(*position, 20, 220)
         if value >= 0:
-            pygame.draw.rect(screen_, (0, 0, 255), (position[0], position[1] + 100 - int(value * 100), 20, int(value * 100)))
+            bar = pygame.draw.rect(screen_, (0, 0, 255), (position[0], position[1] + 100 - int(value * 100), 20, int(value * 100)))
         else:
-            pygame.draw.rect(screen_, (255, 0, 255), (position[0], position[1] + 100, 20, -int(value * 100)))
-        screen_.blit(label_text, (position[0] - 20, position[1]))
+            bar = pygame.draw.rect(screen_, (255, 0, 255), (position[0], position[1] + 100, 20, -int(value * 100)))
+    return rect.union(bar)
 
 
-if __name__ == "__main__":
+def setup_display():
+    """Abre la ventana y crea las fuentes y capas que usa update_display; devuelve la pantalla"""
+    global font, static_layer, frame_timer, telemetry_overlay
     pygame.init()
-    screen = pygame.display.set_mode((800, 600))
-
+    screen = pygame.display.set_mode((800, 600), pygame.RESIZABLE)
     font = pygame.font.Font(None, 24)
+    static_layer = StaticLayer(draw_static)
+    frame_timer = FrameTimer(font, position=(5, 575))
+    # telemetria del bucle EGM (opcional: si no hay servidor se reintenta en segundo plano)
+    telemetry_overlay = TelemetryOverlay(pygame.font.Font(None, 18), position=(20, 430))
+    return screen
 
-    # run_display_client()
-    client_socket = run_display_client()
 
-    buffer = ""
+def run_display(reader, telemetry):
+    """Bucle del display (teleop.display.run_display), igual que el del mando Xbox"""
+    screen = setup_display()
+    display.run_display(reader, telemetry, screen, update_display, telemetry_overlay, frame_timer, MAX_FPS)
+
+
+if __name__ == "__main__":
+    telemetry = TelemetrySubscriber()
+    # run_display_client()
+    # se vacia el socket en cada frame y solo se dibuja el ultimo estado recibido
+    reader = run_display_client()
     try:
-        while True:
-            data = client_socket.recv(4096).decode('utf-8')  # antes recv() era 1024
-            if not data:
-                break
-            buffer += data
-            while '\n' in buffer:
-                message, buffer = buffer.split('\n', 1)
-                state = json.loads(message)
-                update_display(screen, state)
-            # state = json.loads(data.decode('utf-8'))
-            # update_display(screen, state)
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-
-            # pygame.time.delay(10)
+        run_display(reader, telemetry)
     finally:
-        client_socket.close()
+        reader.close()
+        telemetry.close()
@@ -1,14 +1,19 @@
 from time import sleep
-import pywinusb.hid as hid
 from collections import namedtuple
 import timeit
 import copy
-from pywinusb.hid import usage_pages, helpers, winapi
+import os
+import sys
 import socket
 import json
 import threading
 import time
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# el acceso HID (pywinusb en Windows, hidraw en Linux) se carga al buscar dispositivos
+from teleop.backends import get_backend, get_full_usage_id
+from teleop.stream import LinkStats, serve_latest
+
 # current version number
 __version__ = "0.2.3"
 
@@ -29,8 +34,6 @@ HID_AXIS_MAP = {
     0x35: "yaw",
 }
 
-import pprint
-
 # el mapeado de los ejes se especifica como:
 # [channel, byte1, byte2, scale]; scale es por lo grneral -1 o 1 y multiplica el resultado por este valor
 # (pero el escalado per-axis tabien puede ser establecido de porma manual)
@@ -76,7 +79,7 @@ class DeviceSpec(object):
         self.button_mapping = button_mapping
         self.axis_scale = axis_scale
 
-        self.led_usage = hid.get_full_usage_id(led_id[0], led_id[1])
+        self.led_usage = get_full_usage_id(led_id[0], led_id[1])
         # se inicializa en un vector de reposo "0" para cada estado
         self.dict_state = {
             "t": -1,
@@ -140,11 +143,7 @@ class DeviceSpec(object):
     def set_led(self, state):
         """Establece el estado del LED"""
         if self.connected:
-            reports = self.device.find_output_reports()
-            for report in reports:
-                if self.led_usage in report:
-                    report[self.led_usage] = state
-                    report.send()
+            self.device.set_usage_value(self.led_usage, state)
 
     def close(self):
         """Cierra la conexión si está abierta"""
@@ -501,7 +500,7 @@ def list_devices():
         Una lista de los elementos con soporte que sean encontrados.
     """
     devices = []
-    all_hids = hid.find_all_hid_devices()
+    all_hids = get_backend('hid').find_devices()
     if all_hids:
         for index, device in enumerate(all_hids):
             for device_name, spec in device_specs.items():
@@ -540,7 +539,7 @@ def open(callback=None, button_callback=None, device=None, DeviceNumber=0):
             return None
 
     found_devices = []
-    all_hids = hid.find_all_hid_devices()
+    all_hids = get_backend('hid').find_devices()
     if all_hids:
         for index, dev in enumerate(all_hids):
             spec = device_specs[device]
@@ -580,6 +579,32 @@ def open(callback=None, button_callback=None, device=None, DeviceNumber=0):
     return None
 
 
+def open_all(callback=None, button_callback=None):
+    """
+    Abre todos los dispositivos compatibles conectados, cada uno con su propia copia
+    de DeviceSpec y su propio handler de datos (no modifica el dispositivo activo).
+
+    Parametros:
+        callback, button_callback: como en open(), para todos los dispositivos
+    Devuelve:
+        Lista de objetos de dispositivo abiertos, en el orden en que se encuentran
+    """
+    opened = []
+    for dev in get_backend('hid').find_devices():
+        for device_name, spec in device_specs.items():
+            if dev.vendor_id == spec.hid_id[0] and dev.product_id == spec.hid_id[1]:
+                new_device = copy.deepcopy(spec)
+                new_device.device = dev
+                new_device.callback = callback
+                new_device.button_callback = button_callback
+                new_device.open()
+                dev.set_raw_data_handler(new_device.process)
+                opened.append(new_device)
+                print("%s found" % device_name)
+                break
+    return opened
+
+
 def print_state(state):
     # llamada al print en consola
     if state:
@@ -607,42 +632,42 @@ def set_led(state):
         _active_device.set_led(state)
 
 
+def encode_state(state):
+    """Linea JSON (bytes) del protocolo de los servidores con un estado SpaceNavigator"""
+    data = {
+        'x': state.x,
+        'y': state.y,
+        'z': state.z,
+        'roll': state.roll,
+        'pitch': state.pitch,
+        'yaw': state.yaw,
+        't': state.t,
+        'buttons': list(state.buttons)
+    }
+    return (json.dumps(data) + '\n').encode('utf-8')
+
+
 # ///////////////////////////////////////////////////
 def run_sn_server(address='localhost', port=65432):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # el servidor se puede reiniciar en el acto aunque queden conexiones en TIME_WAIT
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((address, port))
     server_socket.listen(1)
     print("Esperando conexion")
-    connection, client_address = server_socket.accept()
-    print("Conexion de", client_address)
 
     # joystick = XInputJoystick(0)
     Edmouse = DeviceSpec
 
+    def produce():
+        # state = joystick.get_state()
+        state = read()
+        return encode_state(state) if state else None
+
+    # si el cliente se desconecta se vuelve a aceptar; al reconectar recibe el estado actual
     try:
-        while True:
-            # state = joystick.get_state()
-            state = read()
-            if state:
-                data = {
-                # data = json.dumps({
-                    'x': state.x,
-                    'y': state.y,
-                    'z': state.z,
-                    'roll': state.roll,
-                    'pitch': state.pitch,
-                    'yaw': state.yaw,
-                    't': state.t,
-                    'buttons': list(state.buttons)
-                }
-                # })
-                message = json.dumps(data) + '\n'
-                connection.sendall(message.encode('utf-8'))
-                # # connection.sendall(json.dumps(data).encode('utf-8'))
-                # connection.sendall(data.encode('utf-8'))
-            time.sleep(0.01)  # limita frec de envio a 100Hz
+        serve_latest(server_socket, produce, 0.01, LinkStats("Cliente del display (%d)" % port))  # 100Hz
     finally:
-        connection.close()
         server_socket.close()
 
 # ///////////////////////////////////////////////////
@@ -650,39 +675,24 @@ def run_sn_server(address='localhost', port=65432):
 # ///////////////////////////////////////////////////
 def run_sn_egm_server(address='localhost', port=65433):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # el servidor se puede reiniciar en el acto aunque queden conexiones en TIME_WAIT
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((address, port))
     server_socket.listen(1)
     print("Esperando conexion")
-    connection, client_address = server_socket.accept()
-    print("Conexion de", client_address)
 
     # joystick = XInputJoystick(0)
     Edmouse = DeviceSpec
 
+    def produce():
+        # state = joystick.get_state()
+        state = read()
+        return encode_state(state) if state else None
+
+    # si el cliente se desconecta se vuelve a aceptar; al reconectar recibe el estado actual
     try:
-        while True:
-            # state = joystick.get_state()
-            state = read()
-            if state:
-                data = {
-                # data = json.dumps({
-                    'x': state.x,
-                    'y': state.y,
-                    'z': state.z,
-                    'roll': state.roll,
-                    'pitch': state.pitch,
-                    'yaw': state.yaw,
-                    't': state.t,
-                    'buttons': list(state.buttons)
-                }
-                # })
-                message = json.dumps(data) + '\n'
-                connection.sendall(message.encode('utf-8'))
-                # # connection.sendall(json.dumps(data).encode('utf-8'))
-                # connection.sendall(data.encode('utf-8'))
-            time.sleep(0.01)  # limita frec de envio a 100Hz
+        serve_latest(server_socket, produce, 0.01, LinkStats("Cliente del bucle EGM (%d)" % port))  # 100Hz
     finally:
-        connection.close()
         server_socket.close()
 
 # ///////////////////////////////////////////////////
@@ -701,9 +711,14 @@ if __name__ == "__main__":
         server_egm = threading.Thread(target=run_sn_egm_server)
         server_thread.start()
         server_egm.start()
-        while 1:
-            sleep(1)
-            dev.set_led(1)
-            sleep(1)
-            dev.set_led(0)
+        # el LED sigue el estado del bucle EGM (telemetria) desde un hilo aparte: encendido con
+        # el bucle en marcha, parpadeando con el watchdog o en un limite (ver teleop.feedback)
+        from teleop.feedback import FeedbackChannel, LedOutput
+        from teleop.telemetry import TelemetrySubscriber
+        feedback = FeedbackChannel([LedOutput(dev)], TelemetrySubscriber()).start()
+        try:
+            while 1:
+                sleep(1)
+        finally:
+            feedback.close()
 
@@ -1,16 +1,42 @@
-from abb_robot_client.egm import EGM
-import abb_motion_program_exec as abb
+import os
 import time
 import numpy as np
 import copy
-import socket
-import json
-import pygame
+import queue
 import sys
 
+# abb_motion_program_exec y abb_robot_client.egm (requests, protobuf) se importan dentro de
+# cada egm_*_target: importar este modulo (teleop.pipeline, teleop.daemon) no los carga
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from teleop.frames import JogFrames
+from teleop.kinematics import CartesianJog, DLSSolver, Kinematics
+from teleop.log_stream import LogStreamer, plot_log
+from teleop.manipulability import ManipulabilityMap
+from teleop.mapping import load_mapping
+from teleop.realtime import RealtimeSession
+from teleop.stream import ReconnectingReader
+from teleop.telemetry import TelemetryPublisher
+from teleop.watchdog import InputWatchdog, feedback_joints, feedback_pose, poll_input
+
 v_global = 0
-previous_state_x = False
-previous_state_y = False
+# modos de mix_target por nombre (argumento del script y teleop.pipeline)
+MODES = {'pose': 0, 'joint': 1, 'cartesian': 4, 'path': 5}
+# espera maxima entre intentos de reconexion con el servidor del mando: un ciclo EGM (4 ms)
+INPUT_RETRY = 0.004
+
+# recorrido por defecto del modo correccion de trayectoria: ('L', destino) o ('C', punto circular, destino),
+# en mm en la base y con la orientacion de r1
+CORR_PATH = [('L', [500, 100, 600]), ('C', [550, 0, 600], [500, -100, 600]), ('L', [400, -100, 600]),
+             ('L', [400, 100, 600])]
+
+# telemetria para los displays (pose, articulaciones, gain, modo y latencia del bucle)
+telemetry = TelemetryPublisher()
+# modo tiempo real opcional: TELEOP_REALTIME=1, TELEOP_REALTIME_CPU=<n> (ver teleop.realtime)
+realtime = RealtimeSession.from_env()
+# ordenes desde fuera del mando (teleop.daemon): cola con ('event', nombre del perfil) o ('mode', modo)
+remote = None
+requested_mode = None
 
 
 def clamp(value, min_value, max_value):
@@ -22,14 +48,39 @@ def normalize_quaternion(q):
     return [q[0] / norm, q[1] / norm, q[2] / norm, q[3] / norm]
 
 
-def mix_target():
-    global v_global
+def remote_events():
+    """
+    Evento pedido por teleop.daemon (exit, switch_mode, gain_up...); () sin daemon.
+    Uno por ciclo, para que varios gain_up seguidos cuenten todos.
+    """
+    global requested_mode
+    if remote is None or remote.empty():
+        return ()
+    try:
+        kind, value = remote.get_nowait()
+    except queue.Empty:
+        return ()
+    if kind == 'mode':
+        requested_mode = value
+        return ('switch_mode',)
+    return (value,)
+
+
+def mix_target(reader=None):
+    global v_global, requested_mode
 
     while True:
+        if requested_mode is not None:
+            # modo concreto pedido por teleop.daemon en lugar del siguiente del ciclo
+            v_global, requested_mode = MODES[requested_mode], None
         if v_global == 0:
-            egm_pose_target()
+            egm_pose_target(reader=reader)
         elif v_global ==1:
-            egm_joint_target()
+            egm_joint_target(reader=reader)
+        elif v_global == 4:
+            egm_cartesian_target(reader=reader)
+        elif v_global == 5:
+            egm_path_corr_target(reader=reader)
         elif v_global == 2:
             print("Finalización del programa por completo")
             break
@@ -39,8 +90,12 @@ def mix_target():
 
 
 
-def egm_joint_target(gain = 0.5):
-    global v_global, previous_state_x, previous_state_y
+def egm_joint_target(gain = 0.5, profile='xbox_joint', input_timeout=0.1, reader=None):
+    global v_global
+    import abb_motion_program_exec as abb
+    from abb_robot_client.egm import EGM
+    # asignacion de ejes, botones y limites (teleop/profiles/xbox_joint.json), compilada al arrancar
+    mapping = load_mapping(profile)
     mm = abb.egm_minmax(-1e-3, 1e-3)
 
     egm_config = abb.EGMJointTargetConfig(
@@ -48,6 +103,7 @@ def egm_joint_target(gain = 0.5):
     )
 
     joints = abb.jointtarget([0, 0, 0, 0, 0, 0], [0] * 6)
+    robax = np.array(joints.robax, dtype=float)
 
     mp = abb.MotionProgram(egm_config=egm_config)
     mp.MoveAbsJ(joints, abb.v5000, abb.fine)
@@ -55,111 +111,330 @@ def egm_joint_target(gain = 0.5):
 
     client = abb.MotionProgramExecClient(base_url="http://127.0.0.1:80")
     lognum = client.execute_motion_program(mp, wait=False)
-
-    xinput_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    xinput_socket.connect(('localhost', 5001))
-    buffer = ""
+    # el log de motion_program_logger se va bajando por trozos mientras corre el programa
+    log_stream = LogStreamer.for_program(client, mp).start()
+
+    # el lector que se crea aqui se cierra al salir del modo (el de teleop.pipeline no)
+    own_reader = reader is None
+    if own_reader:
+        # lectura sin bloquear: el bucle contesta al robot en cada ciclo aunque el mando no envie
+        # (con teleop.pipeline el mando llega por un canal de memoria compartida)
+        # si el servidor del mando se cae o se reinicia, el lector se reconecta solo
+        reader = ReconnectingReader('localhost', 5001, max_delay=INPUT_RETRY, name="Servidor del mando")
+        telemetry.add_source('input_link', reader.stats.telemetry)
+    # si la entrada deja de llegar se mantiene la pose actual del robot (ver teleop.watchdog)
+    watchdog = InputWatchdog(timeout=input_timeout)
+    watchdog.feed(time.perf_counter())
+    telemetry.add_source('watchdog', watchdog.telemetry)
+    # salidas en un limite del perfil, evaluado en el hilo de la telemetria (avisos de teleop.feedback)
+    telemetry.add_source('limit', lambda: mapping.at_limit(robax))
 
     t1 = time.perf_counter()
 
-    egm = EGM()
+    # espera hibrida si el modo tiempo real esta activo (TELEOP_REALTIME=1)
+    egm = realtime.wrap(EGM())
+    realtime.start()
     t2 = t1
     while True:
         t2 = time.perf_counter()
         res, feedback = egm.receive_from_robot(timeout=0.05)
         if res:
-            data = xinput_socket.recv(4096).decode('utf-8')
-            buffer += data
-            if '\n' in buffer:
-                message, buffer = buffer.split('\n', 1)
-                state = json.loads(message)
-
-                # Detectar el evento de pulsación del botón X (Disminuir gain)
-                current_state_x = state['buttons'] & 0x0040
-                if current_state_x and not previous_state_x:
+            t_rx = time.perf_counter()
+            telemetry.update(feedback, gain=gain, mode='joint')
+            state = poll_input(reader)
+            events = remote_events()
+            if state is not None:
+                watchdog.feed(t_rx, live=state.get('deadman', True))
+                axes, buttons = mapping.read(state)
+
+                # eventos por flanco de subida (gain, cambio de modo, salida)
+                events = mapping.events(buttons) + events
+            if events:
+                if 'gain_down' in events:
                     gain = max(0.5, gain - 0.5)
                     print(f"Gain disminuido a: {gain}")
-                previous_state_x = current_state_x
-
-                # Detectar el evento de pulsación del botón Y (Aumentar gain)
-                current_state_y = state['buttons'] & 0x0080
-                if current_state_y and not previous_state_y:
+                if 'gain_up' in events:
                     gain += 0.5
                     print(f"Gain aumentado a: {gain}")
-                previous_state_y = current_state_y
-
-                # Actualización de las articulaciones según el mando
-                joints.robax[0] += state['l_thumb_x'] * gain  # Articulación 1
-                joints.robax[1] += state['l_thumb_y'] * gain  # Articulación 2
-                joints.robax[2] += state['r_thumb_y'] * gain  # Articulación 3
-                joints.robax[3] += state['r_thumb_x'] * gain  # Articulación 4
-
-                if state['buttons'] & 0x0001:  # PAD_UP
-                    joints.robax[4] += gain
-                if state['buttons'] & 0x0002:  # PAD_DOWN
-                    joints.robax[4] -= gain
-
-                if state['buttons'] & 0x0100:  # LB
-                    joints.robax[5] -= gain
-                if state['buttons'] & 0x0200:  # RB
-                    joints.robax[5] += gain
-
-                # Aplicar restricciones a las articulaciones
-                joints.robax[0] = clamp(joints.robax[0], -170, 170)  # Articulación 1
-                joints.robax[1] = clamp(joints.robax[1], -70, 90)  # Articulación 2
-                joints.robax[2] = clamp(joints.robax[2], -60, 40)  # Articulación 3
-                joints.robax[3] = clamp(joints.robax[3], -90, 90)  # Articulación 4
-                joints.robax[4] = clamp(joints.robax[4], -80, 90)  # Articulación 5
-                joints.robax[5] = clamp(joints.robax[5], -180, 180)  # Articulación 6
-
-                # Enviar los valores de las articulaciones al robot
-                egm.send_to_robot(joints.robax)
-
-                if state['buttons'] & 0x0010:  # Botón START para salir
-                    v_global = 3
-                    break
-
-                if state['buttons'] & 0x0020:
-                    v_global = 0
-                    break
+
+            if watchdog.update(t_rx):
+                # entrada perdida: rampa hasta las articulaciones actuales del robot y mantenerlas
+                robax = mapping.clip(watchdog.hold(robax, feedback_joints(feedback), t_rx))
+            elif state is not None:
+                # Actualización de las articulaciones según el mando y restricciones del perfil
+                robax = mapping.clip(robax + mapping.delta(axes, buttons, gain))
+
+            # Enviar los valores de las articulaciones al robot (en todos los ciclos)
+            egm.send_to_robot(robax)
+            telemetry.add_latency(time.perf_counter() - t_rx)
+
+            if 'exit' in events:  # Botón START para salir
+                v_global = 3
+                break
+
+            if 'switch_mode' in events:
+                v_global = 0  # joint -> pose, como siempre
+                break
 
             # egm.send_to_robot(np.ones((6,)) * np.sin(t2 - t1) * 5)
 
+    realtime.stop()
+    # las fuentes de este modo no se siguen publicando con el bucle parado ni en el siguiente modo
+    telemetry.remove_source('input_link', 'watchdog', 'limit')
+    if own_reader:
+        reader.close()
     client.stop_egm()
 
     while client.is_motion_program_running():
         time.sleep(0.05)
 
-    log_results = client.read_motion_program_result_log(lognum)
-
-    # log_results.data is a numpy array
-    import matplotlib.pyplot as plt
-    fig, ax1 = plt.subplots()
-    lns1 = ax1.plot(log_results.data[:, 0], log_results.data[:, 2:])
-    ax1.set_xlabel("Time (s)")
-    ax1.set_ylabel("Joint angle (deg)")
-    ax2 = ax1.twinx()
-    lns2 = ax2.plot(log_results.data[:, 0], log_results.data[:, 1], '-k')
-    ax2.set_ylabel("Command number")
-    ax2.set_yticks(range(-1, int(max(log_results.data[:, 1])) + 1))
-    ax1.legend(lns1 + lns2, log_results.column_headers[2:] + ["cmdnum"])
-    ax1.set_title("Joint motion")
-    plt.show()
+    log_results = log_stream.close(client, lognum)
+    plot_log(log_results)
     print("Operación terminada")
 
 
-def egm_pose_target(gain=10):
-    global v_global, previous_state_x, previous_state_y
+def egm_cartesian_target(gain=0.5, profile='xbox_cartesian', input_timeout=0.1, reader=None):
+    """
+    Movimiento cartesiano con EGM articular: los incrementos del mando (mm y grados por
+    ciclo en la base) se convierten en articulaciones con nuestra cinematica inversa
+    (teleop.kinematics), que se frena cerca de las singularidades en lugar de parar el programa.
+    """
+    global v_global
+    import abb_motion_program_exec as abb
+    from abb_robot_client.egm import EGM
+    # asignacion de ejes, botones y limites (teleop/profiles/xbox_cartesian.json), compilada al arrancar
+    mapping = load_mapping(profile)
+    limits = mapping.profile.get('joint_limits', {})
+    lower = [limits.get('J%d' % (i + 1), (-np.inf, np.inf))[0] for i in range(6)]
+    upper = [limits.get('J%d' % (i + 1), (-np.inf, np.inf))[1] for i in range(6)]
+    solver = DLSSolver(Kinematics(mapping.profile.get('robot', 'IRB1200_7_70')), lower, upper)
+    mm = abb.egm_minmax(-1e-3, 1e-3)
+
+    egm_config = abb.EGMJointTargetConfig(
+        mm, mm, mm, mm, mm, mm, 1000, 1000
+    )
+
+    # postura de partida con la muñeca doblada (J5 = 0 es singular)
+    joints = abb.jointtarget([0, 0, 0, 0, 30, 0], [0] * 6)
+
+    mp = abb.MotionProgram(egm_config=egm_config)
+    mp.MoveAbsJ(joints, abb.v5000, abb.fine)
+    mp.EGMRunJoint(10, 0.05, 0.05)
+
+    client = abb.MotionProgramExecClient(base_url="http://127.0.0.1:80")
+    lognum = client.execute_motion_program(mp, wait=False)
+    # el log de motion_program_logger se va bajando por trozos mientras corre el programa
+    log_stream = LogStreamer.for_program(client, mp).start()
+
+    own_reader = reader is None
+    if own_reader:
+        # si el servidor del mando se cae o se reinicia, el lector se reconecta solo
+        reader = ReconnectingReader('localhost', 5001, max_delay=INPUT_RETRY, name="Servidor del mando")
+        telemetry.add_source('input_link', reader.stats.telemetry)
+    # si la entrada deja de llegar se mantiene la pose actual del robot (ver teleop.watchdog)
+    watchdog = InputWatchdog(timeout=input_timeout)
+    watchdog.feed(time.perf_counter())
+    telemetry.add_source('watchdog', watchdog.telemetry)
+    telemetry.add_source('ik', lambda: solver.info)
+
+    # espera hibrida si el modo tiempo real esta activo (TELEOP_REALTIME=1)
+    egm = realtime.wrap(EGM())
+    realtime.start()
+    jog = None
+    # articulaciones en un limite, evaluado en el hilo de la telemetria (avisos de teleop.feedback)
+    telemetry.add_source('limit', lambda: [] if jog is None else solver.at_limit(jog.joints))
+    while True:
+        res, feedback = egm.receive_from_robot(timeout=0.05)
+        if res:
+            t_rx = time.perf_counter()
+            telemetry.update(feedback, gain=gain, mode='cartesian')
+            if jog is None:
+                # arranque en caliente desde las articulaciones reales del robot
+                jog = CartesianJog(solver, feedback_joints(feedback))
+            state = poll_input(reader)
+            events = remote_events()
+            if state is not None:
+                watchdog.feed(t_rx, live=state.get('deadman', True))
+                axes, buttons = mapping.read(state)
+
+                # eventos por flanco de subida (gain, cambio de modo, salida)
+                events = mapping.events(buttons) + events
+            if events:
+                if 'gain_down' in events:
+                    gain = max(0.5, gain - 0.5)
+                    print(f"Gain disminuido a: {gain}")
+                if 'gain_up' in events:
+                    gain += 0.5
+                    print(f"Gain aumentado a: {gain}")
+
+            if watchdog.update(t_rx):
+                # entrada perdida: rampa hasta las articulaciones actuales del robot y mantenerlas
+                jog.reset(watchdog.hold(jog.joints, feedback_joints(feedback), t_rx))
+            elif state is not None:
+                # incremento cartesiano del mando -> articulaciones (DLS desde el ultimo comando)
+                jog.update(mapping.delta(axes, buttons, gain))
+
+            egm.send_to_robot(jog.joints)
+            telemetry.add_latency(time.perf_counter() - t_rx)
+
+            if 'exit' in events:
+                v_global = 3
+                break
+
+            if 'switch_mode' in events:
+                v_global = 1  # cartesiano -> joint
+                break
+
+    realtime.stop()
+    # las fuentes de este modo no se siguen publicando con el bucle parado ni en el siguiente modo
+    telemetry.remove_source('input_link', 'watchdog', 'ik', 'limit')
+    if own_reader:
+        reader.close()
+    client.stop_egm()
+
+    while client.is_motion_program_running():
+        time.sleep(0.05)
+
+    log_results = log_stream.close(client, lognum)
+    plot_log(log_results)
+    print("Operación terminada")
+
+
+def egm_path_corr_target(path=CORR_PATH, speed=None, gain=1.0, profile='xbox_path_corr', input_timeout=0.1,
+                         reader=None):
+    """
+    Correccion de trayectoria: el robot recorre 'path' con EGMMoveL/EGMMoveC a la velocidad
+    programada y el mando solo desplaza la trayectoria (mm en coordenadas de trayectoria,
+    dentro de los limites del perfil). El robot pide la correccion cada 48 ms
+    (EGMActMove \\SampleRate:=48 en motion_program_exec_egm.mod). Por defecto speed es abb.v200.
+    """
+    global v_global
+    import abb_motion_program_exec as abb
+    from abb_robot_client.egm import EGM
+    if speed is None:
+        speed = abb.v200
+    # asignacion de ejes (mm/s), botones y limites (teleop/profiles/xbox_path_corr.json)
+    mapping = load_mapping(profile)
+    sensor_frame = abb.pose([0, 0, 0], [1, 0, 0, 0])
+    egm_config = abb.EGMPathCorrectionConfig(sensor_frame)
+
+    rot = [0.7071068, 0., 0.7071068, 0.]
+    robtarget = lambda trans: abb.robtarget(trans, rot, abb.confdata(0, 0, 0, 1), [0] * 6)
+    mp = abb.MotionProgram(egm_config=egm_config)
+    mp.MoveJ(robtarget(path[-1][-1]), abb.v1000, abb.fine)
+    for segment in path:
+        if segment[0] == 'L':
+            mp.EGMMoveL(robtarget(segment[1]), speed, abb.z10)
+        else:
+            mp.EGMMoveC(robtarget(segment[1]), robtarget(segment[2]), speed, abb.z10)
+
+    client = abb.MotionProgramExecClient(base_url="http://127.0.0.1:80")
+    lognum = client.execute_motion_program(mp, wait=False)
+    # el log de motion_program_logger se va bajando por trozos mientras corre el programa
+    log_stream = LogStreamer.for_program(client, mp).start()
+
+    own_reader = reader is None
+    if own_reader:
+        # si el servidor del mando se cae o se reinicia, el lector se reconecta solo
+        reader = ReconnectingReader('localhost', 5001, max_delay=INPUT_RETRY, name="Servidor del mando")
+        telemetry.add_source('input_link', reader.stats.telemetry)
+    # si la entrada deja de llegar la correccion vuelve a cero con una rampa (trayectoria programada)
+    watchdog = InputWatchdog(timeout=input_timeout)
+    watchdog.feed(time.perf_counter())
+    telemetry.add_source('watchdog', watchdog.telemetry)
+    offset = np.zeros(3)
+    telemetry.add_source('path_corr', lambda: {'offset': offset.round(2).tolist()})
+    # salidas en un limite del perfil, evaluado en el hilo de la telemetria (avisos de teleop.feedback)
+    telemetry.add_source('limit', lambda: mapping.at_limit(offset))
+
+    egm = realtime.wrap(EGM())
+    realtime.start()
+    t_last = None
+    while True:
+        res, feedback = egm.receive_from_robot(timeout=0.2)
+        t_rx = time.perf_counter()
+        # la entrada y las ordenes se atienden tambien mientras el robot no pide correcciones,
+        # para poder salir antes de que llegue a los EGMMove
+        state = poll_input(reader)
+        events = remote_events()
+        if state is not None:
+            watchdog.feed(t_rx, live=state.get('deadman', True))
+            axes, buttons = mapping.read(state)
+
+            # eventos por flanco de subida (gain, correccion a cero, cambio de modo, salida)
+            events = mapping.events(buttons) + events
+        if events:
+            if 'gain_down' in events:
+                gain = max(0.5, gain - 0.5)
+                print(f"Gain disminuido a: {gain}")
+            if 'gain_up' in events:
+                gain += 0.5
+                print(f"Gain aumentado a: {gain}")
+            if 'reset_offset' in events:
+                offset[:] = 0.0
+        if 'exit' in events or 'switch_mode' in events:
+            v_global = 3 if 'exit' in events else 0
+            # el recorrido no es un EGMRun: se para el programa entero
+            client.stop_motion_program()
+            break
+
+        if not res:
+            # sin peticiones del robot: o no ha llegado aun a los EGMMove o el programa ya no corre
+            # (recorrido terminado, fallo o parada desde fuera)
+            if not client.is_motion_program_running():
+                v_global = 0
+                print("Recorrido terminado" if t_last is not None else "Programa terminado antes de los EGMMove")
+                break
+            continue
+        dt = 0.0 if t_last is None else t_rx - t_last
+        t_last = t_rx
+        telemetry.update(feedback, gain=gain, mode='path')
+
+        if watchdog.update(t_rx):
+            # entrada perdida: rampa de la correccion a cero y mantenerla
+            offset[:] = watchdog.hold(offset, np.zeros(3), t_rx)
+        elif state is not None:
+            # el perfil da mm/s: se integra con el tiempo entre peticiones del robot
+            offset[:] = mapping.clip(offset + mapping.delta(axes, buttons, gain) * dt)
+
+        egm.send_to_robot_path_corr(offset)
+        telemetry.add_latency(time.perf_counter() - t_rx)
+
+    realtime.stop()
+    # las fuentes de este modo no se siguen publicando con el bucle parado ni en el siguiente modo
+    telemetry.remove_source('input_link', 'watchdog', 'path_corr', 'limit')
+    if own_reader:
+        reader.close()
+
+    while client.is_motion_program_running():
+        time.sleep(0.05)
+
+    log_results = log_stream.close(client, lognum)
+    plot_log(log_results)
+    print("Operación terminada")
+
+
+def egm_pose_target(gain=10, profile='xbox_pose', input_timeout=0.1, reader=None):
+    global v_global
+    import abb_motion_program_exec as abb
+    from abb_robot_client.egm import EGM
+    # asignacion de ejes, botones y limites (teleop/profiles/xbox_pose.json), compilada al arrancar
+    mapping = load_mapping(profile)
+    # marcos de jog del perfil (wobj, base, tool, custom); el wobj es el marco de correccion
+    frames = JogFrames.from_profile(mapping.profile)
     # config de limites de correccion
     mm = abb.egm_minmax(-1e-3, 1e-3)
 
     # config de los marcos de referencia
-    corr_frame = abb.pose([0, 0, 0], [1, 0, 0, 0])
+    corr_frame = abb.pose(*frames.corr_frame)
     corr_fr_type = abb.egmframetype.EGM_FRAME_WOBJ
-    sense_frame = abb.pose([0, 0, 0], [1, 0, 0, 0])
+    sense_frame = abb.pose(*frames.corr_frame)
     sense_fr_type = abb.egmframetype.EGM_FRAME_WOBJ
     egm_offset = abb.pose([0, 0, 0], [1, 0, 0, 0])
 
+    # frenado cerca de las singularidades con el mapa precalculado (python -m teleop.manipulability build)
+    singularity = ManipulabilityMap.load()
+
     # config EGM para orientación en el espacio de trabajo
     egm_config = abb.EGMPoseTargetConfig(corr_frame, corr_fr_type, sense_frame, sense_fr_type,
                                          mm, mm, mm, mm, mm, mm, 1000, 1000
@@ -177,125 +452,143 @@ def egm_pose_target(gain=10):
     # envio de datos al robot
     client = abb.MotionProgramExecClient(base_url="http://127.0.0.1:80")
     lognum = client.execute_motion_program(mp, wait=False)
-
-    # conexion con mando
-    xinput_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    xinput_socket.connect(('localhost', 5001))
-    buffer = ""
+    # el log de motion_program_logger se va bajando por trozos mientras corre el programa
+    log_stream = LogStreamer.for_program(client, mp).start()
+
+    # conexion con mando, leida sin bloquear
+    own_reader = reader is None
+    if own_reader:
+        # si el servidor del mando se cae o se reinicia, el lector se reconecta solo
+        reader = ReconnectingReader('localhost', 5001, max_delay=INPUT_RETRY, name="Servidor del mando")
+        telemetry.add_source('input_link', reader.stats.telemetry)
+    # si la entrada deja de llegar se mantiene la pose actual del robot (ver teleop.watchdog)
+    watchdog = InputWatchdog(timeout=input_timeout)
+    watchdog.feed(time.perf_counter())
+    telemetry.add_source('watchdog', watchdog.telemetry)
+    telemetry.add_source('frame', frames.telemetry)
+    if singularity is not None:
+        telemetry.add_source('singularity', singularity.telemetry)
 
     # recepción y envio de correcciones en bucle
     t1 = time.perf_counter()
 
     r2 = copy.copy(r1)
     # r4 = copy.copy(r3)
-
-    egm = EGM()
+    # el objetivo EGM va en el wobj de correccion (r1 esta en la base)
+    r2.trans[:], r2.rot[:] = frames.target_from_base(r1.trans, r1.rot)
+    # objetivo [x, y, z, q1, q2, q3] en el orden de las salidas del perfil
+    target = np.array(r2.trans[:3] + r2.rot[:3], dtype=float)
+    # salidas en un limite del perfil, evaluado en el hilo de la telemetria (avisos de teleop.feedback)
+    telemetry.add_source('limit', lambda: mapping.at_limit(target))
+
+    # espera hibrida si el modo tiempo real esta activo (TELEOP_REALTIME=1)
+    egm = realtime.wrap(EGM())
+    realtime.start()
     t2 = t1
     while True:
         t2 = time.perf_counter()
         res, feedback = egm.receive_from_robot(timeout=0.05)
         if res:
-            data = xinput_socket.recv(4096).decode('utf-8')
-            buffer += data
-            if '\n' in buffer:
-                message, buffer = buffer.split('\n', 1)
-                state = json.loads(message)
-
-                # Detectar el evento de pulsación del botón X (Disminuir gain)
-                current_state_x = state['buttons'] & 0x0040
-                if current_state_x and not previous_state_x:
+            t_rx = time.perf_counter()
+            telemetry.update(feedback, gain=gain, mode='pose')
+            state = poll_input(reader)
+            events = remote_events()
+            if state is not None:
+                watchdog.feed(t_rx, live=state.get('deadman', True))
+                axes, buttons = mapping.read(state)
+
+                # eventos por flanco de subida (gain, cambio de modo, salida)
+                events = mapping.events(buttons) + events
+            if events:
+                if 'gain_down' in events:
                     gain = max(0.5, gain - 0.5)
                     print(f"Gain disminuido a: {gain}")
-                previous_state_x = current_state_x
-
-                # Detectar el evento de pulsación del botón Y (Aumentar gain)
-                current_state_y = state['buttons'] & 0x0080
-                if current_state_y and not previous_state_y:
+                if 'gain_up' in events:
                     gain += 0.5
                     print(f"Gain aumentado a: {gain}")
-                previous_state_y = current_state_y
-
-                # actualización del robot
-                r2.trans[0] += state['l_thumb_x'] * gain
-                r2.trans[1] += state['l_thumb_y'] * gain
-                r2.trans[2] += (state['right_trigger'] - state['left_trigger']) * gain
-                '''
-                r2.rot[0] += state['r_thumb_x'] * gain  # Q1
-                r2.rot[1] += state['r_thumb_y'] * gain  # Q2
-
-                # Usar los botones PAD_LEFT y PAD_RIGHT para ajustar Q3
-                if state['buttons'] & 0x0004:  # PAD_LEFT
-                    r2.rot[2] -= gain * 0.01  # Q3 disminuye
-                if state['buttons'] & 0x0008:  # PAD_RIGHT
-                    r2.rot[2] += gain * 0.01  # Q3 aumenta
-
-                r2.rot[0] = clamp(r2.rot[0], -1, 1)
-                r2.rot[1] = clamp(r2.rot[1], -1, 1)
-                r2.rot[2] = clamp(r2.rot[2], -1, 1)
-                r2.rot[3] = clamp(r2.rot[3], -1, 1)
-
-                r2.rot = normalize_quaternion(r2.rot)
-                '''
-                # Actualización de la orientación del robot
-                q1 = clamp(r2.rot[0] + state['r_thumb_x'] * 0.01, -0.7071068, 0.7071068)  # Q1
-                q2 = clamp(r2.rot[1] + state['r_thumb_y'] * 0.01, -0.7071068, 0.7071068)  # Q2
-                q3 = clamp(r2.rot[2] + (state['buttons'] & 0x0004 - state['buttons'] & 0x0008) * 0.01, -0.7071068,
-                            0.7071068)  # Q3
-                if state['buttons'] & 0x0004:  # PAD_LEFT
-                    q3 = clamp(r2.rot[2] - 0.01 * gain, -0.7071068, 0.7071068)  # Disminuye Q3
-                if state['buttons'] & 0x0008:  # PAD_RIGHT
-                    q3 = clamp(r2.rot[2] + 0.01 * gain, -0.7071068, 0.7071068)  # Aumenta Q3
-
-                # Recalcular el cuarto componente del cuaternión (Q4) para mantenerlo unitario
-                #q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
-
-                # Asegurar que Q1^2 + Q2^2 + Q3^2 <= 1 para evitar valores inválidos
-                if q1 ** 2 + q2 ** 2 + q3 ** 2 <= 1.0:
-                    q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
-                else:
-                    q4 = r2.rot[3]  # Mantener el valor anterior de Q4 si los otros valores son inválidos
-
-                r2.rot[0] = q1
-                r2.rot[1] = q2
-                r2.rot[2] = q3
-                r2.rot[3] = q4
-
-                if state['buttons'] & 0x0010:
-                    v_global = 3
-                    break
-
-                if state['buttons'] & 0x0020:
-                    v_global = 1
-                    break
+                if 'next_frame' in events:
+                    frames.next()
+
+            if watchdog.update(t_rx):
+                # entrada perdida: rampa hasta la pose actual del robot y mantenerla
+                target = mapping.clip(watchdog.hold(target, feedback_pose(feedback, r2.rot), t_rx))
+            elif state is not None:
+                # actualización del robot (traslacion en el marco de jog activo y Q1-Q3, con los limites del perfil)
+                delta = frames.apply(mapping.delta(axes, buttons, gain), r2.rot)
+                if singularity is not None:
+                    # velocidad reducida si el movimiento se acerca a una singularidad
+                    delta *= singularity.speed_scale(frames.to_base(target[:3]), frames.to_base(target[:3] + delta[:3]))
+                target = mapping.clip(target + delta)
+            r2.trans[0], r2.trans[1], r2.trans[2] = target[:3].tolist()
+            '''
+            r2.rot[0] += state['r_thumb_x'] * gain  # Q1
+            r2.rot[1] += state['r_thumb_y'] * gain  # Q2
+
+            # Usar los botones PAD_LEFT y PAD_RIGHT para ajustar Q3
+            if state['buttons'] & 0x0004:  # PAD_LEFT
+                r2.rot[2] -= gain * 0.01  # Q3 disminuye
+            if state['buttons'] & 0x0008:  # PAD_RIGHT
+                r2.rot[2] += gain * 0.01  # Q3 aumenta
+
+            r2.rot[0] = clamp(r2.rot[0], -1, 1)
+            r2.rot[1] = clamp(r2.rot[1], -1, 1)
+            r2.rot[2] = clamp(r2.rot[2], -1, 1)
+            r2.rot[3] = clamp(r2.rot[3], -1, 1)
+
+            r2.rot = normalize_quaternion(r2.rot)
+            '''
+            # Actualización de la orientación del robot
+            q1, q2, q3 = target[3:].tolist()
+
+            # Recalcular el cuarto componente del cuaternión (Q4) para mantenerlo unitario
+            #q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
+
+            # Asegurar que Q1^2 + Q2^2 + Q3^2 <= 1 para evitar valores inválidos
+            if q1 ** 2 + q2 ** 2 + q3 ** 2 <= 1.0:
+                q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
+            else:
+                q4 = r2.rot[3]  # Mantener el valor anterior de Q4 si los otros valores son inválidos
+
+            r2.rot[0] = q1
+            r2.rot[1] = q2
+            r2.rot[2] = q3
+            r2.rot[3] = q4
+
+            if 'exit' in events:
+                v_global = 3
+                break
+
+            if 'switch_mode' in events:
+                v_global = 4  # pose -> cartesiano
+                break
 
             egm.send_to_robot_cart(r2.trans, r2.rot)
+            telemetry.add_latency(time.perf_counter() - t_rx)
             # r4.trans[1] = (t2 - t1) * 100.
             # egm.send_to_robot_cart(r4.trans, r4.rot)
 
     # detención de EGM y graficar datos botenidos
+    realtime.stop()
+    # las fuentes de este modo no se siguen publicando con el bucle parado ni en el siguiente modo
+    telemetry.remove_source('input_link', 'watchdog', 'frame', 'singularity', 'limit')
+    if own_reader:
+        reader.close()
     client.stop_egm()
 
     while client.is_motion_program_running():
         time.sleep(0.05)
 
-    log_results = client.read_motion_program_result_log(lognum)
-
-    # log_results.data is a numpy array
-    import matplotlib.pyplot as plt
-    fig, ax1 = plt.subplots()
-    lns1 = ax1.plot(log_results.data[:, 0], log_results.data[:, 2:])
-    ax1.set_xlabel("Time (s)")
-    ax1.set_ylabel("Joint angle (deg)")
-    ax2 = ax1.twinx()
-    lns2 = ax2.plot(log_results.data[:, 0], log_results.data[:, 1], '-k')
-    ax2.set_ylabel("Command number")
-    ax2.set_yticks(range(-1, int(max(log_results.data[:, 1])) + 1))
-    ax1.legend(lns1 + lns2, log_results.column_headers[2:] + ["cmdnum"])
-    ax1.set_title("Joint motion")
-    plt.show()
+    log_results = log_stream.close(client, lognum)
+    plot_log(log_results)
     print("Operación terminada")
 
 
 if __name__ == "__main__":
+    if realtime.enabled:
+        telemetry.add_source('realtime', lambda: realtime.report)
+    # modo inicial opcional: python egm_interface_Xbox.py [pose|joint|cartesian|path]
+    if len(sys.argv) > 1:
+        v_global = MODES[sys.argv[1]]
+    telemetry.start()
     mix_target()
 
@@ -1,8 +1,13 @@
-import socket
-import json
+import os
 import pygame
 import sys
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from teleop import display
+from teleop.display import FrameTimer, StaticLayer, TelemetryOverlay
+from teleop.stream import ReconnectingReader
+from teleop.telemetry import TelemetrySubscriber
+
 
 # /////////////////////////////////////////////
 BUTTON_MAP = {
@@ -25,6 +30,8 @@ RIGHT_JOYSTICK_POS = (600, 500)
 STATE_POS_CAR = (750, 520)
 STATE_POS_POL = (750, 550)
 
+MAX_FPS = 60  # frames por segundo maximos del display
+
 # ////////////////////////////////////////////
 
 
@@ -34,87 +41,112 @@ def draw_text(screen, text, position, font, color=(255, 255, 255)):
 
 
 def run_display_client(address='localhost', port=5000):
-    # pygame.init()
-    # screen_width, screen_height = 800, 600
-    # screen = pygame.display.set_mode((screen_width, screen_height))
-
-    # Establecer la conexión
-    client_socket_ = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client_socket_.connect((address, port))
-    print("conexión de servidor")
-    return client_socket_
+    """
+    Lector del servidor del mando: no bloquea y, si el servidor se cae o se reinicia,
+    se reconecta solo y el display sigue con el ultimo estado hasta que vuelve.
+    """
+    return ReconnectingReader(address, port, name="Servidor del mando")
 
 
 # //////////////////////////////////////////
+def draw_static(surface):
+    """Parte fija del display: fondo, etiquetas, fondo de los gatillos y aros de los joysticks"""
+    surface.fill((0, 0, 0))
+    for button, position in BUTTON_POSITIONS.items():
+        draw_text(surface, BUTTON_MAP[button], (position[0] + 25, position[1] - 10), font)
+    for label, position in (('LT', LEFT_TRIGGER_POS), ('RT', RIGHT_TRIGGER_POS)):
+        pygame.draw.rect(surface, (255, 255, 255), (*position, 20, 100))
+        draw_text(surface, label, (position[0], position[1] - 20), font)
+    for position in (LEFT_JOYSTICK_POS, RIGHT_JOYSTICK_POS):
+        pygame.draw.circle(surface, (255, 255, 255), position, 40, 1)
+
+
 def update_display(screen_, joystick_state):
+    """
+    Dibuja el estado del mando en screen_ (sin actualizar la ventana): copia la
+    capa fija cacheada y dibuja encima solo los marcadores que dependen del estado.
+
+    Devuelve un dict elemento -> (valor, rect) con el valor que representa cada
+    elemento y el rectangulo que ocupa, para que el bucle principal actualice
+    solo las zonas de los elementos que han cambiado.
+    """
     # Lógica para dibujar los botones y joysticks basada en el estado recibido
-    screen.fill((0, 0, 0))
+    static_layer.blit(screen_)
+    elements = {}
     for button, position in BUTTON_POSITIONS.items():
         # el grupo BUTTON_POSITIONS tiene dos elementos en un orden y en el for establezco que representan en ese orden
-        color = (0, 255, 0) if joystick_state['buttons'] & button else (255, 255, 255)
-        pygame.draw.circle(screen_, color, position, 20)
-        draw_text(screen_, BUTTON_MAP[button], (position[0] + 25, position[1] - 10), font)
-
-    draw_trigger(screen_, joystick_state['left_trigger'], LEFT_TRIGGER_POS)
-    draw_trigger(screen_, joystick_state['right_trigger'], RIGHT_TRIGGER_POS)
+        pressed = bool(joystick_state['buttons'] & button)
+        color = (0, 255, 0) if pressed else (255, 255, 255)
+        elements[button] = (pressed, pygame.draw.circle(screen_, color, position, 20))
 
-    draw_joystick(screen_, joystick_state['l_thumb_x'], joystick_state['l_thumb_y'], LEFT_JOYSTICK_POS)
-    draw_joystick(screen_, joystick_state['r_thumb_x'], joystick_state['r_thumb_y'], RIGHT_JOYSTICK_POS)
+    elements['left_trigger'] = (joystick_state['left_trigger'],
+                                draw_trigger(screen_, joystick_state['left_trigger'], LEFT_TRIGGER_POS))
+    elements['right_trigger'] = (joystick_state['right_trigger'],
+                                 draw_trigger(screen_, joystick_state['right_trigger'], RIGHT_TRIGGER_POS))
 
-    draw_tog(screen_, joystick_state['cartesian_mode'], STATE_POS_CAR)
-    draw_tog(screen_, not joystick_state['cartesian_mode'], STATE_POS_POL)
+    elements['left_joystick'] = ((joystick_state['l_thumb_x'], joystick_state['l_thumb_y']),
+                                 draw_joystick(screen_, joystick_state['l_thumb_x'], joystick_state['l_thumb_y'], LEFT_JOYSTICK_POS))
+    elements['right_joystick'] = ((joystick_state['r_thumb_x'], joystick_state['r_thumb_y']),
+                                  draw_joystick(screen_, joystick_state['r_thumb_x'], joystick_state['r_thumb_y'], RIGHT_JOYSTICK_POS))
 
-    pygame.display.update()
+    cartesian_mode = joystick_state['cartesian_mode']
+    elements['mode'] = (cartesian_mode, draw_tog(screen_, cartesian_mode, STATE_POS_CAR).union(
+        draw_tog(screen_, not cartesian_mode, STATE_POS_POL)))
 
-    # pass  # Aquí iría el código para dibujar basado en joystick_state
+    elements['telemetry'] = telemetry_overlay.draw(screen_)
+    elements['frame_time'] = frame_timer.draw(screen_)
+    return elements
 
 
 def draw_trigger(screen_, value, position):
-    pygame.draw.rect(screen_, (255, 255, 255), (*position, 20, 100))
+    # el fondo blanco y la etiqueta estan en la capa fija
+    rect = pygame.Rect(*position, 20, 100)
     pygame.draw.rect(screen_, (0, 255, 0), (*position, 20, int(100 * value)))
-    if position == LEFT_TRIGGER_POS:
-        draw_text(screen_, 'LT', (position[0], position[1] - 20), font)
-    else:
-        draw_text(screen_, 'RT', (position[0], position[1] - 20), font)
+    return rect
 
 
 def draw_joystick(screen_, x_value, y_value, position):
-    pygame.draw.circle(screen_, (255, 255, 255), position, 40, 1)
-    pygame.draw.circle(screen_, (0, 255, 0),
-                       (position[0] + int(40 * x_value), position[1] - int(40 * y_value)), 10)
+    # el aro esta en la capa fija
+    rect = pygame.Rect(position[0] - 40, position[1] - 40, 81, 81)
+    return rect.union(pygame.draw.circle(screen_, (0, 255, 0),
+                                         (position[0] + int(40 * x_value), position[1] - int(40 * y_value)), 10))
 
 
 def draw_tog(screen_, state_, position):
     color = (0, 255, 0) if state_ else (255, 255, 255)
-    pygame.draw.rect(screen_, color, (*position, 20, 20))
+    return pygame.draw.rect(screen_, color, (*position, 20, 20))
 
 
-if __name__ == "__main__":
+def setup_display():
+    """Abre la ventana y crea las fuentes y capas que usa update_display; devuelve la pantalla"""
+    global font, static_layer, frame_timer, telemetry_overlay
     pygame.init()
-    screen = pygame.display.set_mode((800, 600))
+    screen = pygame.display.set_mode((800, 600), pygame.RESIZABLE)
     font = pygame.font.Font(None, 24)
-    # run_display_client()
-    client_socket = run_display_client()
+    static_layer = StaticLayer(draw_static)
+    frame_timer = FrameTimer(font, position=(5, 575))
+    # telemetria del bucle EGM (opcional: si no hay servidor se reintenta en segundo plano)
+    telemetry_overlay = TelemetryOverlay(pygame.font.Font(None, 18), position=(300, 250))
+    return screen
+
+
+def run_display(reader, telemetry):
+    """
+    Bucle del display (teleop.display.run_display). reader entrega el estado del mando
+    con poll() (ReconnectingReader sobre el socket del servidor o un canal de teleop.shm)
+    y telemetry el estado del bucle EGM (TelemetrySubscriber o el subscriptor de teleop.pipeline).
+    """
+    screen = setup_display()
+    display.run_display(reader, telemetry, screen, update_display, telemetry_overlay, frame_timer, MAX_FPS)
 
-    buffer = ""
+
+if __name__ == "__main__":
+    telemetry = TelemetrySubscriber()
+    # run_display_client()
+    # se vacia el socket en cada frame y solo se dibuja el ultimo estado recibido
+    reader = run_display_client()
     try:
-        while True:
-            data = client_socket.recv(4096).decode('utf-8')  # antes recv() era 1024
-            if not data:
-                break
-            buffer += data
-            while '\n' in buffer:
-                message, buffer = buffer.split('\n', 1)
-                state = json.loads(message)
-                update_display(screen, state)
-            # state = json.loads(data.decode('utf-8'))
-            # update_display(screen, state)
-    
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-    
-            # pygame.time.delay(10)
+        run_display(reader, telemetry)
     finally:
-        client_socket.close()
+        reader.close()
+        telemetry.close()
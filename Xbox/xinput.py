@@ -14,54 +14,41 @@ https://github.com/r4dian/Xbox-Controller-for-Python/tree/master
 Implementado en Python 3
 Modificado para añadir señales de seguimiento y disponer de conexión TCP
 para su comunicación con otras aplicaciones
+El acceso al mando se hace a traves de teleop.backends: XInput en Windows,
+evdev en Linux o un backend sintetico (TELEOP_GAMEPAD_BACKEND=synthetic)
+El flujo hacia EGM envia los ejes lineales; TELEOP_XBOX_CURVES=fine aplica a los
+joysticks una zona muerta y expo para el posicionado fino (FINE_AXIS_CURVES)
 Solo requiere Pyglet 1.2alpha1 o superior:
 pip install --upgrade http://pyglet.googlecode.com/archive/tip.zip
 """
 
 import ctypes
+import os
 import sys
 import time
-from operator import itemgetter, attrgetter
-from itertools import count, starmap
+from operator import attrgetter
+import numpy as np
 from pyglet import event
 import json
 import socket
 import threading
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # biblioteca de eventos
-class XINPUT_GAMEPAD(ctypes.Structure):
-    _fields_ = [
-        ('buttons', ctypes.c_ushort),  # wButtons
-        ('left_trigger', ctypes.c_ubyte),  # bLeftTrigger
-        ('right_trigger', ctypes.c_ubyte),  # bLeftTrigger
-        ('l_thumb_x', ctypes.c_short),  # sThumbLX
-        ('l_thumb_y', ctypes.c_short),  # sThumbLY
-        ('r_thumb_x', ctypes.c_short),  # sThumbRx
-        ('r_thumb_y', ctypes.c_short),  # sThumbRy
-    ]
-
-
-class XINPUT_STATE(ctypes.Structure):
-    _fields_ = [
-        ('packet_number', ctypes.c_ulong),  # dwPacketNumber
-        ('gamepad', XINPUT_GAMEPAD),  # Gamepad
-    ]
-
-
-class XINPUT_VIBRATION(ctypes.Structure):
-    _fields_ = [("wLeftMotorSpeed", ctypes.c_ushort),
-                ("wRightMotorSpeed", ctypes.c_ushort)]
-
-class XINPUT_BATTERY_INFORMATION(ctypes.Structure):
-    _fields_ = [("BatteryType", ctypes.c_ubyte),
-                ("BatteryLevel", ctypes.c_ubyte)]
-
-
-xinput = ctypes.windll.xinput1_4
-# xinput = ctypes.windll.xinput9_1_0  # this is the Win 8 version ?
-# xinput1_2, xinput1_1 (32-bit Vista SP1)
-# xinput1_3 (64-bit Vista SP1)
+# las estructuras de XInput y el acceso a la libreria de plataforma viven en teleop.backends;
+# el backend (xinput1_4 en Windows, evdev en Linux, sintetico en pruebas) se carga al crear el mando
+from teleop.backends import (
+    XINPUT_GAMEPAD,
+    XINPUT_STATE,
+    XINPUT_VIBRATION,
+    XINPUT_BATTERY_INFORMATION,
+    ERROR_DEVICE_NOT_CONNECTED,
+    ERROR_SUCCESS,
+    get_backend,
+)
+from teleop.shaping import AxisCurve, ResponseShaper
+from teleop.stream import LinkStats, serve_latest
 
 
 def struct_dict(struct):
@@ -119,8 +106,45 @@ def gen_bit_values(number):
         number >>= 1
 
 
-ERROR_DEVICE_NOT_CONNECTED = 1167
-ERROR_SUCCESS = 0
+# ejes analógicos del mando (todos los campos menos los botones) y su tamaño en bytes
+AXIS_FIELDS = tuple(
+    (name, ctypes.sizeof(type)) for name, type in XINPUT_GAMEPAD._fields_ if name != 'buttons')
+TRIGGER_AXES = ('left_trigger', 'right_trigger')
+# lee todos los ejes de un XINPUT_GAMEPAD de una vez, en el orden de AXIS_FIELDS
+get_axis_values = attrgetter(*(name for name, size in AXIS_FIELDS))
+
+# zona muerta y cambio minimo de los ejes normalizados
+AXIS_DEADZONE = 0.08
+AXIS_EPSILON = 0.000000005
+
+# escala de cada eje de AXIS_FIELDS a [0, 1] (gatillos) o [-1, 1] (joysticks)
+AXIS_SCALE = tuple(1.0 / 255.0 if name in TRIGGER_AXES else 1.0 / 32767.0 for name, size in AXIS_FIELDS)
+# curvas de respuesta del flujo hacia EGM, en el orden de AXIS_FIELDS. Por defecto la
+# identidad (los ejes van lineales); las de posicionado fino son opcionales: gatillos
+# lineales y joysticks con zona muerta y algo de expo
+EGM_AXIS_CURVES = tuple(AxisCurve() for name, size in AXIS_FIELDS)
+FINE_AXIS_CURVES = tuple(
+    AxisCurve() if name in TRIGGER_AXES else AxisCurve(deadzone=AXIS_DEADZONE, expo=0.3)
+    for name, size in AXIS_FIELDS)
+# curvas por nombre para TELEOP_XBOX_CURVES
+AXIS_CURVES = {'linear': EGM_AXIS_CURVES, 'fine': FINE_AXIS_CURVES}
+
+
+def stream_shaper(curves=None):
+    """
+    ResponseShaper del flujo hacia EGM con 'curves' (por defecto las que diga
+    TELEOP_XBOX_CURVES, 'linear' si no esta), o None si todas son la identidad:
+    asi los ejes se envian exactamente igual que sin curvas.
+    """
+    if curves is None:
+        name = os.environ.get('TELEOP_XBOX_CURVES', 'linear')
+        try:
+            curves = AXIS_CURVES[name]
+        except KeyError:
+            raise ValueError("TELEOP_XBOX_CURVES=%s desconocido; disponibles: %s" % (name, ", ".join(AXIS_CURVES)))
+    if all(AxisCurve(*curve) == AxisCurve() for curve in curves):
+        return None
+    return ResponseShaper(curves)
 
 
 class XInputJoystick(event.EventDispatcher):
@@ -137,13 +161,16 @@ class XInputJoystick(event.EventDispatcher):
     """
     max_devices = 4
 
-    def __init__(self, device_number, normalize_axes=True):
+    def __init__(self, device_number, normalize_axes=True, backend=None, axis_deadzone=AXIS_DEADZONE):
         values = vars()
         del values['self']
         self.__dict__.update(values)
 
         super(XInputJoystick, self).__init__()
 
+        # backend de plataforma, cargado solo ahora (ver teleop.backends)
+        self.backend = backend or get_backend('gamepad')
+
         self._last_state = self.get_state()
         self.received_packets = 0
         self.missed_packets = 0
@@ -151,6 +178,10 @@ class XInputJoystick(event.EventDispatcher):
         # Establece el método que se empleará para la normalización.
         choices = [self.translate_identity, self.translate_using_data_size]
         self.translate = choices[normalize_axes]
+        # tabla de ejes precalculada: (nombre, tamaño en bytes, es_gatillo)
+        # evita reconstruir el dict de campos y llamar a ctypes.sizeof en cada muestreo
+        self._axis_table = tuple(
+            (axis, size, axis in TRIGGER_AXES) for axis, size in AXIS_FIELDS)
         # ///////////////////////
         self.cartesian_mode = True
 
@@ -166,7 +197,7 @@ class XInputJoystick(event.EventDispatcher):
     def get_state(self):
         "Obtiene el estado del controlador representado por este objeto"
         state = XINPUT_STATE()
-        res = xinput.XInputGetState(self.device_number, ctypes.byref(state))
+        res = self.backend.get_state(self.device_number, state)
         if res == ERROR_SUCCESS:
             return state
         if res != ERROR_DEVICE_NOT_CONNECTED:
@@ -178,33 +209,19 @@ class XInputJoystick(event.EventDispatcher):
         return self._last_state is not None
 
     @staticmethod
-    def enumerate_devices():
+    def enumerate_devices(backend=None):
         "Devuelve el dato de # de dispositivos conectados"
-        devices = list(
-            map(XInputJoystick, list(range(XInputJoystick.max_devices))))
+        backend = backend or get_backend('gamepad')
+        devices = [XInputJoystick(n, backend=backend) for n in range(backend.max_devices)]
         return [d for d in devices if d.is_connected()]
 
     def set_vibration(self, left_motor, right_motor):
         "Controla la velocidad de  ambos motores independientemente"
-        # Set up function argument types and return type
-        XInputSetState = xinput.XInputSetState
-        XInputSetState.argtypes = [ctypes.c_uint, ctypes.POINTER(XINPUT_VIBRATION)]
-        XInputSetState.restype = ctypes.c_uint
-
-        vibration = XINPUT_VIBRATION(
-            int(left_motor * 65535), int(right_motor * 65535))
-        XInputSetState(self.device_number, ctypes.byref(vibration))
+        self.backend.set_vibration(self.device_number, left_motor, right_motor)
 
     def get_battery_information(self):
         "Detecta el tipo de batería y el nivel de carga"
-        BATTERY_DEVTYPE_GAMEPAD = 0x00
-        BATTERY_DEVTYPE_HEADSET = 0x01
-        XInputGetBatteryInformation = xinput.XInputGetBatteryInformation
-        XInputGetBatteryInformation.argtypes = [ctypes.c_uint, ctypes.c_ubyte, ctypes.POINTER(XINPUT_BATTERY_INFORMATION)]
-        XInputGetBatteryInformation.restype = ctypes.c_uint
-
-        battery = XINPUT_BATTERY_INFORMATION(0,0)
-        XInputGetBatteryInformation(self.device_number, BATTERY_DEVTYPE_GAMEPAD, ctypes.byref(battery))
+        battery_type, battery_level = self.backend.get_battery_information(self.device_number)
 
         #define BATTERY_TYPE_DISCONNECTED       0x00
         #define BATTERY_TYPE_WIRED              0x01
@@ -215,16 +232,39 @@ class XInputJoystick(event.EventDispatcher):
         #define BATTERY_LEVEL_LOW               0x01
         #define BATTERY_LEVEL_MEDIUM            0x02
         #define BATTERY_LEVEL_FULL              0x03
-        batt_type = "Unknown" if battery.BatteryType == 0xFF else ["Disconnected", "Wired", "Alkaline","Nimh"][battery.BatteryType]
-        level = ["Empty", "Low", "Medium", "Full"][battery.BatteryLevel]
+        batt_type = "Unknown" if battery_type == 0xFF else ["Disconnected", "Wired", "Alkaline","Nimh"][battery_type]
+        level = "Unknown" if battery_level == 0xFF else ["Empty", "Low", "Medium", "Full"][battery_level]
         return batt_type, level
 
+    def wait_events(self, timeout=None):
+        """
+        Bloquea hasta que el mando entregue un estado nuevo (o venza timeout) y
+        despacha sus eventos. Con evdev bloquea en epoll en lugar de sondear.
+        Sin mando (aun no conectado o desconectado) espera 'timeout' sin lanzar.
+        """
+        if self._last_state is None:
+            time.sleep(0.01 if timeout is None else timeout)
+        else:
+            self.backend.wait(self.device_number, self._last_state.packet_number, timeout)
+        state = self.get_state()
+        if not state:
+            self._last_state = None
+            return
+        self._dispatch_state(state)
+
     def dispatch_events(self):
         "Bucle principal de eventos de joystick"
         state = self.get_state()
         if not state:
             raise RuntimeError(
                 "Joystick %d is not connected" % self.device_number)
+        self._dispatch_state(state)
+
+    def _dispatch_state(self, state):
+        if self._last_state is None:
+            # primer estado tras conectarse el mando: es la referencia, no hay eventos que despachar
+            self._last_state = state
+            return
         if state.packet_number != self._last_state.packet_number:
             # si el estado cambia lo maneja
             self.update_packet_count(state)
@@ -248,32 +288,33 @@ class XInputJoystick(event.EventDispatcher):
 
     def dispatch_axis_events(self, state):
         # axis fields se refieren a tod0 menos los botones
-        axis_fields = dict(XINPUT_GAMEPAD._fields_)
-        axis_fields.pop('buttons')
-        for axis, type in list(axis_fields.items()):
-            old_val = getattr(self._last_state.gamepad, axis)
-            new_val = getattr(state.gamepad, axis)
-            data_size = ctypes.sizeof(type)
-            old_val = self.translate(old_val, data_size)
-            new_val = self.translate(new_val, data_size)
+        old_values = get_axis_values(self._last_state.gamepad)
+        new_values = get_axis_values(state.gamepad)
+        if old_values == new_values:
+            # solo han cambiado los botones
+            return
+        translate = self.translate
+        deadzone = self.axis_deadzone
+        for (axis, data_size, is_trigger), old_val, new_val in zip(self._axis_table, old_values, new_values):
+            if old_val == new_val:
+                continue
+            old_val = translate(old_val, data_size)
+            new_val = translate(new_val, data_size)
 
             # establece zonas muertas: minimas
             # ultimos ajustes probados 18/08/24
-            if ((old_val != new_val and (new_val > 0.08000000000000000 or new_val < -0.08000000000000000) and abs(old_val - new_val) > 0.00000000500000000) or
-               (axis == 'right_trigger' or axis == 'left_trigger') and new_val == 0 and abs(old_val - new_val) > 0.00000000500000000):
+            if abs(old_val - new_val) > AXIS_EPSILON and (
+                    new_val > deadzone or new_val < -deadzone or (is_trigger and new_val == 0)):
                 self.dispatch_event('on_axis', axis, new_val)
 
     def dispatch_button_events(self, state):
-        changed = state.gamepad.buttons ^ self._last_state.gamepad.buttons
-        changed = get_bit_values(changed, 16)
-        buttons_state = get_bit_values(state.gamepad.buttons, 16)
-        changed.reverse()
-        buttons_state.reverse()
-        button_numbers = count(1)
-        changed_buttons = list(
-            filter(itemgetter(0), list(zip(changed, button_numbers, buttons_state))))
-        tuple(starmap(self.dispatch_button_event, changed_buttons))
-
+        buttons = state.gamepad.buttons
+        changed = buttons ^ self._last_state.gamepad.buttons
+        # recorre solo los bits activos de 'changed', del LSB al MSB (boton 1 = bit 0)
+        while changed:
+            bit = changed & -changed
+            self.dispatch_button_event(1, bit.bit_length(), 1 if buttons & bit else 0)
+            changed ^= bit
 
     def dispatch_button_event(self, changed, number, pressed):
         self.dispatch_event('on_button', number, pressed)
@@ -390,50 +431,59 @@ def sample_first_joystick():
         j.set_vibration(left_speed, right_speed)
 
     while True:
-        j.dispatch_events()
-        time.sleep(.01)
+        j.wait_events(.01)
+
+
+def encode_state(gamepad, cartesian_mode, shaper=None):
+    """
+    Linea JSON (bytes) del protocolo de los servidores con el estado del mando: ejes
+    normalizados a [0, 1] / [-1, 1] y, para el flujo hacia EGM, con las curvas de 'shaper'
+    aplicadas a los seis ejes en un solo paso vectorizado.
+    """
+    values = np.multiply(get_axis_values(gamepad), AXIS_SCALE)
+    if shaper is not None:
+        values = shaper.apply(values)
+    left_trigger, right_trigger, l_thumb_x, l_thumb_y, r_thumb_x, r_thumb_y = values.tolist()
+    data = {
+        'buttons': gamepad.buttons,
+        'left_trigger': left_trigger,
+        'right_trigger': right_trigger,
+        'l_thumb_x': l_thumb_x,
+        'l_thumb_y': l_thumb_y,
+        'r_thumb_x': r_thumb_x,
+        'r_thumb_y': r_thumb_y,
+        'cartesian_mode': cartesian_mode
+    }
+    return (json.dumps(data) + '\n').encode('utf-8')
 
 
 # ///////////////////////////////////////////////////
-def run_xinput_server(address='localhost', port=5000):
+def run_xinput_server(address='localhost', port=5000, device_number=0):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # el servidor se puede reiniciar en el acto aunque queden conexiones en TIME_WAIT
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((address, port))
     server_socket.listen(1)
     print("Esperando conexion")
-    connection, client_address = server_socket.accept()
-    print("Conexion de", client_address)
 
-    joystick = XInputJoystick(0)
+    joystick = XInputJoystick(device_number)
 
+    def produce():
+        joystick.dispatch_events()  # para leer a tiempo real los eventos internos del joystick
+        # (como el cartesian_mode)
+        state = joystick.get_state()
+        return encode_state(state.gamepad, joystick.cartesian_mode) if state else None
+
+    # si el display se desconecta se vuelve a aceptar; al reconectar recibe el estado actual
     try:
-        while True:
-            joystick.dispatch_events()  # para leer a tiempo real los eventos internos del joystick
-            # (como el cartesian_mode)
-            state = joystick.get_state()
-            if state:
-                data = {
-                    'buttons': state.gamepad.buttons,
-                    'left_trigger': state.gamepad.left_trigger / 255.0,
-                    'right_trigger': state.gamepad.right_trigger / 255.0,
-                    'l_thumb_x': state.gamepad.l_thumb_x / 32767.0,
-                    'l_thumb_y': state.gamepad.l_thumb_y / 32767.0,
-                    'r_thumb_x': state.gamepad.r_thumb_x / 32767.0,
-                    'r_thumb_y': state.gamepad.r_thumb_y / 32767.0,
-                    'cartesian_mode': joystick.cartesian_mode
-                }
-                message = json.dumps(data) + '\n'
-                connection.sendall(message.encode('utf-8'))
-                # # connection.sendall(json.dumps(data).encode('utf-8'))
-                # connection.sendall(data.encode('utf-8'))
-            time.sleep(0.01)  # limita frec de envio a 100Hz
+        serve_latest(server_socket, produce, 0.01, LinkStats("Display (%d)" % port))  # limita frec de envio a 100Hz
     finally:
-        connection.close()
         server_socket.close()
 
 
 # ///////////////////////////////////////////////////
 # Servidor/cliente EGM
-def run_xinput_server_to_egm(address='localhost', port=5001):
+def run_xinput_server_to_egm(address='localhost', port=5001, device_number=0, curves=None):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -442,40 +492,66 @@ def run_xinput_server_to_egm(address='localhost', port=5001):
     server_socket.listen(1)
     print("Esperando conexion con egm_prog")
 
+    # reconexiones y cortes (tiempo sin ningun bucle EGM conectado)
+    stats = LinkStats("Bucle EGM (%d)" % port)
     while True:
         connection, client_address = server_socket.accept()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         print("Conexion de", client_address)
-        threading.Thread(target=handle_client, args=(connection,), daemon=True).start()
-
+        stats.up()
+        threading.Thread(target=handle_client, args=(connection, device_number, curves, stats), daemon=True).start()
 
-def handle_client(connection):
-    joystick = XInputJoystick(0)
 
+def handle_client(connection, device_number=0, curves=None, stats=None):
     try:
+        joystick = XInputJoystick(device_number)
+        # curvas de respuesta (zona muerta, expo, saturacion, signo) de los seis ejes en una tabla
+        shaper = stream_shaper(curves)
         while True:
             joystick.dispatch_events()  # para leer a tiempo real los eventos internos del joystick
             # (como el cartesian_mode)
             state = joystick.get_state()
             if state:
-                data = {
-                    'buttons': state.gamepad.buttons,
-                    'left_trigger': state.gamepad.left_trigger / 255.0,
-                    'right_trigger': state.gamepad.right_trigger / 255.0,
-                    'l_thumb_x': state.gamepad.l_thumb_x / 32767.0,
-                    'l_thumb_y': state.gamepad.l_thumb_y / 32767.0,
-                    'r_thumb_x': state.gamepad.r_thumb_x / 32767.0,
-                    'r_thumb_y': state.gamepad.r_thumb_y / 32767.0,
-                    'cartesian_mode': joystick.cartesian_mode
-                }
-                message = json.dumps(data) + '\n'
-                connection.sendall(message.encode('utf-8'))
+                connection.sendall(encode_state(state.gamepad, joystick.cartesian_mode, shaper))
                 # # connection.sendall(json.dumps(data).encode('utf-8'))
                 # connection.sendall(data.encode('utf-8'))
             time.sleep(0.01)  # limita frec de envio a 100Hz
+    except OSError:
+        # el bucle EGM se ha ido; el servidor sigue aceptando y el bucle se reconecta solo
+        pass
     finally:
+        # tambien si el hilo muere por otro error (p.ej. el mando se desconecta): si no,
+        # LinkStats daria el enlace por conectado para siempre
+        if stats is not None:
+            stats.down()
         connection.close()
         # server_socket.close()
 
+def run_xinput_to_shm(channel_name, device_number=0, curves=None, stop=None):
+    """
+    Etapa de lectura del mando de teleop.pipeline: escribe cada estado (ya con las curvas)
+    en el canal de memoria compartida 'channel_name' en lugar de mandarlo en JSON por TCP.
+    Espera bloqueando al mando (wait_events) y escribe al menos cada 10 ms para que el
+    watchdog del bucle EGM vea la entrada viva aunque no cambie.
+    """
+    from teleop.shm import ShmChannel, XBOX_INPUT
+
+    channel = ShmChannel.attach(channel_name, XBOX_INPUT)
+    joystick = XInputJoystick(device_number)
+    shaper = stream_shaper(curves)
+    try:
+        while stop is None or not stop.is_set():
+            joystick.wait_events(0.01)
+            state = joystick.get_state()
+            if state:
+                values = np.multiply(get_axis_values(state.gamepad), AXIS_SCALE)
+                if shaper is not None:
+                    values = shaper.apply(values)
+                channel.write([time.time(), state.gamepad.buttons] + values.tolist() +
+                              [joystick.cartesian_mode])
+    finally:
+        channel.close()
+
 # ////////////////////////////////////////////////////////
 
 if __name__ == "__main__":
@@ -486,5 +562,10 @@ if __name__ == "__main__":
     server_thread.start()
     ABB_thread.start()
 
+    # vibracion segun el estado del bucle EGM (telemetria) desde un hilo aparte (ver teleop.feedback)
+    from teleop.feedback import FeedbackChannel, RumbleOutput
+    from teleop.telemetry import TelemetrySubscriber
+    feedback = FeedbackChannel([RumbleOutput(0)], TelemetrySubscriber()).start()
+
     sample_first_joystick()
 
@@ -0,0 +1,154 @@
+"""
+Benchmark del jitter del bucle EGM con y sin el modo tiempo real (teleop.realtime).
+
+Un proceso aparte hace de robot: envia mensajes EgmRobot reales (protobuf) a
+250 Hz al puerto EGM y mide el tiempo hasta recibir la correccion (EgmSensor)
+de cada uno. El bucle de control es el de los scripts EGM: recibe, lee un
+mensaje del mando (json), calcula el incremento con el perfil xbox_joint y
+envia el comando. Para que el recolector de basura tenga trabajo real, el
+proceso mantiene un monton de objetos de larga vida y guarda un historial de
+los ultimos mensajes, como hace el registro de datos.
+
+Se compara el modo normal con RealtimeSession (gc congelado, CPU fijada,
+prioridad si se permite y espera hibrida si hay mas de un nucleo). Con
+--carga se lanza ademas un proceso que consume CPU, como un display.
+
+Uso:
+    python benchmarks/bench_egm_jitter.py [n_ciclos] [--carga]
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from abb_robot_client._egm_protobuf import egm_pb2
+from abb_robot_client.egm import EGM
+
+from teleop.mapping import load_mapping
+from teleop.realtime import RealtimeSession
+
+EGM_RATE = 250  # Hz, como el robot real
+N_CYCLES = 5000
+HEAP_OBJECTS = 300000
+
+STATE_LINE = json.dumps({'l_thumb_x': 0.31, 'l_thumb_y': -0.12, 'r_thumb_x': 0.0, 'r_thumb_y': 0.05,
+                         'left_trigger': 0.0, 'right_trigger': 0.4, 'buttons': 0x1000, 't': 0.0})
+
+
+def robot_process(port, n, connection):
+    """Robot simulado: envia EgmRobot a EGM_RATE Hz y mide cuanto tarda cada respuesta"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0 / EGM_RATE)
+    message = egm_pb2.EgmRobot()
+    message.header.mtype = egm_pb2.EgmHeader.MSGTYPE_DATA
+    message.feedBack.joints.joints.extend([0.0] * 6)
+    pos, orient = message.feedBack.cartesian.pos, message.feedBack.cartesian.orient
+    pos.x, pos.y, pos.z = 400.0, 0.0, 600.0
+    orient.u0, orient.u1, orient.u2, orient.u3 = 1.0, 0.0, 0.0, 0.0
+    message.motorState.state = egm_pb2.EgmMotorState.MOTORS_ON
+    message.rapidExecState.state = egm_pb2.EgmRapidCtrlExecState.RAPID_RUNNING
+    period = 1.0 / EGM_RATE
+    rtt = np.full(n, np.nan)
+    start = time.perf_counter() + 0.2
+    for i in range(n):
+        delay = start + i * period - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        message.header.seqno = i
+        t_send = time.perf_counter()
+        sock.sendto(message.SerializeToString(), ('127.0.0.1', port))
+        try:
+            sock.recv(65536)
+            rtt[i] = time.perf_counter() - t_send
+        except socket.timeout:
+            pass  # respuesta perdida o fuera de ciclo
+        # descartar respuestas atrasadas para no asignarlas al ciclo siguiente
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(65536)
+        except BlockingIOError:
+            pass
+        sock.settimeout(period)
+    connection.send(rtt)
+    sock.close()
+
+
+def load_process():
+    """Carga de CPU (un display redibujando sin parar)"""
+    x = 0
+    while True:
+        x = (x * 31 + 7) % 1000003
+
+
+def run(session, port, n):
+    """Bucle de control tipo egm_joint_target; devuelve los tiempos de respuesta medidos por el robot"""
+    mapping = load_mapping('xbox_joint')
+    history = deque(maxlen=20000)
+    robax = np.zeros(6)
+    egm = session.wrap(EGM(port=port))
+    parent, child = multiprocessing.Pipe()
+    robot = multiprocessing.Process(target=robot_process, args=(port, n, child), daemon=True)
+    robot.start()
+    session.start()
+    try:
+        received = 0
+        while received < n and robot.is_alive():
+            res, feedback = egm.receive_from_robot(timeout=0.5)
+            if not res:
+                continue
+            received += 1
+            state = json.loads(STATE_LINE)
+            history.append(state)
+            axes, buttons = mapping.read(state)
+            robax = mapping.clip(robax + mapping.delta(axes, buttons, 0.5) * 1e-3)
+            egm.send_to_robot(robax)
+    finally:
+        session.stop()
+    if not parent.poll(5.0):
+        raise RuntimeError("El robot simulado ha terminado sin resultados")
+    rtt = parent.recv()
+    robot.join()
+    egm.socket.close()
+    return rtt
+
+
+def report(name, rtt):
+    ok = rtt[~np.isnan(rtt)] * 1e6
+    p50, p99, p999 = np.percentile(ok, (50, 99, 99.9))
+    print("%-12s p50 %7.1f us  p99 %7.1f us  p99.9 %8.1f us  max %8.1f us  perdidas %d" % (
+        name, p50, p99, p999, ok.max(), len(rtt) - len(ok)))
+    return p99, p999
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    n = int(args[0]) if args else N_CYCLES
+    cpu = sorted(os.sched_getaffinity(0))[-1] if hasattr(os, 'sched_getaffinity') else 0
+
+    # monton de objetos de larga vida (configuracion, registros, caches...)
+    heap = [{'i': i, 'v': [i, str(i)]} for i in range(HEAP_OBJECTS)]
+
+    load = None
+    if '--carga' in sys.argv:
+        load = multiprocessing.Process(target=load_process, daemon=True)
+        load.start()
+
+    print("%d ciclos a %d Hz, %d objetos en el heap, %d CPU%s" % (
+        n, EGM_RATE, len(heap), os.cpu_count() or 1, ", con carga" if load else ""))
+    normal = report("normal", run(RealtimeSession(enabled=False), 6520, n))
+    session = RealtimeSession(cpu=cpu)
+    realtime = report("tiempo real", run(session, 6521, n))
+    print("ajustes: %s" % ", ".join("%s=%s" % item for item in session.report.items()))
+    print("p99 x%.2f, p99.9 x%.2f" % (normal[0] / realtime[0], normal[1] / realtime[1]))
+    if load is not None:
+        load.terminate()
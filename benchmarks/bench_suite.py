@@ -0,0 +1,504 @@
+"""
+Suite de micro-benchmarks de los caminos calientes, con lineas base guardadas.
+
+Cada benchmark mide el coste por llamada de una operacion del camino
+mando -> servidor -> bucle EGM -> display con datos sinteticos (sin hardware,
+con el backend sintetico y SDL_VIDEODRIVER=dummy). El tiempo de cada uno es
+la mediana de varias rondas, y cada ronda el minimo de varias repeticiones: el
+minimo quita las interrupciones del planificador dentro de una ronda y la
+mediana las rondas enteras que caen en un momento de carga de la maquina. Las
+rondas de todos los benchmarks se intercalan para que esa carga no se la lleven
+solo los que se estuvieran midiendo en ese momento.
+
+Sin opciones compara con benchmarks/baselines.json y termina con codigo 1 si
+algun benchmark es mas lento que su linea base en mas de --threshold por
+ciento (25 % por defecto, o el umbral propio que tenga guardado). Las lineas
+base dependen de la maquina: se regeneran con --save en la maquina de
+referencia.
+
+Con --imports se miden tambien los tiempos de arranque: lo que tarda
+'import <modulo>' de cada punto de entrada en un interprete nuevo
+(-X importtime, tiempo acumulado del modulo), en frio (sin cache de
+bytecode: todo se compila, como tras instalar) y en caliente (cache ya
+generada). Son los benchmarks import.<modulo>.cold / .warm.
+
+Uso:
+    python benchmarks/bench_suite.py [--save] [--threshold 25] [--filter texto] [--list] [--imports]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'Xbox'))
+sys.path.insert(0, os.path.join(ROOT, 'Spacenavigator'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+
+from teleop.backends import set_backend
+from teleop.backends.synthetic import SyntheticGamepadBackend
+
+BASELINES = os.path.join(ROOT, 'benchmarks', 'baselines.json')
+THRESHOLD = 25.0  # % de empeoramiento permitido
+ROUNDS = 5
+REPEAT = 5  # repeticiones por ronda
+RETRIES = 2  # nuevas medidas de un benchmark que parece haber empeorado
+SAVE_PASSES = 3  # con --save se guarda la mediana de varias pasadas completas
+TARGET_TIME = 0.04  # s por repeticion
+IMPORT_REPEAT = 3
+# puntos de entrada cuyo arranque se vigila
+IMPORT_MODULES = ('egm_interface_Xbox', 'egm_s_nav', 'xinput', 'space_navigator', 'teleop.pipeline',
+                  'teleop.daemon')
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Registra una funcion que prepara el benchmark y devuelve la operacion a medir"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+# ///////////////////////////////////////////////
+# SpaceNavigator
+def spacenav_reports():
+    """Reports HID alternando traslacion (canal 1), rotacion (2) y botones (3)"""
+    reports = []
+    for i in range(300):
+        value = int(350 * np.sin(i / 30.0)) & 0xFFFF
+        lo, hi = value & 0xFF, value >> 8
+        channel = (1, 2, 3)[i % 3]
+        reports.append([channel, lo, hi, hi, lo, lo, hi] if channel != 3 else [3, i & 0x3, 0, 0, 0, 0, 0])
+    return reports
+
+
+@benchmark('spacenav.process')
+def bench_spacenav_process():
+    import space_navigator
+    spec = space_navigator.device_specs['SpaceNavigator']
+    reports = spacenav_reports()
+    state = {'i': 0}
+
+    def run():
+        i = state['i'] = (state['i'] + 1) % len(reports)
+        spec.process(reports[i])
+    return run
+
+
+@benchmark('spacenav.to_int16')
+def bench_to_int16():
+    from space_navigator import to_int16
+    return lambda: to_int16(0x5E, 0xFE)
+
+
+@benchmark('spacenav.encode_state')
+def bench_spacenav_encode():
+    import space_navigator
+    spec = space_navigator.device_specs['SpaceNavigator']
+    for report in spacenav_reports()[:3]:
+        spec.process(report)
+    state = spec.tuple_state
+    return lambda: space_navigator.encode_state(state)
+
+
+# ///////////////////////////////////////////////
+# mando Xbox
+def gamepad_states():
+    from bench_xinput_dispatch import recorded_session
+    return recorded_session(2000)
+
+
+@benchmark('xinput.dispatch_events')
+def bench_dispatch():
+    backend = SyntheticGamepadBackend()
+    set_backend('gamepad', backend)
+    import xinput
+    backend.load(0, gamepad_states())
+    joystick = xinput.XInputJoystick(0)
+    joystick.push_handlers(on_axis=lambda axis, value: None, on_button=lambda button, pressed: None)
+    return joystick.dispatch_events
+
+
+@benchmark('xinput.encode_state')
+def bench_xinput_encode():
+    import xinput
+    from teleop.shaping import ResponseShaper
+    shaper = ResponseShaper(xinput.FINE_AXIS_CURVES)
+    gamepad = gamepad_states()[123].gamepad
+    return lambda: xinput.encode_state(gamepad, True, shaper)
+
+
+# ///////////////////////////////////////////////
+# cliente: troceo de lineas y decodificacion
+class ChunkSocket(object):
+    """Socket falso: cada poll recibe un bloque con tres mensajes y despues nada"""
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.pending = False
+
+    def setblocking(self, flag):
+        pass
+
+    def recv(self, bufsize):
+        self.pending = not self.pending
+        if self.pending:
+            return self.chunk
+        raise BlockingIOError
+
+
+@benchmark('client.latest_line')
+def bench_latest_line():
+    import xinput
+    from teleop.stream import LatestLineReader
+    states = gamepad_states()
+    chunk = b"".join(xinput.encode_state(states[i].gamepad, True) for i in range(3))
+    return LatestLineReader(ChunkSocket(chunk)).poll
+
+
+@benchmark('client.shm_poll')
+def bench_shm_poll():
+    from teleop.shm import XBOX_INPUT, ShmChannel
+    name = 'bench_%d' % os.getpid()
+    writer = ShmChannel.create(name, XBOX_INPUT)
+    reader = ShmChannel.attach(name, XBOX_INPUT)
+    row = [0.0, 4096, 0.0, 0.5, 0.1, -0.2, 0.3, 0.0, 1]
+
+    def run():
+        writer.write(row)
+        reader.poll()
+    run.close = lambda: (reader.close(), writer.close())
+    return run
+
+
+# ///////////////////////////////////////////////
+# bucle EGM: calculo de un ciclo (mismo calculo que egm_joint_target / egm_pose_target)
+def input_messages(n=64):
+    """Mensajes del servidor del mando ya decodificados"""
+    import xinput
+    return [json.loads(xinput.encode_state(state.gamepad, True)) for state in gamepad_states()[:n]]
+
+
+@benchmark('egm.joint_update')
+def bench_joint_update():
+    from teleop.mapping import load_mapping
+    mapping = load_mapping('xbox_joint')
+    messages = input_messages()
+    context = {'i': 0, 'robax': np.zeros(6)}
+
+    def run():
+        i = context['i'] = (context['i'] + 1) % len(messages)
+        axes, buttons = mapping.read(messages[i])
+        mapping.events(buttons)
+        context['robax'] = mapping.clip(context['robax'] + mapping.delta(axes, buttons, 0.5))
+    return run
+
+
+@benchmark('egm.pose_update')
+def bench_pose_update():
+    from teleop.mapping import load_mapping
+    mapping = load_mapping('xbox_pose')
+    messages = input_messages()
+    trans, rot = [400.0, 100.0, 600.0], [-0.7071068, 0.0, -0.7071068, 0.0]
+    context = {'i': 0, 'target': np.array(trans + rot[:3])}
+
+    def run():
+        i = context['i'] = (context['i'] + 1) % len(messages)
+        axes, buttons = mapping.read(messages[i])
+        mapping.events(buttons)
+        target = context['target'] = mapping.clip(context['target'] + mapping.delta(axes, buttons, 0.01))
+        trans[0], trans[1], trans[2] = target[:3].tolist()
+        # cuaternion: Q1-Q3 del objetivo y Q4 recalculado para mantenerlo unitario
+        q1, q2, q3 = target[3:].tolist()
+        if q1 ** 2 + q2 ** 2 + q3 ** 2 <= 1.0:
+            q4 = np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))
+        else:
+            q4 = rot[3]
+        rot[0], rot[1], rot[2], rot[3] = q1, q2, q3, q4
+    return run
+
+
+@benchmark('egm.ik_step')
+def bench_ik_step():
+    from teleop.kinematics import CartesianJog, DLSSolver, Kinematics
+    jog = CartesianJog(DLSSolver(Kinematics()), [10.0, 20.0, -10.0, 30.0, 40.0, 50.0])
+    # ida y vuelta para no llegar a los limites del espacio de trabajo
+    deltas = [np.array([0.3, 0.2, -0.1, 0.02, 0.0, 0.01]) * sign for sign in (1.0, -1.0)]
+    context = {'i': 0}
+
+    def run():
+        context['i'] += 1
+        jog.update(deltas[(context['i'] // 500) % 2])
+    return run
+
+
+@benchmark('egm.singularity_scale')
+def bench_singularity_scale():
+    import tempfile
+    from teleop.manipulability import ManipulabilityMap, build_map
+    directory = tempfile.mkdtemp()
+    singularity = ManipulabilityMap(build_map(spacing=40.0, path=os.path.join(directory, 'map.npy')))
+    targets = [np.array([400.0, 100.0, 600.0]) + np.array([3.0, -2.0, 1.5]) * i for i in range(64)]
+    context = {'i': 0}
+
+    def run():
+        i = context['i'] = (context['i'] + 1) % (len(targets) - 1)
+        singularity.speed_scale(targets[i], targets[i + 1])
+    run.close = lambda: shutil.rmtree(directory, ignore_errors=True)
+    return run
+
+
+@benchmark('egm.frame_apply')
+def bench_frame_apply():
+    from teleop.frames import JogFrames
+    frames = JogFrames(('tool',))
+    rot = [0.7071068, 0.0, 0.7071068, 0.0]
+    delta = np.array([1.0, 0.5, -0.2, 0.0, 0.0, 0.0])
+    # orientacion constante: la matriz del marco sale de la cache
+    return lambda: frames.apply(delta, rot)
+
+
+@benchmark('egm.shaper_apply')
+def bench_shaper():
+    import xinput
+    from teleop.shaping import ResponseShaper
+    shaper = ResponseShaper(xinput.FINE_AXIS_CURVES)
+    values = (0.1, 0.9, 0.5, -0.3, 0.05, -0.95)
+    return lambda: shaper.apply(values)
+
+
+# ///////////////////////////////////////////////
+# logs
+@benchmark('log.open_slice')
+def bench_log_slice():
+    import tempfile
+    from teleop.log_stream import LogFile, write_header
+    directory = tempfile.mkdtemp(prefix='bench_log_')
+    path = os.path.join(directory, 'log.bin')
+    # una hora de log a 250 Hz (29 MB): abrir y cortar 1 s no depende del tamano
+    timestamp = '2024-01-01-00-00-00-0000'
+    rows = 3600 * 250
+    with open(path, 'wb') as f:
+        write_header(f, timestamp, "timestamp,cmdnum,J1,J2,J3,J4,J5,J6")
+        data = np.zeros((rows, 8), dtype=np.float32)
+        data[:, 0] = np.arange(rows) / 250.0
+        f.write(data.tobytes())
+
+    def run():
+        window = LogFile(path).time_slice(1800.0, 1801.0)
+        return window['J1'].sum()
+    run.close = lambda: shutil.rmtree(directory)
+    return run
+
+
+# ///////////////////////////////////////////////
+# display
+@benchmark('display.xbox_frame')
+def bench_display():
+    import pygame
+    import x_controller_display as display
+    from teleop.display import dirty_rects
+    screen = display.setup_display()
+    messages = input_messages()
+    context = {'i': 0, 'elements': None}
+
+    def run():
+        i = context['i'] = (context['i'] + 1) % len(messages)
+        elements = display.update_display(screen, messages[i])
+        dirty_rects(screen, elements, context['elements'])
+        context['elements'] = elements
+    run.close = pygame.quit
+    return run
+
+
+# ///////////////////////////////////////////////
+# arranque
+def import_time(module, cache):
+    """Tiempo acumulado (s) de 'import module' en un interprete nuevo con la cache de bytecode en 'cache'"""
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache, PYTHONPATH=os.pathsep.join(
+        [ROOT, os.path.join(ROOT, 'Xbox'), os.path.join(ROOT, 'Spacenavigator')]))
+    # la medida en caliente necesita que se escriba la cache
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError("import %s ha fallado:\n%s" % (module, result.stderr[-2000:]))
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) * 1e-6
+    raise RuntimeError("-X importtime no informa de %s" % module)
+
+
+def import_benchmark(module, cold):
+    def setup():
+        directory = tempfile.mkdtemp(prefix='bench_import_')
+
+        def run():
+            if cold:
+                # cache nueva en cada medida: se compila todo lo que importa el modulo
+                times = [import_time(module, os.path.join(directory, str(i))) for i in range(IMPORT_REPEAT)]
+            else:
+                import_time(module, directory)
+                times = [import_time(module, directory) for _ in range(IMPORT_REPEAT)]
+            return min(times)
+        operation = lambda: None
+        operation.measure = run
+        operation.close = lambda: shutil.rmtree(directory, ignore_errors=True)
+        return operation
+    return setup
+
+
+for _module in IMPORT_MODULES:
+    BENCHMARKS['import.%s.cold' % _module] = import_benchmark(_module, True)
+    BENCHMARKS['import.%s.warm' % _module] = import_benchmark(_module, False)
+
+
+# ///////////////////////////////////////////////
+def calibrate(operation, target=TARGET_TIME):
+    """Llamadas a 'operation' que tardan unos 'target' segundos"""
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            operation()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= target / 10.0:
+            break
+        loops *= 10
+    return max(1, int(loops * target / elapsed))
+
+
+def best_of(operation, loops, repeat=REPEAT):
+    """Tiempo por llamada (s): minimo de 'repeat' repeticiones de 'loops' llamadas"""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            operation()
+        best = min(best, (time.perf_counter() - t0) / loops)
+    return best
+
+
+def measure_all(operations, rounds=ROUNDS, repeat=REPEAT, target=TARGET_TIME):
+    """
+    Tiempo por llamada (s) de cada operacion de {nombre: operacion}: mediana de 'rounds'
+    rondas, cada una el minimo de 'repeat' repeticiones de unos 'target' segundos. Las
+    rondas se intercalan entre operaciones: un rato de carga de la maquina cae repartido
+    entre todas en vez de en las pocas que se estuvieran midiendo en ese momento.
+    """
+    loops = {name: calibrate(operation, target) for name, operation in operations.items()}
+    minimums = {name: [] for name in operations}
+    for _ in range(rounds):
+        for name, operation in operations.items():
+            minimums[name].append(best_of(operation, loops[name], repeat))
+    return {name: float(np.median(values)) for name, values in minimums.items()}
+
+
+def measure(operation, rounds=ROUNDS, repeat=REPEAT, target=TARGET_TIME):
+    """Tiempo por llamada (s) de una sola operacion, como en measure_all"""
+    return measure_all({None: operation}, rounds, repeat, target)[None]
+
+
+def machine():
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'processor': platform.processor() or platform.machine()}
+
+
+def load_baselines():
+    if not os.path.isfile(BASELINES):
+        return None
+    with open(BASELINES) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de los caminos calientes")
+    parser.add_argument('--save', action='store_true', help="guarda los resultados como lineas base")
+    parser.add_argument('--threshold', type=float, help="empeoramiento permitido en %%%% (por defecto %g, o el umbral propio de las lineas base)" % THRESHOLD)
+    parser.add_argument('--filter', default='', help="solo los benchmarks cuyo nombre contenga este texto")
+    parser.add_argument('--list', action='store_true', help="lista los benchmarks y termina")
+    parser.add_argument('--imports', action='store_true', help="incluye los tiempos de importacion (import.*)")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(sorted(BENCHMARKS)))
+        sys.exit(0)
+
+    baselines = load_baselines()
+    if baselines and not args.save and baselines.get('machine', {}).get('platform') != machine()['platform']:
+        print("Aviso: las lineas base son de otra maquina (%s)" % baselines['machine'].get('platform'))
+
+    names = [name for name in sorted(BENCHMARKS) if args.filter in name and
+             # los de arranque lanzan interpretes nuevos (segundos): solo con --imports o pedidos por nombre
+             (not name.startswith('import.') or args.imports or args.filter.startswith('import'))]
+    operations = {}
+    results = {}
+    failed = []
+    try:
+        for name in names:
+            operations[name] = BENCHMARKS[name]()
+        # los que traen su propia medida (import.*) van aparte, el resto por rondas intercaladas;
+        # una linea base sale de varias pasadas para no quedarse con un rato rapido o lento de la maquina
+        passes = []
+        for _ in range(SAVE_PASSES if args.save else 1):
+            measured = measure_all({name: operation for name, operation in operations.items()
+                                    if not hasattr(operation, 'measure')})
+            for name, operation in operations.items():
+                if hasattr(operation, 'measure'):
+                    measured[name] = operation.measure()
+            passes.append(measured)
+        results = {name: float(np.median([measured[name] for measured in passes])) for name in names}
+
+        print("%-32s %12s %12s %9s" % ('benchmark', 'actual', 'base', 'cambio'))
+        for name in names:
+            base = (baselines or {}).get('results', {}).get(name)
+            threshold = args.threshold if args.threshold is not None else \
+                (baselines or {}).get('thresholds', {}).get(name, (baselines or {}).get('threshold', THRESHOLD))
+            operation = operations[name]
+            run = getattr(operation, 'measure', None) or (lambda: measure(operation))
+            seconds = results[name]
+            # una regresion aparente se vuelve a medir antes de darla por buena (ruido del sistema)
+            for _ in range(RETRIES):
+                if args.save or base is None or seconds <= base['seconds'] * (1.0 + threshold / 100.0):
+                    break
+                seconds = min(seconds, run())
+            results[name] = seconds
+            if base is None or args.save:
+                print("%-32s %9.3f us %12s %9s" % (name, seconds * 1e6, '-', ''))
+                continue
+            change = 100.0 * (seconds / base['seconds'] - 1.0)
+            status = 'REGRESION' if change > threshold else ''
+            if status:
+                failed.append(name)
+            print("%-32s %9.3f us %9.3f us %+8.1f%% %s" % (name, seconds * 1e6, base['seconds'] * 1e6, change, status))
+    finally:
+        for operation in operations.values():
+            if hasattr(operation, 'close'):
+                operation.close()
+
+    if args.save:
+        saved = baselines or {'threshold': THRESHOLD, 'thresholds': {}, 'results': {}}
+        saved['machine'] = machine()
+        saved['results'].update({name: {'seconds': seconds, 'date': time.strftime('%Y-%m-%d')}
+                                 for name, seconds in results.items()})
+        with open(BASELINES, 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("\nLineas base guardadas en %s" % BASELINES)
+    elif failed:
+        print("\n%d benchmark(s) por encima del umbral: %s" % (len(failed), ", ".join(failed)))
+        sys.exit(1)
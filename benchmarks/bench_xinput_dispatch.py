@@ -0,0 +1,128 @@
+"""
+Benchmark del despacho de eventos de XInputJoystick a 1 kHz.
+
+Usa el backend sintetico de teleop.backends, que reproduce una secuencia
+grabada de estados del mando (barridos de palancas, gatillos y pulsaciones de
+botones), de modo que se puede ejecutar en cualquier plataforma.
+Compara el despacho actual con la implementacion anterior (dict de campos,
+ctypes.sizeof y get_bit_values en cada muestreo) y muestra el coste por
+muestreo frente al presupuesto de 1 ms de un bucle a 1 kHz.
+
+Uso:
+    python benchmarks/bench_xinput_dispatch.py [n_muestras]
+"""
+
+import ctypes
+import math
+import os
+import sys
+import time
+from itertools import count, starmap
+from operator import itemgetter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'Xbox'))
+
+from teleop.backends import XINPUT_STATE, set_backend
+from teleop.backends.synthetic import SyntheticGamepadBackend
+
+POLL_RATE = 1000  # Hz
+N_SAMPLES = 20000
+
+
+def recorded_session(n):
+    """Genera n XINPUT_STATE: palancas en barrido, gatillos y botones cambiando a menor ritmo"""
+    states = []
+    for i in range(n):
+        t = i / float(POLL_RATE)
+        buttons = 0
+        if (i // 250) % 2:
+            buttons |= 0x1000  # A
+        if (i // 400) % 2:
+            buttons |= 0x0001 | 0x0100  # PAD_UP + LB
+        state = XINPUT_STATE()
+        # el mando solo incrementa packet_number cuando cambia el estado
+        state.packet_number = i // 2 + 1
+        gamepad = state.gamepad
+        gamepad.buttons = buttons
+        gamepad.left_trigger = int(255 * abs(math.sin(t)))
+        gamepad.right_trigger = int(255 * abs(math.cos(t)))
+        gamepad.l_thumb_x = int(32767 * math.sin(2 * t))
+        gamepad.l_thumb_y = int(32767 * math.cos(2 * t))
+        gamepad.r_thumb_x = int(16000 * math.sin(t))
+        states.append(state)
+    return states
+
+
+def make_legacy_class(xinput):
+    """Reconstruye la implementacion anterior del despacho como referencia"""
+
+    class LegacyXInputJoystick(xinput.XInputJoystick):
+        def dispatch_axis_events(self, state):
+            axis_fields = dict(xinput.XINPUT_GAMEPAD._fields_)
+            axis_fields.pop('buttons')
+            for axis, type in list(axis_fields.items()):
+                old_val = getattr(self._last_state.gamepad, axis)
+                new_val = getattr(state.gamepad, axis)
+                data_size = ctypes.sizeof(type)
+                old_val = self.translate(old_val, data_size)
+                new_val = self.translate(new_val, data_size)
+                if ((old_val != new_val and (new_val > 0.08 or new_val < -0.08) and abs(old_val - new_val) > 0.000000005) or
+                        (axis == 'right_trigger' or axis == 'left_trigger') and new_val == 0 and abs(old_val - new_val) > 0.000000005):
+                    self.dispatch_event('on_axis', axis, new_val)
+
+        def dispatch_button_events(self, state):
+            changed = state.gamepad.buttons ^ self._last_state.gamepad.buttons
+            changed = xinput.get_bit_values(changed, 16)
+            buttons_state = xinput.get_bit_values(state.gamepad.buttons, 16)
+            changed.reverse()
+            buttons_state.reverse()
+            button_numbers = count(1)
+            changed_buttons = list(
+                filter(itemgetter(0), list(zip(changed, button_numbers, buttons_state))))
+            tuple(starmap(self.dispatch_button_event, changed_buttons))
+
+    return LegacyXInputJoystick
+
+
+def run(joystick_class, backend, states, n):
+    backend.load(0, states)
+    events = []
+    j = joystick_class(0)
+    j.push_handlers(on_axis=lambda axis, value: events.append((axis, value)),
+                    on_button=lambda button, pressed: events.append((button, pressed)))
+    timings = []
+    perf_counter = time.perf_counter
+    for _ in range(n):
+        t0 = perf_counter()
+        j.dispatch_events()
+        timings.append(perf_counter() - t0)
+    return timings, events
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    mean = sum(timings) / len(timings)
+    p99 = timings[int(0.99 * (len(timings) - 1))]
+    budget = 1.0 / POLL_RATE
+    print("%-8s media %7.2f us  p99 %7.2f us  max %8.2f us  -> %5.2f %% del ciclo de %d Hz" % (
+        name, mean * 1e6, p99 * 1e6, timings[-1] * 1e6, 100.0 * mean / budget, POLL_RATE))
+    return mean
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else N_SAMPLES
+    states = recorded_session(n + 1)
+    backend = SyntheticGamepadBackend()
+    set_backend('gamepad', backend)
+    import xinput
+
+    legacy_timings, legacy_events = run(make_legacy_class(xinput), backend, states, n)
+    timings, events = run(xinput.XInputJoystick, backend, states, n)
+    assert events == legacy_events, "los eventos despachados no coinciden con la implementacion anterior"
+
+    print("%d muestreos, %d eventos despachados" % (n, len(events)))
+    legacy_mean = report('anterior', legacy_timings)
+    mean = report('actual', timings)
+    print("aceleracion x%.2f" % (legacy_mean / mean))
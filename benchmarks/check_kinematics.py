@@ -0,0 +1,105 @@
+"""
+Comprobacion numerica de la cinematica (teleop.kinematics) y de la inversa
+analitica del mapa de manipulabilidad (teleop.manipulability).
+
+Los benchmarks miden lo que tarda un paso de IK, pero no si el resultado es
+correcto. Este script lo comprueba con configuraciones aleatorias dentro de
+los limites articulares (semilla fija), lejos de la singularidad de muñeca:
+
+    jacobiano     cada columna de Kinematics.forward_jacobian frente a
+                  diferencias centradas de forward (posicion en mm/rad y
+                  vector de rotacion en rad/rad)
+    ida y vuelta  forward -> inverse_kinematics -> forward devuelve la misma
+                  pose (posicion en mm y matriz de rotacion)
+
+Termina con codigo 1 si algun error pasa de su tolerancia.
+
+Uso:
+    python benchmarks/check_kinematics.py [--samples 500] [--seed 0] [--geometry IRB1200_7_70]
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from teleop.kinematics import GEOMETRIES, JOINT_LIMITS, Kinematics, rotation_vector
+from teleop.manipulability import inverse_kinematics
+
+STEP = 1e-3  # rad, paso de las diferencias centradas
+# el error de truncamiento de las diferencias con STEP es del orden de 1e-4
+JACOBIAN_TOLERANCE = 1e-3
+ROUND_TRIP_TOLERANCE = 1e-9
+WRIST_MARGIN = 5.0  # grados de J5 alrededor de 0 que se evitan
+
+
+def random_joints(samples, seed=0):
+    """Articulaciones (samples, 6) en grados dentro de los limites y con |J5| >= WRIST_MARGIN"""
+    rng = np.random.default_rng(seed)
+    joints = rng.uniform(JOINT_LIMITS[:, 0], JOINT_LIMITS[:, 1], (samples, 6))
+    joints[:, 4] = np.where(np.abs(joints[:, 4]) < WRIST_MARGIN, np.copysign(WRIST_MARGIN, joints[:, 4]),
+                            joints[:, 4])
+    return joints
+
+
+def jacobian_error(kinematics, joints, step=STEP):
+    """Maximo error absoluto entre el jacobiano analitico y el de diferencias centradas"""
+    jacobian = kinematics.jacobian(joints)
+    error = 0.0
+    for i in range(6):
+        delta = np.zeros(6)
+        delta[i] = np.degrees(step)
+        pos_plus, rot_plus = kinematics.forward(joints + delta)
+        pos_minus, rot_minus = kinematics.forward(joints - delta)
+        linear = (pos_plus - pos_minus) / (2.0 * step)
+        angular = np.array([rotation_vector(plus.dot(minus.T)) for plus, minus in zip(rot_plus, rot_minus)]) / \
+            (2.0 * step)
+        error = max(error, np.max(np.abs(linear - jacobian[:, :3, i])),
+                    np.max(np.abs(angular - jacobian[:, 3:, i])))
+    return error
+
+
+def round_trip_error(kinematics, joints):
+    """
+    Maximo error de posicion (mm) y de rotacion de forward(inverse_kinematics(forward(q)))
+    y numero de poses que la inversa da por alcanzables (solo esas cuentan)
+    """
+    pos, rot = kinematics.forward(joints)
+    solution, reachable = inverse_kinematics(kinematics, pos, rot)
+    if not reachable.any():
+        return np.inf, np.inf, 0
+    pos_back, rot_back = kinematics.forward(solution[reachable])
+    return (np.max(np.abs(pos_back - pos[reachable])), np.max(np.abs(rot_back - rot[reachable])),
+            int(reachable.sum()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comprueba el jacobiano y la cinematica inversa analitica")
+    parser.add_argument('--samples', type=int, default=500, help="configuraciones aleatorias por geometria")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--geometry', choices=sorted(GEOMETRIES), action='append',
+                        help="geometria a comprobar (por defecto todas)")
+    args = parser.parse_args()
+
+    failed = []
+    joints = random_joints(args.samples, args.seed)
+    print("%-14s %14s %14s %14s %12s" % ('geometria', 'jacobiano', 'ida/vuelta mm', 'ida/vuelta rot', 'alcanzables'))
+    for geometry in args.geometry or sorted(GEOMETRIES):
+        kinematics = Kinematics(geometry)
+        jacobian = jacobian_error(kinematics, joints)
+        pos_error, rot_error, reachable = round_trip_error(kinematics, joints)
+        print("%-14s %14.3g %14.3g %14.3g %7d/%d" % (geometry, jacobian, pos_error, rot_error,
+                                                      reachable, len(joints)))
+        if jacobian > JACOBIAN_TOLERANCE:
+            failed.append("%s: jacobiano %.3g > %g" % (geometry, jacobian, JACOBIAN_TOLERANCE))
+        if max(pos_error, rot_error) > ROUND_TRIP_TOLERANCE:
+            failed.append("%s: ida y vuelta %.3g > %g" % (geometry, max(pos_error, rot_error), ROUND_TRIP_TOLERANCE))
+
+    if failed:
+        print("\n" + "\n".join(failed))
+        sys.exit(1)
+    print("\nCinematica correcta")
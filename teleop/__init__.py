@@ -0,0 +1,6 @@
+"""
+Utilidades compartidas por los modulos de teleoperacion (Xbox y Spacenavigator).
+
+Los scripts de cada carpeta se ejecutan directamente, por lo que añaden la raiz
+del repositorio a sys.path antes de importar este paquete.
+"""
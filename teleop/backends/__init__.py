@@ -0,0 +1,96 @@
+"""
+Registro de backends de entrada con carga diferida.
+
+Cada implementacion se importa solo cuando se pide por primera vez, asi que
+importar xinput.py o space_navigator.py no carga xinput1_4, pywinusb ni los
+modulos de Linux. El backend por defecto depende de la plataforma y se puede
+forzar con las variables de entorno TELEOP_GAMEPAD_BACKEND y TELEOP_HID_BACKEND.
+
+Example:
+    backend = get_backend('gamepad')              # xinput en Windows, evdev en Linux
+    set_backend('gamepad', SyntheticGamepadBackend())  # para pruebas/benchmarks
+"""
+
+import importlib
+import os
+import sys
+import threading
+
+from .base import (
+    XINPUT_GAMEPAD,
+    XINPUT_STATE,
+    XINPUT_VIBRATION,
+    XINPUT_BATTERY_INFORMATION,
+    ERROR_DEVICE_NOT_CONNECTED,
+    ERROR_SUCCESS,
+    GamepadBackend,
+    HidBackend,
+    HidDevice,
+    get_full_usage_id,
+)
+
+# tipo de backend -> nombre -> "modulo:clase"
+BACKENDS = {
+    'gamepad': {
+        'xinput': 'teleop.backends.windows:XInputBackend',
+        'evdev': 'teleop.backends.linux:EvdevGamepadBackend',
+        'synthetic': 'teleop.backends.synthetic:SyntheticGamepadBackend',
+    },
+    'hid': {
+        'pywinusb': 'teleop.backends.windows:PyWinUsbBackend',
+        'hidraw': 'teleop.backends.linux:HidrawBackend',
+        'synthetic': 'teleop.backends.synthetic:SyntheticHidBackend',
+    },
+}
+
+DEFAULT_BACKENDS = {
+    'win32': {'gamepad': 'xinput', 'hid': 'pywinusb'},
+    'linux': {'gamepad': 'evdev', 'hid': 'hidraw'},
+}
+
+_instances = {}
+_selected = {}
+_lock = threading.Lock()
+
+
+def default_backend_name(kind):
+    """Nombre del backend por defecto para 'kind' en esta plataforma"""
+    name = _selected.get(kind) or os.environ.get('TELEOP_%s_BACKEND' % kind.upper())
+    if name:
+        return name
+    platform = 'linux' if sys.platform.startswith('linux') else sys.platform
+    try:
+        return DEFAULT_BACKENDS[platform][kind]
+    except KeyError:
+        raise RuntimeError("No hay backend '%s' por defecto para la plataforma %s" % (kind, sys.platform))
+
+
+def load_backend_class(kind, name):
+    """Importa (solo ahora) el modulo del backend y devuelve su clase"""
+    try:
+        target = BACKENDS[kind][name]
+    except KeyError:
+        raise ValueError("Backend desconocido %s/%s; disponibles: %s" % (
+            kind, name, ", ".join(BACKENDS.get(kind, {}))))
+    module_name, class_name = target.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_backend(kind, name=None):
+    """Devuelve la instancia compartida del backend 'kind' ('gamepad' o 'hid')"""
+    if name is None:
+        name = default_backend_name(kind)
+    key = (kind, name)
+    with _lock:
+        backend = _instances.get(key)
+        if backend is None:
+            backend = load_backend_class(kind, name)()
+            _instances[key] = backend
+        return backend
+
+
+def set_backend(kind, backend):
+    """Fija la instancia que devolvera get_backend(kind) (p.ej. un backend sintetico)"""
+    with _lock:
+        _instances[(kind, backend.name)] = backend
+        _selected[kind] = backend.name
@@ -0,0 +1,161 @@
+"""
+Interfaces de los backends de entrada y tipos comunes.
+
+Un backend de mando (GamepadBackend) imita la API de XInput: rellena un
+XINPUT_STATE por numero de dispositivo, de modo que XInputJoystick no depende
+de la plataforma. Un backend HID (HidBackend) devuelve dispositivos que entregan
+los reports crudos a un handler, igual que pywinusb, para que DeviceSpec.process
+decodifique los mismos bytes en cualquier sistema.
+"""
+
+import ctypes
+import time
+
+
+# estructuras de XInput (independientes de la plataforma, solo ctypes)
+class XINPUT_GAMEPAD(ctypes.Structure):
+    _fields_ = [
+        ('buttons', ctypes.c_ushort),  # wButtons
+        ('left_trigger', ctypes.c_ubyte),  # bLeftTrigger
+        ('right_trigger', ctypes.c_ubyte),  # bLeftTrigger
+        ('l_thumb_x', ctypes.c_short),  # sThumbLX
+        ('l_thumb_y', ctypes.c_short),  # sThumbLY
+        ('r_thumb_x', ctypes.c_short),  # sThumbRx
+        ('r_thumb_y', ctypes.c_short),  # sThumbRy
+    ]
+
+
+class XINPUT_STATE(ctypes.Structure):
+    _fields_ = [
+        ('packet_number', ctypes.c_ulong),  # dwPacketNumber
+        ('gamepad', XINPUT_GAMEPAD),  # Gamepad
+    ]
+
+
+class XINPUT_VIBRATION(ctypes.Structure):
+    _fields_ = [("wLeftMotorSpeed", ctypes.c_ushort),
+                ("wRightMotorSpeed", ctypes.c_ushort)]
+
+
+class XINPUT_BATTERY_INFORMATION(ctypes.Structure):
+    _fields_ = [("BatteryType", ctypes.c_ubyte),
+                ("BatteryLevel", ctypes.c_ubyte)]
+
+
+ERROR_DEVICE_NOT_CONNECTED = 1167
+ERROR_SUCCESS = 0
+
+BATTERY_TYPE_WIRED = 0x01
+BATTERY_TYPE_UNKNOWN = 0xFF
+BATTERY_LEVEL_FULL = 0x03
+BATTERY_LEVEL_UNKNOWN = 0xFF
+
+# mascaras de wButtons
+XINPUT_GAMEPAD_DPAD_UP = 0x0001
+XINPUT_GAMEPAD_DPAD_DOWN = 0x0002
+XINPUT_GAMEPAD_DPAD_LEFT = 0x0004
+XINPUT_GAMEPAD_DPAD_RIGHT = 0x0008
+XINPUT_GAMEPAD_START = 0x0010
+XINPUT_GAMEPAD_BACK = 0x0020
+XINPUT_GAMEPAD_LEFT_THUMB = 0x0040
+XINPUT_GAMEPAD_RIGHT_THUMB = 0x0080
+XINPUT_GAMEPAD_LEFT_SHOULDER = 0x0100
+XINPUT_GAMEPAD_RIGHT_SHOULDER = 0x0200
+XINPUT_GAMEPAD_A = 0x1000
+XINPUT_GAMEPAD_B = 0x2000
+XINPUT_GAMEPAD_X = 0x4000
+XINPUT_GAMEPAD_Y = 0x8000
+
+
+def get_full_usage_id(page_id, usage_id):
+    """Convierte un par (usage page, usage) HID en el identificador de 32 bits que usa pywinusb"""
+    return (page_id << 16) | usage_id
+
+
+class GamepadBackend(object):
+    """
+    Backend de mandos con la semantica de XInput.
+
+    Las implementaciones rellenan un XINPUT_STATE y devuelven ERROR_SUCCESS o
+    ERROR_DEVICE_NOT_CONNECTED; packet_number solo cambia cuando cambia el estado.
+    """
+    name = None
+    max_devices = 4
+
+    def get_state(self, device_number, state):
+        """Rellena 'state' (XINPUT_STATE) con el estado actual del dispositivo"""
+        raise NotImplementedError
+
+    def set_vibration(self, device_number, left_motor, right_motor):
+        """Velocidad de los motores de vibración en [0, 1]"""
+        raise NotImplementedError
+
+    def get_battery_information(self, device_number):
+        """Devuelve (BatteryType, BatteryLevel) con los codigos de XInput"""
+        return BATTERY_TYPE_UNKNOWN, BATTERY_LEVEL_UNKNOWN
+
+    def wait(self, device_number, packet_number, timeout=None):
+        """
+        Bloquea hasta que el dispositivo tenga un paquete distinto de 'packet_number'
+        o venza 'timeout'. Devuelve True si hay un estado nuevo.
+
+        Por defecto sondea cada milisegundo; los backends con eventos lo sobreescriben.
+        """
+        state = XINPUT_STATE()
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            if self.get_state(device_number, state) != ERROR_SUCCESS:
+                return False
+            if state.packet_number != packet_number:
+                return True
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+            time.sleep(0.001)
+
+    def close(self):
+        pass
+
+
+class HidDevice(object):
+    """
+    Dispositivo HID devuelto por un HidBackend.
+
+    Expone los atributos que usa space_navigator.py (vendor_id, product_id,
+    product_name, vendor_name, version_number, serial_number) y entrega cada
+    report de entrada al handler como una lista de enteros cuyo primer
+    elemento es el report id.
+    """
+    vendor_id = 0
+    product_id = 0
+    product_name = ""
+    vendor_name = ""
+    version_number = 0
+    serial_number = ""
+
+    def __init__(self):
+        self.raw_data_handler = None
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def set_raw_data_handler(self, handler):
+        self.raw_data_handler = handler
+
+    def set_usage_value(self, usage, value):
+        """Envia un report de salida con el valor de 'usage' (p.ej. el LED)"""
+        raise NotImplementedError
+
+
+class HidBackend(object):
+    """Backend de dispositivos HID crudos (SpaceNavigator y similares)"""
+    name = None
+
+    def find_devices(self):
+        """Devuelve la lista de HidDevice presentes en el sistema"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
@@ -0,0 +1,497 @@
+"""
+Backends de Linux sin dependencias externas.
+
+EvdevGamepadBackend lee los mandos Xbox (driver xpad) de /dev/input/eventN y
+HidrawBackend los reports crudos de los dispositivos 3Dconnexion de
+/dev/hidrawN, de modo que DeviceSpec.process decodifica los mismos bytes que con
+pywinusb. Ambos comparten un hilo lector que bloquea en epoll: no hay sondeo,
+el estado se actualiza en cuanto el kernel entrega un evento.
+"""
+
+import ctypes
+import errno
+import fcntl
+import os
+import select
+import struct
+import threading
+import time
+
+from .base import (
+    XINPUT_STATE,
+    ERROR_DEVICE_NOT_CONNECTED,
+    ERROR_SUCCESS,
+    XINPUT_GAMEPAD_DPAD_UP,
+    XINPUT_GAMEPAD_DPAD_DOWN,
+    XINPUT_GAMEPAD_DPAD_LEFT,
+    XINPUT_GAMEPAD_DPAD_RIGHT,
+    XINPUT_GAMEPAD_START,
+    XINPUT_GAMEPAD_BACK,
+    XINPUT_GAMEPAD_LEFT_THUMB,
+    XINPUT_GAMEPAD_RIGHT_THUMB,
+    XINPUT_GAMEPAD_LEFT_SHOULDER,
+    XINPUT_GAMEPAD_RIGHT_SHOULDER,
+    XINPUT_GAMEPAD_A,
+    XINPUT_GAMEPAD_B,
+    XINPUT_GAMEPAD_X,
+    XINPUT_GAMEPAD_Y,
+    GamepadBackend,
+    HidBackend,
+    HidDevice,
+    get_full_usage_id,
+)
+
+# linux/input.h
+INPUT_EVENT = struct.Struct('llHHi')  # struct timeval, type, code, value
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+EV_FF = 0x15
+SYN_REPORT = 0
+SYN_DROPPED = 3
+FF_RUMBLE = 0x50
+
+ABS_X = 0x00
+ABS_Y = 0x01
+ABS_Z = 0x02
+ABS_RX = 0x03
+ABS_RY = 0x04
+ABS_RZ = 0x05
+ABS_HAT0X = 0x10
+ABS_HAT0Y = 0x11
+KEY_MAX = 0x2ff
+
+# tiempo minimo entre busquedas de un mando desconectado en /proc/bus/input/devices
+RESCAN_INTERVAL = 0.5
+
+BUTTON_MASKS = {
+    0x130: XINPUT_GAMEPAD_A,  # BTN_A
+    0x131: XINPUT_GAMEPAD_B,  # BTN_B
+    0x133: XINPUT_GAMEPAD_X,  # BTN_X
+    0x134: XINPUT_GAMEPAD_Y,  # BTN_Y
+    0x136: XINPUT_GAMEPAD_LEFT_SHOULDER,  # BTN_TL
+    0x137: XINPUT_GAMEPAD_RIGHT_SHOULDER,  # BTN_TR
+    0x13a: XINPUT_GAMEPAD_BACK,  # BTN_SELECT
+    0x13b: XINPUT_GAMEPAD_START,  # BTN_START
+    0x13d: XINPUT_GAMEPAD_LEFT_THUMB,  # BTN_THUMBL
+    0x13e: XINPUT_GAMEPAD_RIGHT_THUMB,  # BTN_THUMBR
+}
+
+# eje evdev -> (indice en el estado pendiente, invertido)
+STICK_AXES = {
+    ABS_X: (3, False),
+    ABS_Y: (4, True),  # xpad invierte el eje Y respecto a XInput
+    ABS_RX: (5, False),
+    ABS_RY: (6, True),
+}
+TRIGGER_AXES = {ABS_Z: 1, ABS_RZ: 2}
+
+
+def _ioc(direction, type, nr, size):
+    return (direction << 30) | (size << 16) | (ord(type) << 8) | nr
+
+
+def EVIOCGABS(abs_code):
+    return _ioc(2, 'E', 0x40 + abs_code, 24)
+
+
+def EVIOCGKEY(length):
+    return _ioc(2, 'E', 0x18, length)
+
+
+class _FF_RUMBLE(ctypes.Structure):
+    _fields_ = [('strong_magnitude', ctypes.c_ushort), ('weak_magnitude', ctypes.c_ushort)]
+
+
+class _FF_PERIODIC(ctypes.Structure):
+    # solo se declara para que la union tenga el tamaño del kernel
+    _fields_ = [('waveform', ctypes.c_ushort), ('period', ctypes.c_ushort),
+                ('magnitude', ctypes.c_short), ('offset', ctypes.c_short), ('phase', ctypes.c_ushort),
+                ('envelope', ctypes.c_ushort * 4),
+                ('custom_len', ctypes.c_uint), ('custom_data', ctypes.c_void_p)]
+
+
+class _FF_UNION(ctypes.Union):
+    _fields_ = [('rumble', _FF_RUMBLE), ('periodic', _FF_PERIODIC)]
+
+
+class FF_EFFECT(ctypes.Structure):
+    _fields_ = [('type', ctypes.c_ushort), ('id', ctypes.c_short), ('direction', ctypes.c_ushort),
+                ('trigger_button', ctypes.c_ushort), ('trigger_interval', ctypes.c_ushort),
+                ('replay_length', ctypes.c_ushort), ('replay_delay', ctypes.c_ushort),
+                ('u', _FF_UNION)]
+
+
+EVIOCSFF = _ioc(1, 'E', 0x80, ctypes.sizeof(FF_EFFECT))
+
+
+class EpollReader(object):
+    """
+    Hilo unico que bloquea en epoll sobre todos los dispositivos abiertos y
+    llama a on_readable(fd) de cada uno cuando el kernel tiene datos.
+    """
+
+    def __init__(self):
+        self._epoll = None
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, fd, on_readable):
+        with self._lock:
+            if self._epoll is None:
+                self._epoll = select.epoll()
+            self._handlers[fd] = on_readable
+            self._epoll.register(fd, select.EPOLLIN)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='epoll-input', daemon=True)
+                self._thread.start()
+
+    def unregister(self, fd):
+        with self._lock:
+            if self._handlers.pop(fd, None) is not None:
+                try:
+                    self._epoll.unregister(fd)
+                except (OSError, ValueError):
+                    pass
+
+    def _run(self):
+        while True:
+            try:
+                events = self._epoll.poll()
+            except InterruptedError:
+                continue
+            for fd, mask in events:
+                handler = self._handlers.get(fd)
+                if handler is None:
+                    continue
+                if mask & (select.EPOLLERR | select.EPOLLHUP):
+                    self.unregister(fd)
+                handler(fd)
+
+
+_reader = EpollReader()
+
+
+def read_proc_input_devices(path='/proc/bus/input/devices'):
+    """Devuelve una lista de dicts {vendor, product, name, handlers} de /proc/bus/input/devices"""
+    devices = []
+    try:
+        with open(path) as f:
+            blocks = f.read().split('\n\n')
+    except OSError:
+        return devices
+    for block in blocks:
+        info = {'vendor': 0, 'product': 0, 'name': '', 'handlers': []}
+        for line in block.splitlines():
+            if line.startswith('I:'):
+                for field in line[2:].split():
+                    key, _, value = field.partition('=')
+                    if key in ('Vendor', 'Product'):
+                        info[key.lower()] = int(value, 16)
+            elif line.startswith('N: Name='):
+                info['name'] = line[len('N: Name='):].strip('"')
+            elif line.startswith('H: Handlers='):
+                info['handlers'] = line[len('H: Handlers='):].split()
+        if info['handlers']:
+            devices.append(info)
+    return devices
+
+
+class _EvdevGamepad(object):
+    """
+    Estado de un mando evdev, actualizado por el hilo de epoll en cada SYN_REPORT.
+    Si el kernel pierde eventos (SYN_DROPPED, la cola del dispositivo se ha llenado)
+    se descarta hasta el siguiente SYN_REPORT y el estado se vuelve a leer entero
+    con EVIOCGKEY y EVIOCGABS, para no quedarse con un boton o un eje pegado.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        except PermissionError:
+            # sin escritura no hay vibración, pero se puede leer
+            self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self.connected = True
+        self.state = XINPUT_STATE()
+        self.condition = threading.Condition()
+        # [buttons, left_trigger, right_trigger, l_thumb_x, l_thumb_y, r_thumb_x, r_thumb_y]
+        self.pending = [0] * 7
+        self.hat = [0, 0]
+        self.dropped = False
+        self.ranges = {}
+        for code in list(STICK_AXES) + list(TRIGGER_AXES):
+            try:
+                info = fcntl.ioctl(self.fd, EVIOCGABS(code), bytes(24))
+                value, minimum, maximum = struct.unpack('6i', info)[:3]
+            except OSError:
+                value, minimum, maximum = 0, (0 if code in TRIGGER_AXES else -32768), \
+                    (255 if code in TRIGGER_AXES else 32767)
+            self.ranges[code] = (minimum, max(maximum - minimum, 1))
+            self._set_axis(code, value)
+        self._resync()
+        self.effect_id = -1
+
+    def _abs_value(self, code):
+        info = fcntl.ioctl(self.fd, EVIOCGABS(code), bytes(24))
+        return struct.unpack('6i', info)[0]
+
+    def _resync(self):
+        """Vuelve a leer del kernel el estado de botones y ejes y lo publica"""
+        try:
+            keys = fcntl.ioctl(self.fd, EVIOCGKEY((KEY_MAX + 7) // 8), bytes((KEY_MAX + 7) // 8))
+            buttons = 0
+            for code, mask in BUTTON_MASKS.items():
+                if keys[code // 8] & (1 << (code % 8)):
+                    buttons |= mask
+            self.pending[0] = buttons
+            for code in self.ranges:
+                self._set_axis(code, self._abs_value(code))
+            self.hat = [self._abs_value(ABS_HAT0X), self._abs_value(ABS_HAT0Y)]
+        except OSError:
+            # sin los ioctl (o sin cruceta) se queda lo que hubiera
+            pass
+        self._commit()
+
+    def _set_axis(self, code, value):
+        minimum, span = self.ranges[code]
+        if code in TRIGGER_AXES:
+            self.pending[TRIGGER_AXES[code]] = min(255, max(0, (value - minimum) * 255 // span))
+        else:
+            index, inverted = STICK_AXES[code]
+            value = (value - minimum) * 65535 // span - 32768
+            if inverted:
+                value = -1 - value
+            self.pending[index] = min(32767, max(-32768, value))
+
+    def _commit(self):
+        buttons, lt, rt, lx, ly, rx, ry = self.pending
+        hat_x, hat_y = self.hat
+        if hat_x < 0:
+            buttons |= XINPUT_GAMEPAD_DPAD_LEFT
+        elif hat_x > 0:
+            buttons |= XINPUT_GAMEPAD_DPAD_RIGHT
+        if hat_y < 0:
+            buttons |= XINPUT_GAMEPAD_DPAD_UP
+        elif hat_y > 0:
+            buttons |= XINPUT_GAMEPAD_DPAD_DOWN
+        with self.condition:
+            gamepad = self.state.gamepad
+            gamepad.buttons = buttons
+            gamepad.left_trigger = lt
+            gamepad.right_trigger = rt
+            gamepad.l_thumb_x = lx
+            gamepad.l_thumb_y = ly
+            gamepad.r_thumb_x = rx
+            gamepad.r_thumb_y = ry
+            self.state.packet_number += 1
+            self.condition.notify_all()
+
+    def on_readable(self, fd):
+        try:
+            data = os.read(fd, INPUT_EVENT.size * 64)
+        except BlockingIOError:
+            return
+        except OSError:
+            # ENODEV: el mando se ha desconectado
+            self.close()
+            return
+        for _, _, type, code, value in INPUT_EVENT.iter_unpack(data):
+            if type == EV_SYN:
+                if code == SYN_DROPPED:
+                    self.dropped = True
+                elif code == SYN_REPORT:
+                    if self.dropped:
+                        self.dropped = False
+                        self._resync()
+                    else:
+                        self._commit()
+            elif self.dropped:
+                # eventos incompletos hasta el siguiente SYN_REPORT
+                continue
+            elif type == EV_KEY:
+                mask = BUTTON_MASKS.get(code)
+                if mask:
+                    if value:
+                        self.pending[0] |= mask
+                    else:
+                        self.pending[0] &= ~mask
+            elif type == EV_ABS:
+                if code == ABS_HAT0X:
+                    self.hat[0] = value
+                elif code == ABS_HAT0Y:
+                    self.hat[1] = value
+                elif code in self.ranges:
+                    self._set_axis(code, value)
+
+    def rumble(self, strong, weak):
+        effect = FF_EFFECT(type=FF_RUMBLE, id=self.effect_id, replay_length=0xFFFF)
+        effect.u.rumble.strong_magnitude = strong
+        effect.u.rumble.weak_magnitude = weak
+        buf = bytearray(effect)
+        fcntl.ioctl(self.fd, EVIOCSFF, buf, True)
+        self.effect_id = FF_EFFECT.from_buffer(buf).id
+        os.write(self.fd, INPUT_EVENT.pack(0, 0, EV_FF, self.effect_id, 1 if strong or weak else 0))
+
+    def close(self):
+        _reader.unregister(self.fd)
+        with self.condition:
+            self.connected = False
+            self.condition.notify_all()
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+
+def find_gamepads():
+    """Rutas /dev/input/eventN de los mandos (dispositivos con manejador jsN), en orden"""
+    paths = []
+    for info in read_proc_input_devices():
+        handlers = info['handlers']
+        if any(h.startswith('js') for h in handlers):
+            paths.extend('/dev/input/' + h for h in handlers if h.startswith('event'))
+    return paths
+
+
+class EvdevGamepadBackend(GamepadBackend):
+    name = 'evdev'
+
+    def __init__(self, rescan_interval=RESCAN_INTERVAL):
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.rescan_interval = rescan_interval
+        self._next_scan = {}
+
+    def _device(self, device_number):
+        device = self._devices.get(device_number)
+        if device is not None and device.connected:
+            return device
+        # sin mando get_state se llama en cada ciclo: /proc se lee como mucho cada rescan_interval
+        now = time.monotonic()
+        if now < self._next_scan.get(device_number, 0.0):
+            return None
+        with self._lock:
+            # otro hilo (el lector o el de la vibracion) puede haberlo abierto mientras se esperaba
+            device = self._devices.get(device_number)
+            if device is not None and device.connected:
+                return device
+            if now < self._next_scan.get(device_number, 0.0):
+                return None
+            self._next_scan[device_number] = now + self.rescan_interval
+            paths = find_gamepads()
+            if device_number >= len(paths):
+                return None
+            try:
+                device = _EvdevGamepad(paths[device_number])
+            except OSError:
+                return None
+            _reader.register(device.fd, device.on_readable)
+            self._devices[device_number] = device
+            return device
+
+    def get_state(self, device_number, state):
+        device = self._device(device_number)
+        if device is None:
+            return ERROR_DEVICE_NOT_CONNECTED
+        with device.condition:
+            ctypes.pointer(state)[0] = device.state
+        return ERROR_SUCCESS
+
+    def wait(self, device_number, packet_number, timeout=None):
+        device = self._device(device_number)
+        if device is None:
+            return False
+        with device.condition:
+            return device.condition.wait_for(
+                lambda: not device.connected or device.state.packet_number != packet_number,
+                timeout) and device.connected
+
+    def set_vibration(self, device_number, left_motor, right_motor):
+        device = self._device(device_number)
+        if device is not None:
+            try:
+                device.rumble(int(left_motor * 65535), int(right_motor * 65535))
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.EBADF, errno.ENOSYS, errno.EPERM):
+                    raise
+
+    def close(self):
+        for device in self._devices.values():
+            device.close()
+        self._devices.clear()
+
+
+# reports de salida conocidos de los dispositivos 3Dconnexion: usage -> report id
+# (hidraw no analiza el descriptor HID, a diferencia de pywinusb)
+OUTPUT_REPORTS = {
+    get_full_usage_id(0x8, 0x4B): 4,  # LED generico
+}
+
+
+class HidrawDevice(HidDevice):
+
+    def __init__(self, path, vendor_id, product_id, product_name):
+        super(HidrawDevice, self).__init__()
+        self.path = path
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.product_name = product_name
+        self.fd = None
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        _reader.register(self.fd, self.on_readable)
+
+    def close(self):
+        if self.fd is not None:
+            _reader.unregister(self.fd)
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+    def on_readable(self, fd):
+        try:
+            data = os.read(fd, 64)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        if data and self.raw_data_handler:
+            self.raw_data_handler(list(data))
+
+    def set_usage_value(self, usage, value):
+        report_id = OUTPUT_REPORTS.get(usage)
+        if report_id is not None and self.fd is not None:
+            os.write(self.fd, bytes([report_id, int(value) & 0xFF]))
+
+
+class HidrawBackend(HidBackend):
+    name = 'hidraw'
+
+    def __init__(self, sysfs='/sys/class/hidraw'):
+        self.sysfs = sysfs
+
+    def find_devices(self):
+        devices = []
+        try:
+            names = sorted(os.listdir(self.sysfs))
+        except OSError:
+            return devices
+        for name in names:
+            info = {}
+            try:
+                with open(os.path.join(self.sysfs, name, 'device', 'uevent')) as f:
+                    for line in f:
+                        key, _, value = line.strip().partition('=')
+                        info[key] = value
+                bus, vendor_id, product_id = info['HID_ID'].split(':')
+            except (OSError, KeyError, ValueError):
+                continue
+            devices.append(HidrawDevice('/dev/' + name, int(vendor_id, 16), int(product_id, 16),
+                                        info.get('HID_NAME', name)))
+        return devices
@@ -0,0 +1,134 @@
+"""
+Backends sinteticos en memoria, para pruebas y benchmarks sin hardware.
+
+SyntheticGamepadBackend devuelve estados inyectados con push() o reproduce una
+secuencia grabada con load(); SyntheticHidBackend crea dispositivos HID cuyos
+reports se inyectan con inject() y que guardan los reports de salida enviados.
+
+Example:
+    backend = SyntheticGamepadBackend()
+    backend.push(0, buttons=0x1000, l_thumb_x=16000)
+    set_backend('gamepad', backend)
+"""
+
+import ctypes
+import threading
+
+from .base import (
+    XINPUT_STATE,
+    ERROR_DEVICE_NOT_CONNECTED,
+    ERROR_SUCCESS,
+    BATTERY_TYPE_WIRED,
+    BATTERY_LEVEL_FULL,
+    GamepadBackend,
+    HidBackend,
+    HidDevice,
+)
+
+_STATE_SIZE = ctypes.sizeof(XINPUT_STATE)
+
+
+class SyntheticGamepadBackend(GamepadBackend):
+    name = 'synthetic'
+
+    def __init__(self, connected=(0,)):
+        self._states = {}
+        self._sequences = {}
+        self._condition = threading.Condition()
+        self.vibration = {}
+        for device_number in connected:
+            self._states[device_number] = XINPUT_STATE()
+
+    def push(self, device_number, **gamepad):
+        """Cambia el estado del dispositivo (campos de XINPUT_GAMEPAD) y avanza packet_number"""
+        with self._condition:
+            state = self._states.setdefault(device_number, XINPUT_STATE())
+            for field, value in gamepad.items():
+                setattr(state.gamepad, field, value)
+            state.packet_number += 1
+            self._condition.notify_all()
+
+    def load(self, device_number, states):
+        """
+        Reproduce 'states' (lista de XINPUT_STATE) en bucle: cada get_state
+        devuelve el siguiente, como un mando muestreado a ritmo fijo.
+        """
+        self._states.setdefault(device_number, XINPUT_STATE())
+        self._sequences[device_number] = [states, 0]
+
+    def disconnect(self, device_number):
+        with self._condition:
+            self._states.pop(device_number, None)
+            self._sequences.pop(device_number, None)
+            self._condition.notify_all()
+
+    def get_state(self, device_number, state):
+        sequence = self._sequences.get(device_number)
+        if sequence is not None:
+            states, index = sequence
+            sequence[1] = index + 1
+            ctypes.memmove(ctypes.addressof(state), ctypes.addressof(states[index % len(states)]), _STATE_SIZE)
+            return ERROR_SUCCESS
+        current = self._states.get(device_number)
+        if current is None:
+            return ERROR_DEVICE_NOT_CONNECTED
+        ctypes.memmove(ctypes.addressof(state), ctypes.addressof(current), _STATE_SIZE)
+        return ERROR_SUCCESS
+
+    def wait(self, device_number, packet_number, timeout=None):
+        if device_number in self._sequences:
+            return True
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: device_number not in self._states or
+                self._states[device_number].packet_number != packet_number, timeout) and \
+                device_number in self._states
+
+    def set_vibration(self, device_number, left_motor, right_motor):
+        self.vibration[device_number] = (left_motor, right_motor)
+
+    def get_battery_information(self, device_number):
+        return BATTERY_TYPE_WIRED, BATTERY_LEVEL_FULL
+
+
+class SyntheticHidDevice(HidDevice):
+
+    def __init__(self, vendor_id, product_id, product_name="Synthetic HID", serial_number=""):
+        super(SyntheticHidDevice, self).__init__()
+        self.vendor_id = vendor_id
+        self.product_id = product_id
+        self.product_name = product_name
+        self.vendor_name = "synthetic"
+        self.serial_number = serial_number
+        self.is_open = False
+        # (usage, value) de cada report de salida enviado
+        self.outputs = []
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def inject(self, report):
+        """Entrega un report de entrada (report id + datos) al handler, como haria el driver"""
+        if self.is_open and self.raw_data_handler:
+            self.raw_data_handler(list(report))
+
+    def set_usage_value(self, usage, value):
+        self.outputs.append((usage, value))
+
+
+class SyntheticHidBackend(HidBackend):
+    name = 'synthetic'
+
+    def __init__(self):
+        self.devices = []
+
+    def add_device(self, vendor_id, product_id, **kwargs):
+        device = SyntheticHidDevice(vendor_id, product_id, **kwargs)
+        self.devices.append(device)
+        return device
+
+    def find_devices(self):
+        return list(self.devices)
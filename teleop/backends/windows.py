@@ -0,0 +1,104 @@
+"""
+Backends de Windows: XInput (xinput1_4) para los mandos Xbox y pywinusb para
+los dispositivos HID de 3Dconnexion.
+
+Las librerias de plataforma se cargan al crear el backend, no al importar.
+"""
+
+import ctypes
+
+from .base import (
+    XINPUT_VIBRATION,
+    XINPUT_BATTERY_INFORMATION,
+    GamepadBackend,
+    HidBackend,
+    HidDevice,
+)
+
+BATTERY_DEVTYPE_GAMEPAD = 0x00
+BATTERY_DEVTYPE_HEADSET = 0x01
+
+
+class XInputBackend(GamepadBackend):
+    """Acceso directo a xinput1_4.dll"""
+    name = 'xinput'
+
+    def __init__(self, dll_name='xinput1_4'):
+        # xinput9_1_0 es la version de Win 8 ?
+        # xinput1_2, xinput1_1 (32-bit Vista SP1)
+        # xinput1_3 (64-bit Vista SP1)
+        self.dll = getattr(ctypes.windll, dll_name)
+        self._get_state = self.dll.XInputGetState
+
+        self._set_state = self.dll.XInputSetState
+        self._set_state.argtypes = [ctypes.c_uint, ctypes.POINTER(XINPUT_VIBRATION)]
+        self._set_state.restype = ctypes.c_uint
+
+        self._get_battery = self.dll.XInputGetBatteryInformation
+        self._get_battery.argtypes = [ctypes.c_uint, ctypes.c_ubyte, ctypes.POINTER(XINPUT_BATTERY_INFORMATION)]
+        self._get_battery.restype = ctypes.c_uint
+
+    def get_state(self, device_number, state):
+        return self._get_state(device_number, ctypes.byref(state))
+
+    def set_vibration(self, device_number, left_motor, right_motor):
+        vibration = XINPUT_VIBRATION(
+            int(left_motor * 65535), int(right_motor * 65535))
+        self._set_state(device_number, ctypes.byref(vibration))
+
+    def get_battery_information(self, device_number):
+        battery = XINPUT_BATTERY_INFORMATION(0, 0)
+        self._get_battery(device_number, BATTERY_DEVTYPE_GAMEPAD, ctypes.byref(battery))
+        return battery.BatteryType, battery.BatteryLevel
+
+
+class PyWinUsbDevice(HidDevice):
+    """Envoltorio de pywinusb.hid.HidDevice con la interfaz de HidDevice"""
+
+    def __init__(self, device):
+        super(PyWinUsbDevice, self).__init__()
+        self.device = device
+        self.vendor_id = device.vendor_id
+        self.product_id = device.product_id
+        self.product_name = device.product_name
+        self.vendor_name = device.vendor_name
+        self.version_number = device.version_number
+        self.serial_number = device.serial_number
+        self._output_reports = []
+        self._report_by_usage = {}
+
+    def open(self):
+        self.device.open()
+        # los reports de salida se buscan una sola vez al abrir; set_usage_value solo
+        # consulta el report de cada usage (memorizado en la primera llamada)
+        self._output_reports = self.device.find_output_reports()
+        self._report_by_usage = {}
+
+    def close(self):
+        self.device.close()
+        self._output_reports = []
+        self._report_by_usage = {}
+
+    def set_raw_data_handler(self, handler):
+        self.raw_data_handler = handler
+        self.device.set_raw_data_handler(handler)
+
+    def set_usage_value(self, usage, value):
+        report = self._report_by_usage.get(usage, False)
+        if report is False:
+            report = next((r for r in self._output_reports if usage in r), None)
+            self._report_by_usage[usage] = report
+        if report is not None:
+            report[usage] = value
+            report.send()
+
+
+class PyWinUsbBackend(HidBackend):
+    name = 'pywinusb'
+
+    def __init__(self):
+        import pywinusb.hid as hid
+        self.hid = hid
+
+    def find_devices(self):
+        return [PyWinUsbDevice(device) for device in self.hid.find_all_hid_devices() or []]
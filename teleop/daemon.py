@@ -0,0 +1,309 @@
+"""
+Demonio de teleoperacion con una API local.
+
+Hoy cada sesion son tres o cuatro programas (xinput.py o space_navigator.py, un
+display y egm_interface_Xbox.py / egm_s_nav.py) en puertos fijos, y cambiar de
+modo es salir de un bucle y entrar en otro por v_global. El demonio arranca una
+vez las etapas de teleop.pipeline y las mantiene vivas:
+
+    mando    el proceso del mando Xbox, siempre leyendo (no se reconecta entre sesiones)
+    EGM      un proceso que ya ha importado egm_interface_Xbox y espera ordenes;
+             cada 'start' ejecuta mix_target en el modo pedido
+    display  el display del mando, bajo demanda
+    registro un proceso record_stage por cada 'record', hasta 'record_stop'
+
+Las ordenes al bucle EGM en marcha (parar, cambiar de modo, gain) llegan como
+eventos del perfil por egm_interface_Xbox.remote: el bucle las trata igual que
+los botones del mando, asi que al parar o cambiar de modo pasa por stop_egm y
+la descarga del log como siempre. Las graficas del log van al backend Agg (sin
+ventana) para que no bloqueen el proceso.
+
+API: socket TCP local, una peticion JSON por linea y una respuesta JSON por linea.
+    {"cmd": "status"}                         etapas, sesion y ultima telemetria del bucle
+    {"cmd": "start", "mode": "pose"}          arranca una sesion EGM (pose, joint, cartesian, path)
+    {"cmd": "mode", "mode": "joint"}          cambia el modo de la sesion en marcha
+    {"cmd": "gain", "steps": 2}               sube (o baja, si es negativo) el gain en pasos de 0.5
+    {"cmd": "stop"}                           termina la sesion (stop_egm, log)
+    {"cmd": "record", "path": "sesion.npz"}   empieza a registrar el estado del bucle
+    {"cmd": "record_stop"}
+    {"cmd": "display"}                        abre el display si no esta abierto
+    {"cmd": "shutdown"}
+Respuesta: {"ok": true, ...} o {"ok": false, "error": "..."}.
+
+Uso:
+    python -m teleop.daemon serve [--port 5010] [--device 0]
+    python -m teleop.daemon start --mode pose
+    python -m teleop.daemon gain --steps -1
+    python -m teleop.daemon status
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from teleop.pipeline import (MODES, FeedbackPublisher, FeedbackSubscriber, _xbox_path, device_stage,
+                             display_stage, record_stage)
+from teleop.shm import EGM_FEEDBACK, XBOX_INPUT, ShmChannel
+
+DAEMON_PORT = 5010
+SESSION_MODES = MODES[:-1]
+
+
+def session_stage(input_name, feedback_name, requests, remote, running):
+    """Proceso EGM de larga vida: importa una vez y ejecuta una sesion por cada modo que llega en 'requests'"""
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    _xbox_path()
+    import egm_interface_Xbox
+    reader = ShmChannel.attach(input_name, XBOX_INPUT)
+    egm_interface_Xbox.telemetry = FeedbackPublisher(ShmChannel.attach(feedback_name, EGM_FEEDBACK))
+    egm_interface_Xbox.remote = remote
+    try:
+        while True:
+            mode = requests.get()
+            if mode is None:
+                break
+            egm_interface_Xbox.v_global = egm_interface_Xbox.MODES[mode]
+            running.value = 1
+            try:
+                egm_interface_Xbox.mix_target(reader=reader)
+            except Exception as e:
+                print("Sesion EGM terminada con error: %s" % e)
+            finally:
+                # ordenes que llegaran con el bucle ya terminando no pasan a la siguiente sesion
+                while egm_interface_Xbox.remote_events():
+                    pass
+                egm_interface_Xbox.requested_mode = None
+                running.value = 0
+                plt = sys.modules.get('matplotlib.pyplot')
+                if plt is not None:
+                    plt.close('all')
+    finally:
+        egm_interface_Xbox.telemetry.channel.close()
+        reader.close()
+
+
+class TeleopDaemon(object):
+    """Dueno de los canales y las etapas; las ordenes de la API se ejecutan con un lock"""
+
+    def __init__(self, device_number=0):
+        self.context = multiprocessing.get_context('spawn')
+        prefix = 'teleop_daemon_%d' % os.getpid()
+        self.input_channel = ShmChannel.create(prefix + '_input', XBOX_INPUT)
+        self.feedback_channel = ShmChannel.create(prefix + '_feedback', EGM_FEEDBACK)
+        self.stop_event = self.context.Event()
+        self.requests = self.context.Queue()
+        self.remote = self.context.Queue()
+        self.running = self.context.Value('b', 0)
+        self.device = self.context.Process(target=device_stage, name='mando', daemon=True,
+                                           args=(self.input_channel.name, device_number, self.stop_event,
+                                                 self.feedback_channel.name))
+        self.session = self.context.Process(target=session_stage, name='EGM', daemon=True,
+                                            args=(self.input_channel.name, self.feedback_channel.name,
+                                                  self.requests, self.remote, self.running))
+        self.display = None
+        self.recorder = None
+        self.session_mode = None
+        self.started = None
+        self.subscriber = FeedbackSubscriber(ShmChannel.attach(self.feedback_channel.name, EGM_FEEDBACK), rate=4.0)
+        self.latest = None
+        self.lock = threading.Lock()
+        self.shutdown_requested = threading.Event()
+
+    def start(self):
+        self.device.start()
+        self.session.start()
+        self._watcher = threading.Thread(target=self._watch_feedback, daemon=True)
+        self._watcher.start()
+        return self
+
+    def _watch_feedback(self):
+        while not self.shutdown_requested.is_set():
+            message = self.subscriber.poll()
+            if message is not None:
+                self.latest = message
+            time.sleep(0.05)
+
+    # ordenes de la API
+    def handle(self, request):
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "la orden debe ser un objeto JSON, no %s" % type(request).__name__}
+        cmd = request.get('cmd')
+        handler = getattr(self, 'cmd_' + str(cmd), None)
+        if handler is None:
+            return {'ok': False, 'error': "orden desconocida: %s" % cmd}
+        with self.lock:
+            try:
+                result = handler(request)
+            except (KeyError, ValueError, TypeError) as e:
+                return {'ok': False, 'error': str(e)}
+        return dict({'ok': True}, **(result or {}))
+
+    @property
+    def session_running(self):
+        return bool(self.running.value) and self.session.is_alive()
+
+    def _check_mode(self, request):
+        mode = request.get('mode', 'pose')
+        if mode not in SESSION_MODES:
+            raise ValueError("modo %s desconocido (%s)" % (mode, ", ".join(SESSION_MODES)))
+        return mode
+
+    def cmd_status(self, request):
+        return {'session': {'running': self.session_running, 'mode': self.session_mode,
+                            'since': self.started},
+                'stages': {'mando': self.device.is_alive(), 'EGM': self.session.is_alive(),
+                           'display': bool(self.display and self.display.is_alive()),
+                           'registro': bool(self.recorder and self.recorder[0].is_alive())},
+                'record': self.recorder[1] if self.recorder else None,
+                'telemetry': self.latest}
+
+    def cmd_start(self, request):
+        mode = self._check_mode(request)
+        if self.session_running:
+            raise ValueError("ya hay una sesion en marcha (%s); usa 'mode' o 'stop'" % self.session_mode)
+        self.running.value = 1  # hasta que el proceso EGM la recoja, para que 'mode' no lance otra
+        self.requests.put(mode)
+        self.session_mode, self.started = mode, time.time()
+        return {'mode': mode}
+
+    def cmd_mode(self, request):
+        mode = self._check_mode(request)
+        if not self.session_running:
+            return self.cmd_start(request)
+        self.remote.put(('mode', mode))
+        self.session_mode = mode
+        return {'mode': mode}
+
+    def cmd_gain(self, request):
+        steps = int(request.get('steps', 1))
+        if not self.session_running:
+            raise ValueError("no hay ninguna sesion en marcha")
+        for _ in range(abs(steps)):
+            self.remote.put(('event', 'gain_up' if steps > 0 else 'gain_down'))
+        return {'steps': steps}
+
+    def cmd_stop(self, request):
+        if not self.session_running:
+            raise ValueError("no hay ninguna sesion en marcha")
+        self.remote.put(('event', 'exit'))
+        self.session_mode = None
+        return {}
+
+    def cmd_record(self, request):
+        path = request['path']
+        if self.recorder and self.recorder[0].is_alive():
+            raise ValueError("ya se esta registrando en %s" % self.recorder[1])
+        stop = self.context.Event()
+        process = self.context.Process(target=record_stage, name='registro',
+                                       args=(self.feedback_channel.name, path, stop))
+        process.start()
+        self.recorder = (process, path, stop)
+        return {'path': path}
+
+    def cmd_record_stop(self, request):
+        if not self.recorder:
+            raise ValueError("no se esta registrando")
+        process, path, stop = self.recorder
+        stop.set()
+        process.join(timeout=5.0)
+        self.recorder = None
+        return {'path': path}
+
+    def cmd_display(self, request):
+        if not (self.display and self.display.is_alive()):
+            self.display = self.context.Process(target=display_stage, name='display', daemon=True,
+                                                args=(self.input_channel.name, self.feedback_channel.name))
+            self.display.start()
+        return {}
+
+    def cmd_shutdown(self, request):
+        self.shutdown_requested.set()
+        return {}
+
+    def close(self):
+        if self.session_running:
+            self.remote.put(('event', 'exit'))
+            deadline = time.perf_counter() + 10.0
+            while self.session_running and time.perf_counter() < deadline:
+                time.sleep(0.05)
+        self.requests.put(None)
+        if self.recorder:
+            self.cmd_record_stop({})
+        self.stop_event.set()
+        self.input_channel.mark_closed()
+        self.feedback_channel.mark_closed()
+        for stage in (self.session, self.device, self.display):
+            if stage is None:
+                continue
+            stage.join(timeout=2.0)
+            if stage.is_alive():
+                stage.terminate()
+        self.shutdown_requested.set()
+        self._watcher.join()
+        self.subscriber.close()
+        self.input_channel.close()
+        self.feedback_channel.close()
+
+
+class _ApiHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.teleop.handle(json.loads(line))
+            except ValueError as e:
+                response = {'ok': False, 'error': "JSON invalido: %s" % e}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+def serve(port=DAEMON_PORT, device_number=0):
+    daemon = TeleopDaemon(device_number).start()
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(('localhost', port), _ApiHandler)
+    server.daemon_threads = True
+    server.teleop = daemon
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Demonio de teleoperacion en localhost:%d" % port)
+    try:
+        daemon.shutdown_requested.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        daemon.close()
+        print("Demonio terminado")
+
+
+def request(message, port=DAEMON_PORT, timeout=15.0):
+    """Envia una orden al demonio y devuelve su respuesta"""
+    with socket.create_connection(('localhost', port), timeout=timeout) as sock:
+        sock.sendall((json.dumps(message) + '\n').encode())
+        return json.loads(sock.makefile().readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Demonio de teleoperacion con API local")
+    parser.add_argument('--port', type=int, default=DAEMON_PORT)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_serve = sub.add_parser('serve', help="arranca el demonio")
+    p_serve.add_argument('--device', type=int, default=0, help="numero del mando")
+    for name in ('start', 'mode'):
+        sub.add_parser(name).add_argument('--mode', choices=SESSION_MODES, default='pose')
+    sub.add_parser('gain').add_argument('--steps', type=int, default=1)
+    sub.add_parser('record').add_argument('path')
+    for name in ('stop', 'record_stop', 'display', 'status', 'shutdown'):
+        sub.add_parser(name)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.port, args.device)
+    else:
+        message = {key: value for key, value in vars(args).items() if key not in ('command', 'port')}
+        message['cmd'] = args.command
+        print(json.dumps(request(message, args.port), indent=2))
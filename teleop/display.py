@@ -0,0 +1,196 @@
+"""
+Utilidades comunes de los displays de pygame (x_controller_display.py y s_nav_display.py).
+
+Los displays dibujan cada elemento y devuelven un dict elemento -> (valor, rect);
+dirty_rects compara con el frame anterior para enviar a la ventana solo las
+zonas que han cambiado. La parte fija se cachea en un StaticLayer y solo se
+dibujan los marcadores que dependen del estado. TelemetryOverlay muestra encima
+la telemetria que publica el bucle EGM (teleop.telemetry). run_display es el
+bucle comun de los dos displays.
+"""
+
+import sys
+import time
+
+import pygame
+
+
+def dirty_rects(screen_, elements, previous_elements):
+    """Rectangulos a actualizar: la posicion anterior y la nueva de cada elemento que ha cambiado"""
+    if previous_elements is None:
+        return [screen_.get_rect()]
+    rects = []
+    for key, (value, rect) in elements.items():
+        previous_value, previous_rect = previous_elements.get(key, (None, rect))
+        if value != previous_value or rect != previous_rect:
+            rects.append(rect.union(previous_rect))
+    return rects
+
+
+class StaticLayer(object):
+    """
+    Parte fija de un display (fondo, contornos, ejes y etiquetas) dibujada una sola
+    vez con draw(surface) y reconstruida solo cuando cambia el tamaño de la ventana.
+    """
+
+    def __init__(self, draw):
+        self.draw = draw
+        self.surface = None
+
+    def blit(self, screen_):
+        if self.surface is None or self.surface.get_size() != screen_.get_size():
+            self.surface = pygame.Surface(screen_.get_size()).convert()
+            self.draw(self.surface)
+        return screen_.blit(self.surface, (0, 0))
+
+
+class FrameTimer(object):
+    """
+    Contador en pantalla del tiempo de dibujo por frame (media movil) y de los fps.
+    El texto solo se vuelve a renderizar cada 'refresh' segundos.
+    """
+
+    def __init__(self, font, position=(5, 5), refresh=0.25, color=(255, 255, 0)):
+        self.font = font
+        self.position = position
+        self.refresh = refresh
+        self.color = color
+        self.frame_time = None
+        self.fps = 0.0
+        self._text = None
+        self._surface = None
+        self._rendered_at = 0.0
+
+    def add(self, frame_time, fps=0.0):
+        """Registra el tiempo (s) que ha costado dibujar y mostrar un frame"""
+        if self.frame_time is None:
+            self.frame_time = frame_time
+        else:
+            self.frame_time += 0.1 * (frame_time - self.frame_time)
+        self.fps = fps
+
+    def draw(self, screen_):
+        now = time.perf_counter()
+        if self._surface is None or now - self._rendered_at >= self.refresh:
+            frame_time = (self.frame_time or 0.0) * 1000.0
+            self._text = "%.2f ms/frame  %.0f fps" % (frame_time, self.fps)
+            self._surface = self.font.render(self._text, True, self.color)
+            self._rendered_at = now
+        return self._text, screen_.blit(self._surface, self.position)
+
+
+class TelemetryOverlay(object):
+    """
+    Texto con la telemetria del bucle EGM (pose del TCP, articulaciones, gain,
+    modo y latencia). Las lineas solo se renderizan cuando llega un mensaje nuevo
+    o cuando la telemetria pasa a estar desactualizada ('stale_after' segundos).
+    """
+
+    def __init__(self, font, position=(5, 5), stale_after=1.0, color=(0, 255, 255)):
+        self.font = font
+        self.position = position
+        self.stale_after = stale_after
+        self.color = color
+        self.message = None
+        self._received_at = None
+        self._key = None
+        self._surfaces = []
+
+    def update(self, message):
+        if message is not None:
+            self.message = message
+            self._received_at = time.perf_counter()
+
+    def stale(self):
+        return self._received_at is None or time.perf_counter() - self._received_at > self.stale_after
+
+    def changed(self):
+        """True si hay que redibujar aunque el estado del mando no haya cambiado"""
+        return self._key != self._current_key()
+
+    def _current_key(self):
+        return (self.message or {}).get('seq'), self.stale()
+
+    def lines(self):
+        message = self.message
+        if message is None:
+            return ["sin telemetria EGM"]
+        lines = []
+        if 'pos' in message:
+            lines.append("TCP %8.1f %8.1f %8.1f mm" % tuple(message['pos']))
+            lines.append("q   %7.4f %7.4f %7.4f %7.4f" % tuple(message['quat']))
+            joints = message['joints']
+            lines.append("J1-3 %7.2f %7.2f %7.2f" % tuple(joints[:3]))
+            lines.append("J4-6 %7.2f %7.2f %7.2f" % tuple(joints[3:6]))
+        mode = message.get('mode')
+        if message.get('frame') and mode == 'pose':
+            mode = "%s/%s" % (mode, message['frame'])
+        lines.append("gain %s  modo %s  %s Hz" % (message.get('gain'), mode, message.get('hz')))
+        latency = message.get('latency')
+        if latency:
+            lines.append("lat p50 %.2f p95 %.2f p99 %.2f ms" % (latency['p50'], latency['p95'], latency['p99']))
+        watchdog = message.get('watchdog')
+        if watchdog and watchdog['holding']:
+            lines.append("HOLD: %s (%s ms)" % (watchdog['reason'], watchdog['input_age']))
+        if self.stale():
+            lines.append("(telemetria sin actualizar)")
+        return lines
+
+    def draw(self, screen_):
+        key = self._current_key()
+        if key != self._key:
+            color = (128, 128, 128) if key[1] else self.color
+            self._surfaces = [self.font.render(line, True, (255, 64, 64) if line.startswith("HOLD") else color)
+                              for line in self.lines()]
+            self._key = key
+        x, y = self.position
+        rect = pygame.Rect(x, y, 0, 0)
+        for surface in self._surfaces:
+            rect.union_ip(screen_.blit(surface, (x, y)))
+            y += surface.get_height()
+        return key, rect
+
+
+def run_display(reader, telemetry, screen, update_display, telemetry_overlay, frame_timer, max_fps=60):
+    """
+    Bucle de un display. reader entrega el estado del mando con poll() (ReconnectingReader
+    sobre el socket del servidor o un canal de teleop.shm) y telemetry el estado del
+    bucle EGM (TelemetrySubscriber o el subscriptor de teleop.pipeline).
+    update_display(screen, state) dibuja un estado y devuelve sus elementos.
+    """
+    clock = pygame.time.Clock()
+
+    state = None
+    elements = None
+    while True:
+        try:
+            new_state = reader.poll()
+        except ConnectionError:
+            break
+        if new_state is not None:
+            state = new_state
+        telemetry_overlay.update(telemetry.poll())
+        if state is not None and new_state is None and telemetry_overlay.changed():
+            new_state = state
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.VIDEORESIZE and state is not None:
+                # la capa fija se reconstruye con el nuevo tamaño en el siguiente dibujo
+                new_state = state
+                elements = None
+
+        # solo se redibuja si el estado ha cambiado, y solo se envian a la ventana
+        # las zonas de los elementos que han cambiado
+        if new_state is not None:
+            t0 = time.perf_counter()
+            new_elements = update_display(screen, state)
+            rects = dirty_rects(screen, new_elements, elements)
+            if rects:
+                pygame.display.update(rects)
+            elements = new_elements
+            frame_timer.add(time.perf_counter() - t0, clock.get_fps())
+
+        clock.tick(max_fps)  # limita el refresco de la ventana
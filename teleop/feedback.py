@@ -0,0 +1,218 @@
+"""
+Avisos al operador en el propio mando: LED del SpaceNavigator y vibracion del Xbox
+segun el estado del bucle EGM.
+
+FeedbackChannel tiene un hilo propio que, a 'rate' Hz como mucho:
+    - lee el ultimo estado del bucle EGM de una fuente con poll() (TelemetrySubscriber
+      por TCP o el FeedbackSubscriber de teleop.pipeline);
+    - decide el LED y la vibracion a partir de ese estado;
+    - envia a cada salida solo lo que ha cambiado desde el ultimo envio.
+Ni la lectura del mando ni el bucle de control hacen nada: el bucle EGM ya publica
+su estado en la telemetria y los reports de salida se preparan al abrir el dispositivo.
+
+Avisos:
+    sin bucle EGM          LED apagado
+    bucle EGM en marcha    LED encendido
+    en un limite           LED parpadeando rapido, pulso fuerte al llegar a un limite nuevo
+    watchdog manteniendo   LED parpadeando lento, pulso suave al empezar
+    cambio de gain         pulso corto
+
+Example:
+    feedback = FeedbackChannel([RumbleOutput(0)], TelemetrySubscriber()).start()
+    ...
+    feedback.close()
+
+Uso:
+    python -m teleop.feedback [--xbox 0] [--spacenav] [--port 5002] [--rate 20]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+from teleop.telemetry import TELEMETRY_PORT, TelemetrySubscriber
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (vibracion (motor izquierdo/fuerte, motor derecho/suave) en [0, 1], segundos)
+PULSES = {
+    'limit': ((0.7, 0.0), 0.25),
+    'hold': ((0.0, 0.4), 0.4),
+    'gain': ((0.3, 0.3), 0.1),
+}
+# periodo del parpadeo del LED (s)
+BLINK_HOLD = 0.5
+BLINK_LIMIT = 0.2
+
+OFF = (False, (0.0, 0.0))
+
+
+class RumbleOutput(object):
+    """Vibracion de un mando por el backend de mandos (XInput, evdev o sintetico)"""
+
+    def __init__(self, device_number=0, backend=None):
+        from teleop.backends import get_backend
+        self.device_number = device_number
+        self.backend = backend or get_backend('gamepad')
+
+    def value(self, led, rumble):
+        return rumble
+
+    def send(self, rumble):
+        self.backend.set_vibration(self.device_number, *rumble)
+
+
+class LedOutput(object):
+    """LED de un dispositivo 3Dconnexion abierto (DeviceSpec de space_navigator.py)"""
+
+    def __init__(self, device):
+        self.device = device
+
+    def value(self, led, rumble):
+        return bool(led)
+
+    def send(self, led):
+        self.device.set_led(1 if led else 0)
+
+
+class FeedbackChannel(object):
+    """
+    Hilo de avisos: decide el LED y la vibracion con el estado del bucle EGM y los
+    envia a cada salida solo cuando cambian, a 'rate' Hz como mucho. Una salida tiene
+    value(led, rumble), la parte del estado que usa, y send(value). El publicador de
+    telemetria sigue reenviando su ultimo estado cuando el bucle se para, asi que
+    solo cuentan los mensajes con ciclos nuevos ('hz' > 0): sin ninguno durante
+    'stale' segundos se considera que no hay bucle EGM. La fuente se cierra con el canal.
+    """
+
+    def __init__(self, outputs, source=None, rate=20.0, stale=1.0):
+        self.outputs = list(outputs)
+        self.source = source
+        self.period = 1.0 / rate
+        self.stale = stale
+        self.sent = 0
+        self._last = [None] * len(self.outputs)
+        self._seen = None
+        self._gain = None
+        self._holding = False
+        self._hold_since = 0.0
+        self._limit = ()
+        self._pulse = None
+        self._pulse_until = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='avisos', daemon=True)
+        self._thread.start()
+        return self
+
+    def pulse(self, name, now=None):
+        """Lanza el pulso de vibracion 'name' de PULSES"""
+        now = time.perf_counter() if now is None else now
+        self._pulse, duration = PULSES[name]
+        self._pulse_until = now + duration
+
+    def observe(self, message, now=None):
+        """Actualiza el estado con un mensaje de telemetria del bucle EGM"""
+        if not message.get('hz'):
+            # ultimo estado reenviado sin ciclos nuevos: el bucle esta parado
+            return
+        now = time.perf_counter() if now is None else now
+        if self._seen is None:
+            self._gain = None
+        self._seen = now
+        gain = message.get('gain')
+        if self._gain is not None and gain != self._gain:
+            self.pulse('gain', now)
+        self._gain = gain
+        holding = bool((message.get('watchdog') or {}).get('holding'))
+        if holding and not self._holding:
+            self._hold_since = now
+            self.pulse('hold', now)
+        self._holding = holding
+        limit = tuple(message.get('limit') or ())
+        if set(limit) - set(self._limit):
+            self.pulse('limit', now)
+        self._limit = limit
+
+    def state(self, now):
+        """(led, (izquierdo, derecho)) que toca en 'now'"""
+        if self._seen is None or now - self._seen > self.stale:
+            self._seen = None
+            self._holding = False
+            self._limit = ()
+            return OFF
+        if self._holding:
+            led = (now - self._hold_since) % BLINK_HOLD < BLINK_HOLD / 2
+        elif self._limit:
+            led = now % BLINK_LIMIT < BLINK_LIMIT / 2
+        else:
+            led = True
+        rumble = self._pulse if now < self._pulse_until else OFF[1]
+        return led, rumble
+
+    def _send(self, state, force=False):
+        for i, output in enumerate(self.outputs):
+            # cada salida recibe solo su parte (LED o vibracion) y solo si ha cambiado
+            value = output.value(*state)
+            if not force and self._last[i] == value:
+                continue
+            try:
+                output.send(value)
+            except OSError as e:
+                print("Aviso no enviado a %s: %s" % (type(output).__name__, e))
+            self._last[i] = value
+            self.sent += 1
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            now = time.perf_counter()
+            if self.source is not None:
+                message = self.source.poll()
+                if message is not None:
+                    self.observe(message, now)
+            self._send(self.state(now))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # nada encendido ni vibrando al salir
+        self._send(OFF, force=True)
+        if self.source is not None and hasattr(self.source, 'close'):
+            self.source.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Avisos en el mando (LED, vibracion) segun el bucle EGM")
+    parser.add_argument('--xbox', type=int, metavar='N', help="vibracion del mando Xbox numero N")
+    parser.add_argument('--spacenav', action='store_true', help="LED del primer SpaceNavigator")
+    parser.add_argument('--port', type=int, default=TELEMETRY_PORT, help="puerto de la telemetria del bucle EGM")
+    parser.add_argument('--rate', type=float, default=20.0, help="envios por segundo como mucho")
+    args = parser.parse_args()
+
+    outputs = []
+    if args.xbox is not None:
+        outputs.append(RumbleOutput(args.xbox))
+    if args.spacenav:
+        sys.path.append(os.path.join(ROOT, 'Spacenavigator'))
+        import space_navigator
+        device = space_navigator.open()
+        if device is None:
+            parser.error("no se ha encontrado ningun SpaceNavigator")
+        outputs.append(LedOutput(device))
+    if not outputs:
+        parser.error("indica al menos una salida (--xbox N, --spacenav)")
+
+    feedback = FeedbackChannel(outputs, TelemetrySubscriber(port=args.port), rate=args.rate).start()
+    print("Avisos en marcha (telemetria en el puerto %d)" % args.port)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        feedback.close()
@@ -0,0 +1,118 @@
+"""
+Marcos de jog seleccionables para el modo pose.
+
+El objetivo de EGMRunPose se expresa en el marco de correccion (corr_frame,
+de tipo EGM_FRAME_WOBJ). Los ejes del mando se pueden interpretar en:
+
+    wobj    el marco de correccion (lo de siempre; el "user frame" del perfil)
+    base    la base del robot, aunque el wobj este girado
+    tool    los ejes de tool0 en la orientacion actual del objetivo
+    custom  una orientacion fija del perfil, relativa al wobj
+
+La matriz de cada marco se calcula una vez y se guarda; solo se recalcula al
+cambiar de marco o, en 'tool', cuando cambia la orientacion del objetivo. En el
+resto de ciclos convertir el incremento de traslacion es un producto 3x3.
+Los incrementos de Q1-Q3 del perfil no se transforman (son componentes del
+cuaternion, no giros sobre ejes).
+
+En el perfil:
+    "frames": {
+        "jog": ["wobj", "base", "tool"],                    # orden del evento next_frame
+        "wobj": {"trans": [0, 0, 0], "rot": [1, 0, 0, 0]},   # opcional: corr_frame y sense_frame
+        "custom": {"rot": [0.9238795, 0, 0, 0.3826834]}      # opcional
+    }
+
+Example:
+    frames = JogFrames.from_profile(mapping.profile)
+    corr_frame = abb.pose(*frames.corr_frame)
+    target = frames.target_from_base(r1.trans, r1.rot)
+    ...
+    if 'next_frame' in events:
+        frames.next()
+    delta = frames.apply(mapping.delta(axes, buttons, gain), r2.rot)
+"""
+
+import numpy as np
+
+from teleop.kinematics import matrix_to_quat, quat_to_matrix
+
+FRAME_KINDS = ('wobj', 'base', 'tool', 'custom')
+
+
+class JogFrames(object):
+    """Marco de jog activo y cache de su matriz de rotacion (ejes del marco -> wobj)"""
+
+    def __init__(self, jog=('wobj',), wobj=None, custom=None):
+        unknown = [name for name in jog if name not in FRAME_KINDS]
+        if unknown:
+            raise ValueError("Marcos de jog desconocidos: %s; disponibles: %s" % (
+                ", ".join(unknown), ", ".join(FRAME_KINDS)))
+        if 'custom' in jog and custom is None:
+            raise ValueError("El marco 'custom' necesita su orientacion ('rot') en el perfil")
+        self.jog = tuple(jog)
+        wobj = wobj or {}
+        self.wobj_trans = np.array(wobj.get('trans', (0.0, 0.0, 0.0)), dtype=float)
+        self.wobj_rot = quat_to_matrix(wobj.get('rot', (1.0, 0.0, 0.0, 0.0)))
+        self.identity_wobj = not self.wobj_trans.any() and np.allclose(self.wobj_rot, np.eye(3))
+        self.custom_rot = None if custom is None else quat_to_matrix(custom['rot'])
+        self.name = None
+        self._rotation = None
+        self._tool_quat = None
+        self.select(self.jog[0])
+
+    @classmethod
+    def from_profile(cls, profile):
+        frames = profile.get('frames', {})
+        return cls(frames.get('jog', ('wobj',)), frames.get('wobj'), frames.get('custom'))
+
+    @property
+    def corr_frame(self):
+        """(trans, rot) del wobj para corr_frame / sense_frame de EGMPoseTargetConfig"""
+        return self.wobj_trans.tolist(), matrix_to_quat(self.wobj_rot).tolist()
+
+    def select(self, name):
+        if name not in self.jog:
+            raise ValueError("Marco de jog %s no configurado (%s)" % (name, ", ".join(self.jog)))
+        self.name = name
+        self._tool_quat = None
+        if name == 'wobj':
+            self._rotation = None  # identidad: el incremento ya esta en el wobj
+        elif name == 'base':
+            self._rotation = self.wobj_rot.T
+        elif name == 'custom':
+            self._rotation = self.custom_rot
+        return name
+
+    def next(self):
+        """Pasa al siguiente marco de la lista 'jog' y devuelve su nombre"""
+        name = self.select(self.jog[(self.jog.index(self.name) + 1) % len(self.jog)])
+        print("Marco de jog: %s" % name)
+        return name
+
+    def apply(self, delta, rot):
+        """Pasa la traslacion de 'delta' (en el marco activo) al wobj; 'rot' es el cuaternion del objetivo"""
+        if self.name == 'tool':
+            quat = (rot[0], rot[1], rot[2], rot[3])
+            if quat != self._tool_quat:
+                self._tool_quat = quat
+                self._rotation = quat_to_matrix(quat)
+        if self._rotation is not None:
+            delta[:3] = self._rotation.dot(delta[:3])
+        return delta
+
+    def to_base(self, pos):
+        """Posicion del wobj en la base (p.ej. para el mapa de manipulabilidad)"""
+        if self.identity_wobj:
+            return pos
+        return self.wobj_rot.dot(pos) + self.wobj_trans
+
+    def target_from_base(self, trans, rot):
+        """Robtarget en la base (wobj0) -> (trans, rot) en el wobj de correccion"""
+        if self.identity_wobj:
+            return list(trans), list(rot)
+        trans = self.wobj_rot.T.dot(np.asarray(trans, dtype=float) - self.wobj_trans)
+        rot = matrix_to_quat(self.wobj_rot.T.dot(quat_to_matrix(rot)))
+        return trans.tolist(), rot.tolist()
+
+    def telemetry(self):
+        return self.name
@@ -0,0 +1,283 @@
+"""
+Cinematica del IRB-1200 y resolucion inversa por minimos cuadrados amortiguados.
+
+En el modo pose el controlador resuelve la cinematica inversa y, si el brazo
+pasa por una singularidad, el programa se para y hay que reiniciar los modulos.
+Aqui la resolvemos nosotros para mover el robot en cartesianas con los
+objetivos articulares de EGMRunJoint (egm.send_to_robot):
+
+    - cinematica directa vectorizada (producto de exponenciales): acepta un
+      array (..., 6) de articulaciones y devuelve todas las poses a la vez;
+    - jacobiano geometrico analitico en la base, calculado en la misma pasada;
+    - paso de minimos cuadrados amortiguados (DLS) con amortiguamiento
+      adaptativo: cero lejos de las singularidades y creciente segun el menor
+      valor singular se acerca a cero, de modo que cerca de una singularidad
+      el robot se frena en la direccion degenerada en lugar de pedir
+      velocidades articulares enormes;
+    - arranque en caliente desde el ultimo comando: con los incrementos de un
+      ciclo EGM (4 ms) basta con una o dos iteraciones.
+
+Unidades como en RAPID/EGM: articulaciones en grados, posiciones en mm y
+cuaterniones [q1, q2, q3, q4] = [w, x, y, z].
+
+Example:
+    kinematics = Kinematics('IRB1200_7_70')
+    solver = DLSSolver(kinematics, lower, upper)
+    jog = CartesianJog(solver, feedback_joints(feedback))
+    ...
+    robax = jog.update(delta)  # [dx, dy, dz] mm y [rx, ry, rz] grados en la base
+    egm.send_to_robot(robax)
+"""
+
+import numpy as np
+
+# cotas del IRB-1200 en mm (especificacion de producto): altura del eje 2 (d1),
+# brazo (a2), desplazamiento vertical del antebrazo (a3), del eje 3 al centro de
+# la muñeca (d4) y del centro de la muñeca a la brida (d6)
+GEOMETRIES = {
+    'IRB1200_7_70': {'d1': 399.0, 'a2': 350.0, 'a3': 42.0, 'd4': 351.0, 'd6': 82.0},
+    'IRB1200_5_90': {'d1': 399.0, 'a2': 448.0, 'a3': 42.0, 'd4': 451.0, 'd6': 82.0},
+}
+
+# limites de los ejes (grados) de la especificacion de producto
+JOINT_LIMITS = np.array([[-170.0, 170.0], [-100.0, 135.0], [-200.0, 70.0],
+                         [-270.0, 270.0], [-130.0, 130.0], [-400.0, 400.0]])
+
+
+def skew(v):
+    return np.array([[0.0, -v[2], v[1]], [v[2], 0.0, -v[0]], [-v[1], v[0], 0.0]])
+
+
+def quat_to_matrix(q):
+    """Matriz de rotacion de un cuaternion [w, x, y, z] (orden de RAPID)"""
+    w, x, y, z = np.asarray(q, dtype=float) / np.linalg.norm(q)
+    return np.array([[1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)],
+                     [2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+                     [2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)]])
+
+
+def matrix_to_quat(r):
+    """Cuaternion [w, x, y, z] con w >= 0 de una matriz de rotacion"""
+    trace = r[0, 0] + r[1, 1] + r[2, 2]
+    if trace > 0.0:
+        s = 2.0 * np.sqrt(trace + 1.0)
+        q = [0.25 * s, (r[2, 1] - r[1, 2]) / s, (r[0, 2] - r[2, 0]) / s, (r[1, 0] - r[0, 1]) / s]
+    elif r[0, 0] > r[1, 1] and r[0, 0] > r[2, 2]:
+        s = 2.0 * np.sqrt(1.0 + r[0, 0] - r[1, 1] - r[2, 2])
+        q = [(r[2, 1] - r[1, 2]) / s, 0.25 * s, (r[0, 1] + r[1, 0]) / s, (r[0, 2] + r[2, 0]) / s]
+    elif r[1, 1] > r[2, 2]:
+        s = 2.0 * np.sqrt(1.0 + r[1, 1] - r[0, 0] - r[2, 2])
+        q = [(r[0, 2] - r[2, 0]) / s, (r[0, 1] + r[1, 0]) / s, 0.25 * s, (r[1, 2] + r[2, 1]) / s]
+    else:
+        s = 2.0 * np.sqrt(1.0 + r[2, 2] - r[0, 0] - r[1, 1])
+        q = [(r[1, 0] - r[0, 1]) / s, (r[0, 2] + r[2, 0]) / s, (r[1, 2] + r[2, 1]) / s, 0.25 * s]
+    q = np.array(q)
+    return -q if q[0] < 0.0 else q
+
+
+def rotation_matrix(rotvec):
+    """Rotacion de un vector de rotacion (eje * angulo en radianes), formula de Rodrigues"""
+    rotvec = np.asarray(rotvec, dtype=float)
+    angle = np.sqrt(rotvec.dot(rotvec))
+    if angle < 1e-12:
+        return np.eye(3)
+    k = skew(rotvec / angle)
+    return np.eye(3) + np.sin(angle) * k + (1.0 - np.cos(angle)) * k.dot(k)
+
+
+def rotation_vector(r):
+    """Vector de rotacion (radianes) de una matriz de rotacion, inversa de rotation_matrix"""
+    cos = min(1.0, max(-1.0, (r[0, 0] + r[1, 1] + r[2, 2] - 1.0) * 0.5))
+    axis = np.array([r[2, 1] - r[1, 2], r[0, 2] - r[2, 0], r[1, 0] - r[0, 1]]) * 0.5
+    sin = np.sqrt(axis.dot(axis))
+    angle = np.arctan2(sin, cos)
+    if sin < 1e-9:
+        if cos > 0.0:
+            return axis  # angulo ~0: primer orden
+        # angulo ~pi: eje de la diagonal de (R + I) / 2
+        sym = (r + np.eye(3)) * 0.5
+        axis = sym[np.argmax(np.diagonal(sym))]
+        return axis / np.linalg.norm(axis) * np.pi
+    return axis * (angle / sin)
+
+
+class Kinematics(object):
+    """
+    Cinematica directa y jacobiano de un brazo de 6 ejes con muñeca esferica del
+    tipo del IRB-1200, por producto de exponenciales en la base. Con todas las
+    articulaciones a cero el antebrazo esta horizontal segun +X y la brida mira a
+    +X (tool0 = [d4 + d6, 0, d1 + a2 + a3], [0.7071068, 0, 0.7071068, 0]).
+    """
+
+    def __init__(self, geometry='IRB1200_7_70'):
+        if isinstance(geometry, str):
+            try:
+                geometry = GEOMETRIES[geometry]
+            except KeyError:
+                raise ValueError("Geometria desconocida %s; disponibles: %s" % (geometry, ", ".join(GEOMETRIES)))
+        self.geometry = dict(geometry)
+        d1, a2, a3, d4, d6 = (geometry[key] for key in ('d1', 'a2', 'a3', 'd4', 'd6'))
+        x, y, z = np.eye(3)
+        # eje de giro y un punto del eje de cada articulacion con todo a cero
+        self.axes = np.array([z, y, y, x, y, x])
+        self.points = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, d1], [0.0, 0.0, d1 + a2],
+                                [0.0, 0.0, d1 + a2 + a3], [d4, 0.0, d1 + a2 + a3], [d4, 0.0, d1 + a2 + a3]])
+        # tool0 con todo a cero
+        self.home = np.array([[0.0, 0.0, 1.0, d4 + d6], [0.0, 1.0, 0.0, 0.0],
+                              [-1.0, 0.0, 0.0, d1 + a2 + a3], [0.0, 0.0, 0.0, 1.0]])
+        self._k = np.array([skew(axis) for axis in self.axes])
+        self._k2 = np.matmul(self._k, self._k)
+        self._eye, self._eye4 = np.eye(3), np.eye(4)
+
+    def _chain(self, q):
+        """Transformaciones homogeneas acumuladas antes de cada eje (..., 6, 4, 4) y de tool0 (..., 4, 4), en radianes"""
+        s, c = np.sin(q), np.cos(q)
+        # exponencial de cada eje: R_i = I + sin K + (1 - cos) K^2, t_i = (I - R_i) p_i
+        exps = np.zeros(q.shape + (4, 4))
+        rot = exps[..., :3, :3]
+        rot[:] = self._eye + s[..., None, None] * self._k + (1.0 - c)[..., None, None] * self._k2
+        exps[..., :3, 3] = self.points - np.matmul(rot, self.points[..., None])[..., 0]
+        exps[..., 3, 3] = 1.0
+        before = np.empty_like(exps)
+        before[..., 0, :, :] = self._eye4
+        for i in range(5):
+            np.matmul(before[..., i, :, :], exps[..., i, :, :], out=before[..., i + 1, :, :])
+        return before, np.matmul(np.matmul(before[..., 5, :, :], exps[..., 5, :, :]), self.home)
+
+    def forward(self, joints):
+        """Pose de tool0: posicion (..., 3) en mm y rotacion (..., 3, 3) para articulaciones (..., 6) en grados"""
+        tool = self._chain(np.radians(np.asarray(joints, dtype=float)))[1]
+        return tool[..., :3, 3], tool[..., :3, :3]
+
+    def forward_jacobian(self, joints):
+        """
+        Pose de tool0 y jacobiano geometrico (..., 6, 6) en la base: filas [v (mm/rad); w (rad/rad)],
+        columnas por articulacion (derivadas respecto a radianes)
+        """
+        before, tool = self._chain(np.radians(np.asarray(joints, dtype=float)))
+        pos = tool[..., :3, 3]
+        # eje y punto de cada articulacion en la configuracion actual
+        w = np.matmul(before[..., :3, :3], self.axes[..., None])[..., 0]
+        p = np.matmul(before[..., :3, :3], self.points[..., None])[..., 0] + before[..., :3, 3]
+        d = pos[..., None, :] - p
+        # columnas [w x d; w] (producto vectorial escrito a mano: np.cross es lento con arrays pequeños)
+        jacobian = np.empty(pos.shape[:-1] + (6, 6))
+        jacobian[..., 0, :] = w[..., 1] * d[..., 2] - w[..., 2] * d[..., 1]
+        jacobian[..., 1, :] = w[..., 2] * d[..., 0] - w[..., 0] * d[..., 2]
+        jacobian[..., 2, :] = w[..., 0] * d[..., 1] - w[..., 1] * d[..., 0]
+        jacobian[..., 3:, :] = np.swapaxes(w, -1, -2)
+        return pos, tool[..., :3, :3], jacobian
+
+    def jacobian(self, joints):
+        return self.forward_jacobian(joints)[2]
+
+
+class DLSSolver(object):
+    """
+    Cinematica inversa por minimos cuadrados amortiguados con arranque en caliente.
+
+    El error de orientacion se pesa con 'rot_weight' (mm por radian) para mezclarlo
+    con el de posicion. El amortiguamiento es lambda^2 = (1 - (s_min / threshold)^2) * damping^2
+    si el menor valor singular del jacobiano pesado baja de 'threshold', y cero si no.
+    Cada paso se limita a 'max_step' grados en la articulacion que mas se mueve y se
+    recorta a los limites articulares.
+    """
+
+    def __init__(self, kinematics, lower=None, upper=None, rot_weight=100.0, threshold=10.0, damping=20.0,
+                 max_step=1.0, max_iter=2, tolerance=(0.01, 0.01)):
+        self.kinematics = kinematics
+        self.lower = JOINT_LIMITS[:, 0].copy() if lower is None else np.asarray(lower, dtype=float)
+        self.upper = JOINT_LIMITS[:, 1].copy() if upper is None else np.asarray(upper, dtype=float)
+        self.rot_weight = rot_weight
+        self.threshold = threshold
+        self.damping = damping
+        self.max_step = max_step
+        self.max_iter = max_iter
+        # tolerancias de parada: mm y grados
+        self.tolerance = (tolerance[0], np.radians(tolerance[1]) * rot_weight)
+        self._weights = np.array([1.0, 1.0, 1.0, rot_weight, rot_weight, rot_weight])
+        self.pos = None
+        self.rot = None
+        self.info = {'iterations': 0, 'error_mm': 0.0, 'error_deg': 0.0, 'sigma_min': None, 'damping': 0.0}
+
+    def at_limit(self, joints):
+        """Articulaciones (J1..J6) en un limite articular (para teleop.feedback)"""
+        joints = np.asarray(joints, dtype=float)
+        return ['J%d' % (i + 1) for i in np.flatnonzero((joints <= self.lower) | (joints >= self.upper))]
+
+    def step(self, jacobian, error):
+        """Incremento articular (grados) para un error pesado [mm; mm] con el jacobiano pesado"""
+        u, s, vt = np.linalg.svd(jacobian)
+        sigma_min = s[-1]
+        if sigma_min < self.threshold:
+            damping = (1.0 - (sigma_min / self.threshold) ** 2) * self.damping ** 2
+        else:
+            damping = 0.0
+        self.info['sigma_min'], self.info['damping'] = float(sigma_min), float(np.sqrt(damping))
+        dq = np.degrees(vt.T.dot(s / (s * s + damping) * u.T.dot(error)))
+        largest = np.abs(dq).max()
+        if largest > self.max_step:
+            dq *= self.max_step / largest
+        return dq
+
+    def solve(self, joints, pos, rot):
+        """
+        Articulaciones (grados) que llevan tool0 a (pos, rot) partiendo de 'joints'. Tras la
+        llamada self.pos / self.rot es la pose alcanzada y self.info el error que queda.
+        """
+        q = np.array(joints, dtype=float)
+        for iteration in range(self.max_iter + 1):
+            current_pos, current_rot, jacobian = self.kinematics.forward_jacobian(q)
+            error_pos = pos - current_pos
+            error_rot = rotation_vector(rot.dot(current_rot.T)) * self.rot_weight
+            error_mm = np.sqrt(error_pos.dot(error_pos))
+            error_w = np.sqrt(error_rot.dot(error_rot))
+            if iteration == self.max_iter or (error_mm <= self.tolerance[0] and error_w <= self.tolerance[1]):
+                break
+            error = np.concatenate((error_pos, error_rot))
+            q = np.clip(q + self.step(jacobian * self._weights[:, None], error), self.lower, self.upper)
+        self.pos, self.rot = current_pos, current_rot
+        self.info['iterations'] = iteration
+        self.info['error_mm'] = float(error_mm)
+        self.info['error_deg'] = float(np.degrees(error_w / self.rot_weight))
+        return q
+
+
+class CartesianJog(object):
+    """
+    Integra incrementos cartesianos del mando en un objetivo de tool0 y lo convierte
+    en articulaciones con DLSSolver en cada ciclo.
+
+    Si el objetivo se aleja de lo alcanzable (limites articulares, singularidad) mas
+    de 'windup' (mm, grados), se reancla a la pose alcanzada para que al invertir el
+    joystick el robot responda al momento, sin tener que deshacer el exceso acumulado.
+    """
+
+    def __init__(self, solver, joints, windup=(5.0, 2.0)):
+        self.solver = solver
+        self.windup = windup
+        self.reset(joints)
+
+    def reset(self, joints):
+        """Nuevo punto de partida (p.ej. tras una rampa del watchdog): el objetivo se recalcula"""
+        self.joints = np.array(joints, dtype=float)
+        self.pos = None
+        self.rot = None
+
+    def update(self, delta):
+        """delta = [dx, dy, dz] mm + [rx, ry, rz] grados en la base; devuelve las articulaciones"""
+        if self.pos is None:
+            self.pos, self.rot = self.solver.kinematics.forward(self.joints)
+        elif not np.any(delta):
+            return self.joints
+        self.pos = self.pos + delta[:3]
+        self.rot = rotation_matrix(np.radians(delta[3:])).dot(self.rot)
+        self.joints = self.solver.solve(self.joints, self.pos, self.rot)
+        info = self.solver.info
+        if info['error_mm'] > self.windup[0] or info['error_deg'] > self.windup[1]:
+            self.pos, self.rot = self.solver.pos, self.solver.rot
+        return self.joints
+
+    def pose(self):
+        """Pose objetivo como (trans, rot) de RAPID"""
+        return self.pos.tolist(), matrix_to_quat(self.rot).tolist()
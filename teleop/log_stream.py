@@ -0,0 +1,459 @@
+"""
+Descarga incremental del log de motion_program_logger.mod durante el programa.
+
+El logger escribe en RAMDISK:log-<timestamp>.bin una cabecera (version, timestamp
+y nombres de columna) y luego una fila de float32 cada 4 ms. read_motion_program_result_log
+baja el fichero entero al final, despues de stop_egm: en sesiones largas son
+varios MB justo al cerrar. LogStreamer lo va pidiendo por trozos (cabecera
+HTTP Range desde el ultimo byte recibido) en un hilo aparte mientras corre el
+programa; al cerrar solo queda por bajar la cola.
+
+Si el servidor no respeta Range (contesta 200 con el fichero entero) se recorta
+en local desde el offset: el resultado es el mismo, solo se ahorra menos red.
+Si nunca se llega a leer el fichero (p.ej. el logger esta desactivado) close()
+recurre a client.read_motion_program_result_log como antes. Si no, close() solo
+repasa el log de eventos del controlador desde 'lognum' (check_program_failed),
+como hace read_motion_program_result_log, para lanzar la excepcion si el
+programa ha fallado en lugar de devolver un log parcial.
+
+Con copy_to los bytes recibidos se van anadiendo tambien a una copia local,
+que LogFile abre con np.memmap y un dtype estructurado (una columna float32
+por nombre de la cabecera): abrir un log de horas no lee las filas, y
+time_slice busca el rango de tiempo con searchsorted sobre la columna
+'timestamp' y devuelve una vista, sin copiar.
+
+Para probar sin controlador, 'serve' levanta un sustituto local del fileservice
+de RWS (GET con Range, PUT y DELETE sobre un directorio, y ctrl/$RAMDISK) y
+puede simular el logger escribiendo filas a 250 Hz.
+
+Example:
+    lognum = client.execute_motion_program(mp, wait=False)
+    log_stream = LogStreamer.for_program(client, mp).start()
+    ...
+    client.stop_egm()
+    while client.is_motion_program_running():
+        time.sleep(0.05)
+    log_results = log_stream.close(client, lognum)
+
+    log = LogFile('log.bin')
+    window = log.time_slice(10.0, 20.0)    # vista de los registros entre 10 y 20 s
+    plt.plot(window['timestamp'], window['J1'])
+
+Uso:
+    python -m teleop.log_stream serve [--port 8080] [--dir carpeta] [--simulate segundos]
+    python -m teleop.log_stream fetch --timestamp 2024-01-01-12-00-00-0000 [--url http://127.0.0.1:80] [--copy log.bin]
+    python -m teleop.log_stream info log.bin [--start s] [--stop s]
+"""
+
+import argparse
+import bisect
+import json
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+LOG_FILE_VERSION = 10011  # MOTION_PROGRAM_FILE_VERSION de abb_motion_program_exec
+_NUM = struct.Struct('<f')
+
+
+def parse_header(data):
+    """(timestamp, columnas, bytes de cabecera) o None si aun no ha llegado entera"""
+    offset = 0
+    values = []
+    for kind in ('num', 'str', 'str'):
+        if len(data) < offset + 4:
+            return None
+        value = _NUM.unpack_from(data, offset)[0]
+        offset += 4
+        if kind == 'str':
+            length = int(value)
+            if len(data) < offset + length:
+                return None
+            value = bytes(data[offset:offset + length]).decode('ascii')
+            offset += length
+        values.append(value)
+    version, timestamp, header = values
+    if int(version) != LOG_FILE_VERSION:
+        raise ValueError("Version de log %d no soportada (se esperaba %d)" % (version, LOG_FILE_VERSION))
+    return timestamp, header.split(','), offset
+
+
+def check_program_failed(client, lognum):
+    """
+    Lanza una excepcion si el log de eventos del controlador posterior a 'lognum'
+    tiene un fallo del programa (la misma comprobacion que read_motion_program_result_log).
+    """
+    log_after = []
+    for entry in client.abb_client.read_event_log():
+        # lognum es un seqnum de 16 bits: tras 61440 puede haber dado la vuelta
+        if entry.seqnum > lognum or (lognum > 61440 and entry.seqnum < 4096):
+            log_after.append(entry)
+        else:
+            break
+    failed = False
+    for entry in log_after:
+        if entry.msgtype >= 2 and len(entry.args) > 0 and entry.args[0].lower() == "motion program failed":
+            raise Exception(" ".join(entry.args[1:5]))
+        if entry.msgtype >= 3:
+            failed = True
+    if failed:
+        raise Exception("Motion Program Failed, see robot error log for details")
+
+
+class LogStreamer(object):
+    """Va bajando por offset el log binario del logger y lo convierte en filas"""
+
+    def __init__(self, rws, filename, period=1.0, chunk=1 << 20, copy_to=None):
+        self.rws = rws
+        self.url = "/".join([rws.base_url, "fileservice", filename])
+        self.filename = filename
+        self.period = period
+        self.chunk = chunk
+        self.offset = 0          # bytes del fichero ya recibidos
+        self.ranged = True       # False si el servidor ignora Range
+        self.timestamp = None
+        self.columns = None
+        self.requests = 0
+        self._pending = bytearray()
+        self._chunks = []
+        self._rows = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._copy = open(copy_to, 'wb') if copy_to else None
+
+    @classmethod
+    def for_program(cls, client, mp, **kwargs):
+        """Streamer del log de 'mp' (el logger lo llama log-<timestamp del programa>.bin)"""
+        rws = client.abb_client
+        # el timestamp del programa es el que manda execute_motion_program al logger
+        filename = "%s/log-%s.bin" % (rws.get_ramdisk_path(), mp.get_timestamp())
+        return cls(rws, filename, **kwargs)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log_stream', daemon=True)
+        self._thread.start()
+        return self
+
+    @property
+    def rows(self):
+        return self._rows
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            try:
+                self.poll()
+            except Exception as e:  # la red no debe tumbar la sesion; se reintenta en el siguiente periodo
+                print("Log: error leyendo %s: %s" % (self.filename, e))
+
+    def _get(self):
+        """Siguiente trozo desde self.offset (b'' si no hay nada nuevo)"""
+        headers = {'Range': 'bytes=%d-%d' % (self.offset, self.offset + self.chunk - 1)}
+        # RWS.read_file no deja pasar cabeceras: misma sesion y autenticacion
+        res = self.rws._session.get(self.url, auth=self.rws.auth, headers=headers)
+        self.requests += 1
+        try:
+            if res.status_code in (404, 416):  # aun no existe / no hay bytes nuevos
+                return b''
+            if not res.ok:
+                raise Exception("HTTP %d" % res.status_code)
+            if res.status_code == 206:
+                return res.content
+            self.ranged = False
+            return res.content[self.offset:]
+        finally:
+            res.close()
+
+    def poll(self):
+        """Baja todo lo nuevo y devuelve el numero de filas anadidas"""
+        with self._lock:
+            added = 0
+            while True:
+                data = self._get()
+                if not data:
+                    break
+                self.offset += len(data)
+                if self._copy is not None:
+                    self._copy.write(data)
+                    self._copy.flush()
+                added += self._consume(data)
+                if len(data) < self.chunk or not self.ranged:
+                    break
+            return added
+
+    def _consume(self, data):
+        self._pending += data
+        if self.columns is None:
+            header = parse_header(self._pending)
+            if header is None:
+                return 0
+            self.timestamp, self.columns, size = header
+            del self._pending[:size]
+        row_bytes = 4 * len(self.columns)
+        count = len(self._pending) // row_bytes
+        if not count:
+            return 0
+        rows = np.frombuffer(bytes(self._pending[:count * row_bytes]), dtype=np.float32)
+        del self._pending[:count * row_bytes]
+        self._chunks.append(rows.reshape(count, len(self.columns)))
+        self._rows += count
+        return count
+
+    def data(self):
+        if not self._chunks:
+            return np.zeros((0, len(self.columns or ())), dtype=np.float32)
+        if len(self._chunks) > 1:
+            self._chunks = [np.vstack(self._chunks)]
+        return self._chunks[0]
+
+    def close(self, client=None, lognum=None, delete=True):
+        """
+        Para el hilo, baja la cola del fichero y devuelve un MotionProgramResultLog.
+        Llamar cuando el programa ya ha terminado (el logger ha cerrado el fichero).
+        Con client y lognum lanza una excepcion si el programa ha fallado.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.poll()
+        if self._copy is not None:
+            self._copy.close()
+        if self.columns is None:
+            if client is None:
+                raise Exception("No se ha podido leer el log %s" % self.filename)
+            print("Log: %s no disponible por trozos, se descarga entero" % self.filename)
+            return client.read_motion_program_result_log(lognum)
+        if client is not None and lognum is not None:
+            check_program_failed(client, lognum)
+        if delete:
+            try:
+                self.rws.delete_file(self.filename)
+            except Exception:
+                pass
+        print("Log: %d filas en %d peticiones (%.1f kB%s)" % (
+            self._rows, self.requests, self.offset / 1024.0, "" if self.ranged else ", sin Range"))
+        from abb_motion_program_exec.abb_motion_program_exec_client import MotionProgramResultLog
+        return MotionProgramResultLog(self.timestamp, self.columns, self.data())
+
+
+class LogFile(object):
+    """Log del logger en disco, mapeado en memoria: los registros solo se leen al usarlos"""
+
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(min(size, 4096))
+        header = parse_header(head)
+        if header is None:
+            raise ValueError("%s: cabecera incompleta" % path)
+        self.timestamp, self.columns, self.header_size = header
+        self.dtype = np.dtype([(name, '<f4') for name in self.columns])
+        # una fila a medio escribir al final (log copiado en marcha) se ignora
+        count = (size - self.header_size) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=self.header_size, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def span(self):
+        """(primer, ultimo) timestamp en s"""
+        if not len(self.records):
+            return None
+        return float(self.records['timestamp'][0]), float(self.records['timestamp'][-1])
+
+    def time_slice(self, start=None, stop=None):
+        """Vista de los registros con start <= timestamp < stop (busqueda binaria, sin recorrer el fichero)"""
+        # bisect y no np.searchsorted: la columna es una vista con paso y searchsorted la copiaria entera
+        times = self.records['timestamp']
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = len(times) if stop is None else bisect.bisect_left(times, stop)
+        return self.records[first:last]
+
+    def array(self, records=None):
+        """Registros como matriz float32 (n, columnas), tambien sin copiar"""
+        records = self.records if records is None else records
+        return records.view('<f4').reshape(len(records), len(self.columns))
+
+    def result(self, start=None, stop=None):
+        """MotionProgramResultLog de un rango de tiempo (lo que espera plot_log)"""
+        from abb_motion_program_exec.abb_motion_program_exec_client import MotionProgramResultLog
+        return MotionProgramResultLog(self.timestamp, self.columns, self.array(self.time_slice(start, stop)))
+
+
+def plot_log(log_results):
+    """Articulaciones y numero de comando frente al tiempo (matplotlib se importa aqui)"""
+    # log_results.data is a numpy array
+    import matplotlib.pyplot as plt
+    fig, ax1 = plt.subplots()
+    lns1 = ax1.plot(log_results.data[:, 0], log_results.data[:, 2:])
+    ax1.set_xlabel("Time (s)")
+    ax1.set_ylabel("Joint angle (deg)")
+    ax2 = ax1.twinx()
+    lns2 = ax2.plot(log_results.data[:, 0], log_results.data[:, 1], '-k')
+    ax2.set_ylabel("Command number")
+    ax2.set_yticks(range(-1, int(max(log_results.data[:, 1])) + 1))
+    ax1.legend(lns1 + lns2, log_results.column_headers[2:] + ["cmdnum"])
+    ax1.set_title("Joint motion")
+    plt.show()
+
+
+class _FileServiceHandler(BaseHTTPRequestHandler):
+    """fileservice de RWS sobre un directorio local (solo lo que usan el cliente y LogStreamer)"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _path(self):
+        path = self.path.split('?')[0]
+        if not path.startswith('/fileservice/'):
+            return None
+        name = os.path.basename(path)
+        return os.path.join(self.server.directory, name) if name else None
+
+    def _reply(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/ctrl/$RAMDISK':
+            body = json.dumps({'_embedded': {'_state': [{'_value': self.server.ramdisk}]}}).encode()
+            return self._reply(200, body, [('Content-Type', 'application/json')])
+        path = self._path()
+        if path is None or not os.path.isfile(path):
+            return self._reply(404)
+        with open(path, 'rb') as f:
+            data = f.read()
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match is None:
+            return self._reply(200, data)
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(data) - 1
+        if start >= len(data):
+            return self._reply(416, headers=[('Content-Range', 'bytes */%d' % len(data))])
+        end = min(end, len(data) - 1)
+        self._reply(206, data[start:end + 1], [('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))])
+
+    def do_PUT(self):
+        path = self._path()
+        if path is None:
+            return self._reply(404)
+        with open(path, 'wb') as f:
+            f.write(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        self._reply(201)
+
+    def do_DELETE(self):
+        path = self._path()
+        if path is None or not os.path.isfile(path):
+            return self._reply(404)
+        os.remove(path)
+        self._reply(204)
+
+
+def serve(directory, address='127.0.0.1', port=8080, ramdisk='$temp'):
+    """Sustituto local del fileservice del controlador; devuelve el servidor (serve_forever en un hilo)"""
+    server = ThreadingHTTPServer((address, port), _FileServiceHandler)
+    server.directory = directory
+    server.ramdisk = ramdisk
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("fileservice local en http://%s:%d (%s -> %s)" % (address, port, ramdisk, directory))
+    return server
+
+
+def write_header(f, timestamp, columns):
+    """Cabecera como motion_program_log_open (pack_num / pack_str)"""
+    f.write(_NUM.pack(LOG_FILE_VERSION))
+    for text in (timestamp, columns):
+        f.write(_NUM.pack(len(text)) + text.encode('ascii'))
+
+
+def simulate_logger(path, duration, timestamp, rate=250.0, robots=1):
+    """Escribe un log como motion_program_logger.mod: cabecera y una fila por muestra, volcando cada 20 ms"""
+    columns = "timestamp,cmdnum,J1,J2,J3,J4,J5,J6"
+    if robots >= 2:
+        columns += ",J1_2,J2_2,J3_2,J4_2,J5_2,J6_2"
+    width = len(columns.split(','))
+    period = 1.0 / rate
+    with open(path, 'wb') as f:
+        write_header(f, timestamp, columns)
+        t0 = time.perf_counter()
+        n = 0
+        while n * period < duration:
+            t = n * period
+            row = np.zeros(width, dtype=np.float32)
+            row[0], row[1] = t, 1 + int(t)
+            row[2:] = 10.0 * np.sin(t + np.arange(width - 2))
+            f.write(row.tobytes())
+            n += 1
+            if n % 5 == 0:
+                f.flush()
+                time.sleep(max(0.0, t0 + n * period - time.perf_counter()))
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log de motion_program_logger por trozos")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_serve = sub.add_parser('serve', help="sustituto local del fileservice del controlador")
+    p_serve.add_argument('--port', type=int, default=8080)
+    p_serve.add_argument('--dir', help="carpeta que hace de RAMDISK (por defecto una temporal)")
+    p_serve.add_argument('--simulate', type=float, metavar='SEGUNDOS', help="simula el logger durante SEGUNDOS")
+    p_fetch = sub.add_parser('fetch', help="sigue un log por trozos hasta que deja de crecer")
+    p_fetch.add_argument('--timestamp', required=True, help="timestamp del programa (log-<timestamp>.bin)")
+    p_fetch.add_argument('--url', default="http://127.0.0.1:80")
+    p_fetch.add_argument('--period', type=float, default=1.0)
+    p_fetch.add_argument('--copy', metavar='FICHERO', help="copia local del log (para abrirla con LogFile)")
+    p_info = sub.add_parser('info', help="resumen de un log local, opcionalmente de un rango de tiempo")
+    p_info.add_argument('path')
+    p_info.add_argument('--start', type=float)
+    p_info.add_argument('--stop', type=float)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        directory = args.dir or tempfile.mkdtemp(prefix='ramdisk_')
+        server = serve(directory, port=args.port)
+        try:
+            if args.simulate:
+                timestamp = time.strftime("%Y-%m-%d-%H-%M-%S-0000")
+                print("Simulando log-%s.bin" % timestamp)
+                print("Filas escritas: %d" % simulate_logger(
+                    os.path.join(directory, "log-%s.bin" % timestamp), args.simulate, timestamp))
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif args.command == 'info':
+        log = LogFile(args.path)
+        window = log.time_slice(args.start, args.stop)
+        print("%s: %d registros, columnas %s" % (log.timestamp, len(log), ",".join(log.columns)))
+        if len(window):
+            print("rango %.3f-%.3f s: %d registros, cmdnum %d-%d" % (
+                window['timestamp'][0], window['timestamp'][-1], len(window),
+                window['cmdnum'][0], window['cmdnum'][-1]))
+    else:
+        from abb_robot_client.rws import RWS
+        rws = RWS(args.url)
+        stream = LogStreamer(rws, "%s/log-%s.bin" % (rws.get_ramdisk_path(), args.timestamp), period=args.period,
+                             copy_to=args.copy)
+        idle = 0
+        while idle < 3:
+            time.sleep(args.period)
+            added = stream.poll()
+            idle = 0 if added else idle + 1
+            print("%d filas (+%d)" % (stream.rows, added))
+        stream.close(delete=False)
@@ -0,0 +1,241 @@
+"""
+Mapa de manipulabilidad del IRB-1200 precalculado, para frenar el modo pose
+cerca de las singularidades.
+
+En el modo pose el controlador resuelve la cinematica inversa y, si el brazo
+llega a una singularidad, el programa se para. Para evitarlo sin calcular el
+jacobiano en cada ciclo, se precalcula fuera de linea una rejilla 3D sobre la
+posicion de tool0 (con la orientacion de referencia del modo pose) con dos
+medidas del jacobiano de la configuracion que la alcanza:
+
+    manipulability     |det J| normalizado al maximo de la rejilla
+    inverse_condition  s_min / s_max del jacobiano (orientacion pesada en mm/rad)
+
+Las celdas inalcanzables (o fuera de los limites articulares) valen 0. La rejilla
+se guarda como .npy (float32, (nx, ny, nz, 2)) con un .json al lado (origen, paso,
+orientacion, geometria) y se abre con np.load(mmap_mode='r'): el bucle EGM solo
+lee las 8 celdas de alrededor del objetivo (interpolacion trilineal).
+
+La configuracion de cada celda sale de la cinematica inversa analitica (muñeca
+esferica): frontal, codo arriba y J5 >= 0 (o la muñeca girada si asi entra en los
+limites). La orientacion del modo pose cambia al mover Q1-Q3, pero las
+singularidades de hombro y codo solo dependen de la posicion; la de muñeca se
+evalua para la orientacion de referencia.
+
+Uso:
+    python -m teleop.manipulability build [--spacing 20] [--geometry IRB1200_7_70] [--out mapa.npy]
+    python -m teleop.manipulability info [mapa.npy]
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from teleop.kinematics import GEOMETRIES, JOINT_LIMITS, Kinematics, quat_to_matrix
+
+MAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps')
+CHANNELS = ('manipulability', 'inverse_condition')
+# orientacion de tool0 de egm_pose_target (r1)
+POSE_ORIENTATION = (0.7071068, 0.0, 0.7071068, 0.0)
+ROT_WEIGHT = 100.0  # mm por radian, como DLSSolver
+
+
+def default_path(geometry='IRB1200_7_70'):
+    """Ruta del mapa: TELEOP_MANIPULABILITY_MAP o teleop/maps/<geometria>.npy"""
+    return os.environ.get('TELEOP_MANIPULABILITY_MAP') or os.path.join(MAP_DIR, geometry + '.npy')
+
+
+def inverse_kinematics(kinematics, pos, rot):
+    """
+    Cinematica inversa analitica (vectorizada) de la muñeca esferica: articulaciones
+    (..., 6) en grados y mascara de alcanzables. Frontal, codo arriba, J5 >= 0; si asi
+    no entra en los limites se prueba con la muñeca girada (J4 + 180, -J5, J6 + 180).
+    """
+    g = kinematics.geometry
+    d1, a2, a3, d4, d6 = g['d1'], g['a2'], g['a3'], g['d4'], g['d6']
+    pos = np.asarray(pos, dtype=float)
+    rot = np.broadcast_to(rot, pos.shape[:-1] + (3, 3))
+    # centro de la muñeca: tool0 retrocedido d6 sobre su eje z
+    wrist = pos - d6 * rot[..., :, 2]
+    q1 = np.arctan2(wrist[..., 1], wrist[..., 0])
+    r = np.hypot(wrist[..., 0], wrist[..., 1])
+    h = wrist[..., 2] - d1
+    # codo: |centro - hombro|^2 = a2^2 + L^2 - 2 a2 L sin(q3 - phi0)
+    length, phi0 = np.hypot(d4, a3), np.arctan2(a3, d4)
+    k = (a2 * a2 + length * length - r * r - h * h) / (2.0 * a2 * length)
+    reachable = np.abs(k) <= 1.0
+    q3 = phi0 + np.arcsin(np.clip(k, -1.0, 1.0))
+    beta = np.pi / 2 - phi0 + q3
+    q2 = np.pi / 2 - (np.arctan2(h, r) + np.arctan2(length * np.sin(beta), a2 + length * np.cos(beta)))
+    # muñeca: Rx(q4) Ry(q5) Rx(q6) = (Rz(q1) Ry(q2 + q3))^T R R_home^T
+    c1, s1, c23, s23 = np.cos(q1), np.sin(q1), np.cos(q2 + q3), np.sin(q2 + q3)
+    arm = np.zeros(q1.shape + (3, 3))
+    arm[..., 0, 0], arm[..., 0, 1], arm[..., 0, 2] = c1 * c23, -s1, c1 * s23
+    arm[..., 1, 0], arm[..., 1, 1], arm[..., 1, 2] = s1 * c23, c1, s1 * s23
+    arm[..., 2, 0], arm[..., 2, 2] = -s23, c23
+    w = np.matmul(np.matmul(np.swapaxes(arm, -1, -2), rot), kinematics.home[:3, :3].T)
+    q4 = np.arctan2(w[..., 1, 0], -w[..., 2, 0])
+    q5 = np.arctan2(np.hypot(w[..., 0, 1], w[..., 0, 2]), w[..., 0, 0])
+    q6 = np.arctan2(w[..., 0, 1], w[..., 0, 2])
+    joints = np.degrees(np.stack((q1, q2, q3, q4, q5, q6), -1))
+    flipped = joints + np.array([0.0, 0.0, 0.0, 180.0, 0.0, 180.0])
+    flipped[..., 4] *= -1.0
+    flipped[..., [3, 5]] = (flipped[..., [3, 5]] + 180.0) % 360.0 - 180.0
+    lower, upper = JOINT_LIMITS[:, 0], JOINT_LIMITS[:, 1]
+    inside = np.all((joints >= lower) & (joints <= upper), -1)
+    use_flip = ~inside & np.all((flipped >= lower) & (flipped <= upper), -1)
+    joints = np.where(use_flip[..., None], flipped, joints)
+    return joints, reachable & (inside | use_flip)
+
+
+def build_map(geometry='IRB1200_7_70', spacing=20.0, orientation=POSE_ORIENTATION, path=None, chunk=20000):
+    """Calcula la rejilla y la guarda (memmap .npy + .json); devuelve la ruta"""
+    kinematics = Kinematics(geometry)
+    g = kinematics.geometry
+    path = path or default_path(geometry)
+    rot = quat_to_matrix(orientation)
+    # caja que contiene todo el alcance de tool0 alrededor del hombro
+    reach = g['a2'] + np.hypot(g['d4'], g['a3']) + g['d6']
+    origin = np.array([-reach, -reach, g['d1'] - reach])
+    shape = tuple(int(np.ceil(2.0 * reach / spacing)) + 1 for _ in range(3))
+    axes = [origin[i] + spacing * np.arange(shape[i]) for i in range(3)]
+
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    grid = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape + (len(CHANNELS),))
+    flat = grid.reshape(-1, len(CHANNELS))
+    weights = np.array([1.0, 1.0, 1.0, ROT_WEIGHT, ROT_WEIGHT, ROT_WEIGHT])
+    n = int(np.prod(shape))
+    for start in range(0, n, chunk):
+        index = np.unravel_index(np.arange(start, min(n, start + chunk)), shape)
+        pos = np.stack([axes[i][index[i]] for i in range(3)], -1)
+        joints, valid = inverse_kinematics(kinematics, pos, rot)
+        values = np.zeros((len(pos), len(CHANNELS)))
+        if valid.any():
+            jacobian = kinematics.jacobian(joints[valid]) * weights[:, None]
+            s = np.linalg.svd(jacobian, compute_uv=False)
+            values[valid, 0] = np.prod(s, -1)
+            values[valid, 1] = s[:, -1] / s[:, 0]
+        flat[start:start + len(pos)] = values
+    peak = float(flat[:, 0].max())
+    if peak > 0.0:
+        flat[:, 0] /= peak
+    grid.flush()
+    del flat, grid
+
+    meta = {'geometry': geometry, 'orientation': list(orientation), 'origin': origin.tolist(),
+            'spacing': spacing, 'shape': list(shape), 'channels': list(CHANNELS),
+            'rot_weight': ROT_WEIGHT, 'manipulability_peak': peak, 'date': time.strftime('%Y-%m-%d')}
+    with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+        f.write('\n')
+    return path
+
+
+class ManipulabilityMap(object):
+    """
+    Rejilla precalculada abierta como memmap. lookup() interpola una medida en una
+    posicion; speed_scale() da el factor de velocidad para ir de una posicion a otra:
+    1 lejos de las singularidades, bajando a 'floor' segun inverse_condition cae de
+    'high' a 'low', y siempre 1 si el movimiento se aleja de la singularidad (para
+    poder salir de ella).
+    """
+
+    def __init__(self, path, low=0.01, high=0.04, floor=0.0, channel='inverse_condition'):
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.grid = np.load(path, mmap_mode='r')
+        self.origin = np.array(self.meta['origin'])
+        self.spacing = float(self.meta['spacing'])
+        # vista ndarray del memmap (trocear un np.memmap es mas lento) y cotas como escalares
+        self._data = self.grid.view(np.ndarray)
+        self._origin = self.origin.tolist()
+        self._limit = [n - 2 for n in self.meta['shape']]
+        self.channel = self.meta['channels'].index(channel)
+        self.low, self.high, self.floor = low, high, floor
+        self.value = None
+        self.scale = 1.0
+
+    @classmethod
+    def load(cls, path=None, geometry='IRB1200_7_70', **kwargs):
+        """Abre el mapa por defecto (o 'path'); None si no se ha generado todavia"""
+        path = path or default_path(geometry)
+        if not os.path.isfile(path):
+            print("Sin mapa de manipulabilidad (%s): genera uno con 'python -m teleop.manipulability build'" % path)
+            return None
+        return cls(path, **kwargs)
+
+    def lookup(self, pos):
+        """Medida interpolada (trilineal) en la posicion de tool0 (mm); 0 fuera de la rejilla"""
+        # aritmetica de escalares de Python: con 3 valores es mas rapida que numpy
+        fx, fy, fz = [(p - o) / self.spacing for p, o in zip(pos, self._origin)]
+        x, y, z = math.floor(fx), math.floor(fy), math.floor(fz)
+        if not (0 <= x <= self._limit[0] and 0 <= y <= self._limit[1] and 0 <= z <= self._limit[2]):
+            return 0.0
+        tx, ty, tz = fx - x, fy - y, fz - z
+        c = self._data[x:x + 2, y:y + 2, z:z + 2, self.channel].tolist()
+        c00 = c[0][0][0] + (c[1][0][0] - c[0][0][0]) * tx
+        c01 = c[0][0][1] + (c[1][0][1] - c[0][0][1]) * tx
+        c10 = c[0][1][0] + (c[1][1][0] - c[0][1][0]) * tx
+        c11 = c[0][1][1] + (c[1][1][1] - c[0][1][1]) * tx
+        c0 = c00 + (c10 - c00) * ty
+        c1 = c01 + (c11 - c01) * ty
+        return c0 + (c1 - c0) * tz
+
+    def speed_scale(self, current, target):
+        """Factor (0-1) para el incremento que lleva tool0 de 'current' a 'target'"""
+        now, then = self.lookup(current), self.lookup(target)
+        self.value = then
+        if then >= now or then >= self.high:
+            self.scale = 1.0
+        else:
+            self.scale = min(1.0, max(self.floor, (then - self.low) / (self.high - self.low)))
+        return self.scale
+
+    def telemetry(self):
+        """Estado para teleop.telemetry"""
+        return {'value': None if self.value is None else round(self.value, 4), 'scale': round(self.scale, 3)}
+
+
+def info(path):
+    grid = np.load(path, mmap_mode='r')
+    with open(os.path.splitext(path)[0] + '.json') as f:
+        meta = json.load(f)
+    print("%s: rejilla %s con paso %g mm desde %s, %.1f MB" % (
+        path, "x".join(map(str, meta['shape'])), meta['spacing'], meta['origin'], grid.nbytes / 1e6))
+    print("geometria %s, orientacion %s, generado %s" % (meta['geometry'], meta['orientation'], meta['date']))
+    for i, name in enumerate(meta['channels']):
+        values = np.asarray(grid[..., i])
+        reachable = values[values > 0]
+        print("%-18s alcanzable %.1f %%, percentiles 5/50/95: %s" % (
+            name, 100.0 * reachable.size / values.size, np.percentile(reachable, (5, 50, 95)).round(4).tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mapa de manipulabilidad precalculado del IRB-1200")
+    commands_parser = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands_parser.add_parser('build', help="calcula y guarda la rejilla")
+    build_parser.add_argument('--geometry', default='IRB1200_7_70', choices=sorted(GEOMETRIES))
+    build_parser.add_argument('--spacing', type=float, default=20.0, help="paso de la rejilla en mm")
+    build_parser.add_argument('--orientation', type=float, nargs=4, default=POSE_ORIENTATION,
+                              metavar=('Q1', 'Q2', 'Q3', 'Q4'), help="orientacion de tool0 de referencia")
+    build_parser.add_argument('--out', help="ruta del .npy (por defecto %s)" % default_path())
+    info_parser = commands_parser.add_parser('info', help="resume un mapa ya generado")
+    info_parser.add_argument('path', nargs='?')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        info(args.path or default_path())
+        sys.exit(0)
+
+    t0 = time.perf_counter()
+    path = build_map(args.geometry, args.spacing, tuple(args.orientation), args.out)
+    print("Mapa guardado en %s en %.1f s" % (path, time.perf_counter() - t0))
+    info(path)
@@ -0,0 +1,172 @@
+"""
+Mapeos de entrada configurables (perfiles JSON) compilados al arrancar.
+
+Un perfil asigna ejes y botones del mensaje del mando a las salidas del bucle
+EGM (articulaciones o pose) y nombra los botones de evento (gain, modo,
+salida). Al cargarlo se compila en arrays planos: nombres de los ejes, mascaras
+de los botones y una matriz de escalas, de modo que el bucle obtiene el
+incremento de las seis salidas con un producto matriz-vector y sin cadenas de
+'if state['buttons'] & ...'.
+
+Los perfiles se buscan por nombre en los directorios de la variable de entorno
+TELEOP_PROFILES (separados por os.pathsep) y despues en teleop/profiles; tambien
+se puede pasar la ruta de un fichero .json.
+
+Formato:
+    {
+        "buttons": "mask" | "list",        # entero con bits (Xbox) o lista de 0/1 (SpaceNavigator)
+        "outputs": ["J1", ..., "J6"],
+        "axis_map": [{"axis": "l_thumb_x", "output": "J1", "scale": 1.0, "gain": true}, ...],
+        "button_map": [{"mask": "0x0001", "output": "J5", "scale": 1.0, "gain": true}, ...],
+        "limits": {"J1": [-170, 170], ...},             # opcional, sobre el objetivo absoluto
+        "curves": {"x": {"deadzone": 0.5, "expo": 0.3}},  # opcional, ver teleop.shaping
+        "events": {"gain_down": "0x0040", "exit": "0x0010", ...}
+    }
+
+Las entradas con "gain": true (por defecto) se multiplican por el gain activo.
+Un evento se dispara en el flanco de subida de su mascara completa (una mascara
+con varios bits es un acorde); los botones pulsados al arrancar se ignoran hasta
+que se sueltan.
+
+Example:
+    mapping = load_mapping('xbox_joint')
+    axes, buttons = mapping.read(state)
+    for event in mapping.events(buttons):
+        ...
+    target = mapping.clip(target + mapping.delta(axes, buttons, gain))
+"""
+
+import json
+import os
+from operator import itemgetter
+
+import numpy as np
+
+from teleop.shaping import AxisCurve, ResponseShaper
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+
+
+def _mask(value):
+    """Las mascaras se escriben en JSON como entero o como texto ('0x0040')"""
+    return int(value, 0) if isinstance(value, str) else int(value)
+
+
+def find_profile(name):
+    """Ruta del perfil 'name' (nombre o ruta a un .json)"""
+    if os.path.isfile(name):
+        return name
+    directories = [d for d in os.environ.get('TELEOP_PROFILES', '').split(os.pathsep) if d]
+    for directory in directories + [PROFILE_DIR]:
+        path = os.path.join(directory, name + '.json')
+        if os.path.isfile(path):
+            return path
+    raise ValueError("No se encuentra el perfil de mapeo '%s' (buscado en %s)" % (
+        name, ", ".join(directories + [PROFILE_DIR])))
+
+
+def load_mapping(name):
+    """Carga y compila un perfil por nombre o ruta"""
+    path = find_profile(name)
+    with open(path) as f:
+        profile = json.load(f)
+    return InputMapping(profile, name=os.path.splitext(os.path.basename(path))[0])
+
+
+class InputMapping(object):
+    """Perfil de mapeo compilado"""
+
+    def __init__(self, profile, name=None):
+        self.name = name
+        self.profile = profile
+        self.outputs = list(profile['outputs'])
+        output_index = {output: i for i, output in enumerate(self.outputs)}
+        axis_map = profile.get('axis_map', [])
+        button_map = profile.get('button_map', [])
+
+        # ejes en el orden de su primera aparicion
+        self.axes = []
+        for entry in axis_map:
+            if entry['axis'] not in self.axes:
+                self.axes.append(entry['axis'])
+        self.axis_index = {axis: i for i, axis in enumerate(self.axes)}
+        self._get_axes = itemgetter(*self.axes) if len(self.axes) > 1 else (lambda state: (state[self.axes[0]],))
+        self.list_buttons = profile.get('buttons', 'mask') == 'list'
+
+        # curvas de respuesta opcionales, en el orden de self.axes
+        curves = profile.get('curves', {})
+        unknown = set(curves) - set(self.axes)
+        if unknown:
+            raise ValueError("Curvas para ejes que no se usan en el perfil: %s" % ", ".join(sorted(unknown)))
+        self.shaper = ResponseShaper([AxisCurve(**curves.get(axis, {})) for axis in self.axes]) if curves else None
+
+        # mascaras de los botones que mueven salidas
+        self.masks = np.array([_mask(entry['mask']) for entry in button_map], dtype=np.int64)
+
+        # matriz de escalas: filas [salidas con gain; salidas sin gain], columnas [ejes; botones]
+        n = len(self.outputs)
+        self.matrix = np.zeros((2 * n, len(self.axes) + len(button_map)))
+        columns = [self.axis_index[entry['axis']] for entry in axis_map] + \
+            list(range(len(self.axes), len(self.axes) + len(button_map)))
+        for column, entry in zip(columns, axis_map + button_map):
+            try:
+                row = output_index[entry['output']]
+            except KeyError:
+                raise ValueError("Salida desconocida '%s' en el perfil %s" % (entry['output'], name))
+            if not entry.get('gain', True):
+                row += n
+            self.matrix[row, column] += float(entry.get('scale', 1.0))
+        self._n_outputs = n
+        self._inputs = np.zeros(self.matrix.shape[1])
+        self._pressed = self._inputs[len(self.axes):]
+
+        # limites sobre el objetivo absoluto (sin limite: +-inf)
+        limits = profile.get('limits', {})
+        self.lower = np.array([limits.get(output, (-np.inf, np.inf))[0] for output in self.outputs], dtype=float)
+        self.upper = np.array([limits.get(output, (-np.inf, np.inf))[1] for output in self.outputs], dtype=float)
+
+        # eventos por flanco de subida
+        self.event_masks = tuple((event, _mask(mask)) for event, mask in profile.get('events', {}).items())
+        # None hasta el primer mensaje: un boton que ya esta pulsado al arrancar (p.ej. el
+        # de cambio de modo que nos ha traido aqui) no cuenta hasta que se suelte
+        self._previous_buttons = None
+
+    def read(self, state):
+        """Extrae del mensaje los ejes (ya conformados si el perfil tiene curvas) y la mascara de botones"""
+        axes = self._get_axes(state)
+        if self.shaper is not None:
+            axes = self.shaper.apply(axes)
+        buttons = state['buttons']
+        if self.list_buttons:
+            buttons = sum(pressed << bit for bit, pressed in enumerate(buttons))
+        return axes, buttons
+
+    def events(self, buttons):
+        """Nombres de los eventos cuyo boton (o acorde) se acaba de pulsar"""
+        previous = self._previous_buttons
+        if buttons == previous:
+            return ()
+        self._previous_buttons = buttons
+        if previous is None:
+            return ()
+        return tuple(event for event, mask in self.event_masks
+                     if buttons & mask == mask and previous & mask != mask)
+
+    def delta(self, axes, buttons, gain=1.0):
+        """Incremento de cada salida para esta muestra"""
+        inputs = self._inputs
+        inputs[:len(self.axes)] = axes
+        np.not_equal(np.bitwise_and(buttons, self.masks), 0, out=self._pressed, casting='unsafe')
+        result = self.matrix.dot(inputs)
+        n = self._n_outputs
+        return result[:n] * gain + result[n:]
+
+    def clip(self, target):
+        """Aplica los limites del perfil al objetivo absoluto"""
+        target = np.maximum(target, self.lower)
+        return np.minimum(target, self.upper, out=target)
+
+    def at_limit(self, target):
+        """Salidas cuyo objetivo esta en un limite del perfil (para teleop.feedback)"""
+        target = np.asarray(target, dtype=float)
+        return [output for output, at in zip(self.outputs, (target <= self.lower) | (target >= self.upper)) if at]
@@ -0,0 +1,108 @@
+"""
+Modo monitor: escucha el flujo de estado EGM sin mandar correcciones.
+
+motion_program_exec_egm.mod arranca EGMStreamStart (SampleRate:=egm_sample_rate,
+4 ms) despues de cada EGMRun y en los programas creados con
+egm_config=abb.EGMStreamConfig(). En ese modo el robot manda su estado por UDP
+pero no espera respuesta, asi que se puede observar el brazo durante un
+programa normal sin pasar por el log HTTP de read_motion_program_result_log.
+
+El monitor solo recibe (nunca llama a send_to_robot*) y publica cada mensaje:
+    - en un canal de memoria compartida con los campos de teleop.shm.EGM_FEEDBACK
+      y modo 'monitor', a la frecuencia completa del flujo (lo leen el registro
+      y cualquier otro proceso con ShmChannel.attach);
+    - en la telemetria TCP (puerto 5002) para x_controller_display.py y
+      s_nav_display.py, submuestreada como siempre;
+    - opcionalmente en un .npz con todas las muestras (teleop.pipeline.record_stage).
+
+Usa el mismo puerto UDP que los bucles EGM (6510): no puede correr a la vez que
+una sesion de teleoperacion.
+
+Uso:
+    python -m teleop.monitor [--port 6510] [--record fichero.npz] [--channel nombre] [--duration s]
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from teleop.pipeline import FeedbackPublisher, record_stage
+from teleop.shm import EGM_FEEDBACK, ShmChannel
+from teleop.telemetry import TelemetryPublisher
+
+
+def run_monitor(port=6510, record=None, channel_name=None, telemetry=True, duration=None, timeout=1.0):
+    from abb_robot_client.egm import EGM
+
+    channel = ShmChannel.create(channel_name or 'teleop_monitor', EGM_FEEDBACK)
+    publisher = FeedbackPublisher(channel)
+    tcp = TelemetryPublisher().start() if telemetry else None
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    recorder = None
+    if record:
+        recorder = context.Process(target=record_stage, args=(channel.name, record, stop), name='registro')
+        recorder.start()
+    print("Monitor EGM en el puerto %d, estado en el canal %s" % (port, channel.name))
+
+    egm = EGM(port)
+    count = 0
+    waiting = True
+    t_start = t_last = None
+    max_gap = 0.0
+    try:
+        while duration is None or t_start is None or time.perf_counter() - t_start < duration:
+            res, feedback = egm.receive_from_robot(timeout=timeout)
+            if not res:
+                if not waiting:
+                    print("Flujo EGM interrumpido tras %d mensajes" % count)
+                    waiting = True
+                continue
+            t_rx = time.perf_counter()
+            if waiting:
+                print("Recibiendo el flujo EGM")
+                waiting = False
+            elif t_last is not None:
+                max_gap = max(max_gap, t_rx - t_last)
+            if t_start is None:
+                t_start = t_rx
+            t_last = t_rx
+            count += 1
+            if feedback.cartesian is None:
+                continue
+            publisher.update(feedback, mode='monitor')
+            if tcp is not None:
+                tcp.update(feedback, mode='monitor')
+            elapsed = time.perf_counter() - t_rx
+            publisher.add_latency(elapsed)
+            if tcp is not None:
+                tcp.add_latency(elapsed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        channel.mark_closed()
+        if recorder is not None:
+            recorder.join(timeout=5.0)
+        if tcp is not None:
+            tcp.close()
+        channel.close()
+        egm.close()
+    if count > 1:
+        span = t_last - t_start
+        print("%d mensajes en %.1f s (%.1f Hz), mayor hueco %.1f ms" % (
+            count, span, (count - 1) / span if span > 0 else np.nan, max_gap * 1000.0))
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitor del flujo de estado EGM (sin correcciones)")
+    parser.add_argument('--port', type=int, default=6510, help="puerto UDP del flujo EGM")
+    parser.add_argument('--record', metavar='FICHERO', help="guarda todas las muestras en un .npz")
+    parser.add_argument('--channel', help="nombre del canal de memoria compartida (por defecto teleop_monitor)")
+    parser.add_argument('--no-telemetry', action='store_true', help="sin telemetria TCP para los displays")
+    parser.add_argument('--duration', type=float, help="segundos de flujo a escuchar (por defecto, hasta Ctrl+C)")
+    args = parser.parse_args()
+    run_monitor(args.port, args.record, args.channel, not args.no_telemetry, args.duration)
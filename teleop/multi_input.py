@@ -0,0 +1,379 @@
+"""
+Varios dispositivos de entrada a la vez, fusionados en un unico flujo de comandos.
+
+Cada dispositivo tiene su propio lector (un hilo para el mando Xbox, el hilo de
+HID para el SpaceMouse) que deja su ultima muestra en un CommandMerger. El
+merger aplica una politica de arbitraje configurable por canal (traslacion,
+rotacion, botones) y un boton de hombre muerto opcional, y publica un comando
+con marca de tiempo en el formato de 6 ejes del SpaceNavigator, por lo que
+egm_s_nav.py lo consume sin cambios.
+
+Formato del comando (una linea JSON por mensaje):
+    {'t', 'seq', 'x', 'y', 'z', 'roll', 'pitch', 'yaw', 'buttons': [bajar_gain, subir_gain, ...],
+     'deadman', 'mode', 'age', 'sources': {'translation', 'rotation', 'buttons'}}
+
+Uso (SpaceMouse para mover, mando Xbox para gain/modo y LB como hombre muerto):
+    python -m teleop.multi_input --device spacenav --device xbox --buttons xbox --deadman xbox:0x0100
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from teleop.backends import XINPUT_STATE, ERROR_SUCCESS, get_backend
+from teleop.stream import LinkStats
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# muestra normalizada de un dispositivo
+# translation/rotation: tuplas de 3 floats, buttons: lista de 0/1 en el formato del
+# SpaceNavigator ([bajar_gain, subir_gain, ...]), raw_buttons: mascara nativa del dispositivo
+# (en el SpaceNavigator el boton i de la lista es el bit i, como en InputMapping.read)
+InputSample = namedtuple("InputSample", ["t", "source", "translation", "rotation", "buttons", "raw_buttons", "mode"])
+
+ZERO3 = (0.0, 0.0, 0.0)
+
+# botones del mando Xbox que egm_interface_Xbox.py usa para gain y modo
+XBOX_GAIN_DOWN = 0x0040
+XBOX_GAIN_UP = 0x0080
+XBOX_MODE = 0x0020
+XBOX_DPAD_LEFT = 0x0004
+XBOX_DPAD_RIGHT = 0x0008
+
+
+def source_name(spec):
+    """'xbox' -> 'xbox:0'; los nombres de fuente siempre llevan el indice del dispositivo"""
+    return spec if ':' in spec else spec + ':0'
+
+
+class DeviceReader(object):
+    """Lector de un dispositivo: entrega cada muestra nueva a merger.update()"""
+
+    def __init__(self, source, merger):
+        self.source = source
+        self.merger = merger
+        self.running = False
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+class XboxReader(DeviceReader):
+    """
+    Lee un mando con el backend de teleop.backends en un hilo propio, bloqueando
+    hasta que llega un paquete nuevo (epoll con evdev).
+    """
+
+    def __init__(self, source, merger, device_number=0, backend=None, timeout=0.05):
+        super(XboxReader, self).__init__(source, merger)
+        self.device_number = device_number
+        self.backend = backend or get_backend('gamepad')
+        self.timeout = timeout
+        self.cartesian_mode = True
+        self._thread = None
+
+    def start(self):
+        super(XboxReader, self).start()
+        self._thread = threading.Thread(target=self._run, name='reader-' + self.source, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        state = XINPUT_STATE()
+        packet_number = None
+        previous = 0
+        while self.running:
+            if packet_number is not None:
+                self.backend.wait(self.device_number, packet_number, self.timeout)
+            if self.backend.get_state(self.device_number, state) != ERROR_SUCCESS:
+                # mando desconectado: se deja de publicar y la muestra anterior envejece
+                packet_number = None
+                time.sleep(self.timeout)
+                continue
+            # aunque no haya paquete nuevo se vuelve a publicar el estado: el mando sigue
+            # conectado y mantener la palanca quieta no debe envejecer la muestra
+            packet_number = state.packet_number
+            gamepad = state.gamepad
+            buttons = gamepad.buttons
+            # el boton 'back' alterna el modo cartesiano como en XInputJoystick
+            if buttons & XBOX_MODE and not previous & XBOX_MODE:
+                self.cartesian_mode = not self.cartesian_mode
+            previous = buttons
+            self.merger.update(InputSample(
+                time.perf_counter(), self.source,
+                (gamepad.l_thumb_x / 32767.0, gamepad.l_thumb_y / 32767.0,
+                 (gamepad.right_trigger - gamepad.left_trigger) / 255.0),
+                (gamepad.r_thumb_x / 32767.0, gamepad.r_thumb_y / 32767.0,
+                 (1.0 if buttons & XBOX_DPAD_RIGHT else 0.0) - (1.0 if buttons & XBOX_DPAD_LEFT else 0.0)),
+                [1 if buttons & XBOX_GAIN_DOWN else 0, 1 if buttons & XBOX_GAIN_UP else 0],
+                buttons, 'cartesian' if self.cartesian_mode else 'joint'))
+
+
+class SpaceNavigatorReader(DeviceReader):
+    """
+    Adapta un DeviceSpec abierto de space_navigator.py: el hilo HID del
+    dispositivo llama a on_state con cada estado nuevo. El dispositivo solo
+    envia reports cuando cambia, asi que un hilo de latido vuelve a publicar el
+    ultimo estado mientras siga conectado.
+    """
+
+    def __init__(self, source, merger, device, heartbeat=0.05):
+        super(SpaceNavigatorReader, self).__init__(source, merger)
+        self.device = device
+        self.heartbeat = heartbeat
+        self.last = None
+
+    def start(self):
+        super(SpaceNavigatorReader, self).start()
+        self.device.callback = self.on_state
+        threading.Thread(target=self._run_heartbeat, name='heartbeat-' + self.source, daemon=True).start()
+
+    def stop(self):
+        super(SpaceNavigatorReader, self).stop()
+        self.device.callback = None
+
+    def on_state(self, state):
+        self.last = InputSample(
+            state.t, self.source,
+            (state.x, state.y, state.z), (state.roll, state.pitch, state.yaw),
+            list(state.buttons), sum(pressed << bit for bit, pressed in enumerate(state.buttons)), None)
+        self.merger.update(self.last)
+
+    def _run_heartbeat(self):
+        while self.running:
+            time.sleep(self.heartbeat)
+            last = self.last
+            if last is not None and self.device.connected and time.perf_counter() - last.t >= self.heartbeat:
+                self.merger.update(last._replace(t=time.perf_counter()))
+
+
+class ArbitrationPolicy(object):
+    """
+    Decide que fuente aporta cada canal del comando.
+
+    channels: canal -> lista de fuentes en orden de preferencia
+        ('translation', 'rotation' y 'buttons')
+    mode: como se combinan las fuentes de los canales de movimiento
+        'priority' - la primera fuente con el canal activo (|v| > threshold)
+        'latest'   - la fuente activa con la muestra mas reciente
+        'sum'      - suma de todas las fuentes
+    deadman: (fuente, mascara) que debe estar pulsada para que haya movimiento
+    stale_after: segundos tras los que una muestra deja de contar
+    """
+    MODES = ('priority', 'latest', 'sum')
+
+    def __init__(self, translation, rotation=None, buttons=None, mode='priority',
+                 deadman=None, threshold=0.05, stale_after=0.2):
+        if mode not in self.MODES:
+            raise ValueError("Politica desconocida %s; disponibles: %s" % (mode, ", ".join(self.MODES)))
+        translation = [source_name(s) for s in translation]
+        self.channels = {
+            'translation': translation,
+            'rotation': [source_name(s) for s in rotation] if rotation else translation,
+            'buttons': [source_name(s) for s in buttons] if buttons else translation,
+        }
+        self.mode = mode
+        self.deadman = (source_name(deadman[0]), deadman[1]) if deadman else None
+        self.threshold = threshold
+        self.stale_after = stale_after
+
+    @property
+    def sources(self):
+        names = []
+        for channel in self.channels.values():
+            names.extend(s for s in channel if s not in names)
+        if self.deadman and self.deadman[0] not in names:
+            names.append(self.deadman[0])
+        return names
+
+    def _active(self, values):
+        threshold = self.threshold
+        return any(v > threshold or v < -threshold for v in values)
+
+    def select(self, channel, fresh):
+        """Devuelve (valores, fuente) del canal 'translation' o 'rotation'"""
+        candidates = [fresh[s] for s in self.channels[channel] if s in fresh]
+        if not candidates:
+            return ZERO3, None
+        if self.mode == 'sum':
+            values = [getattr(sample, channel) for sample in candidates]
+            return tuple(map(sum, zip(*values))), '+'.join(sample.source for sample in candidates)
+        active = [sample for sample in candidates if self._active(getattr(sample, channel))]
+        if not active:
+            return ZERO3, None
+        if self.mode == 'latest':
+            sample = max(active, key=lambda sample: sample.t)
+        else:
+            sample = active[0]
+        return getattr(sample, channel), sample.source
+
+    def merge(self, samples, now):
+        fresh = dict((source, sample) for source, sample in samples.items()
+                     if now - sample.t <= self.stale_after)
+        translation, translation_source = self.select('translation', fresh)
+        rotation, rotation_source = self.select('rotation', fresh)
+
+        buttons, buttons_source, mode = [0, 0], None, None
+        for source in self.channels['buttons']:
+            if source in fresh:
+                buttons, buttons_source, mode = fresh[source].buttons, source, fresh[source].mode
+                break
+
+        deadman = True
+        if self.deadman:
+            source, mask = self.deadman
+            deadman = source in fresh and bool(fresh[source].raw_buttons & mask)
+            if not deadman:
+                translation = rotation = ZERO3
+
+        used = [fresh[s] for s in (translation_source, rotation_source, buttons_source) if s in fresh]
+        return {
+            'x': translation[0], 'y': translation[1], 'z': translation[2],
+            'roll': rotation[0], 'pitch': rotation[1], 'yaw': rotation[2],
+            'buttons': list(buttons),
+            'deadman': deadman,
+            'mode': mode,
+            'age': now - min(sample.t for sample in used) if used else None,
+            'sources': {'translation': translation_source, 'rotation': rotation_source, 'buttons': buttons_source},
+        }
+
+
+class CommandMerger(object):
+    """Guarda la ultima muestra de cada fuente y genera comandos fusionados con marca de tiempo"""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.samples = {}
+        self.seq = 0
+        self.condition = threading.Condition()
+
+    def update(self, sample):
+        with self.condition:
+            self.samples[sample.source] = sample
+            self.seq += 1
+            self.condition.notify_all()
+
+    def command(self, now=None):
+        """Comando fusionado con las muestras actuales"""
+        now = time.perf_counter() if now is None else now
+        with self.condition:
+            samples = dict(self.samples)
+            seq = self.seq
+        command = self.policy.merge(samples, now)
+        command['t'] = now
+        command['seq'] = seq
+        return command
+
+    def wait(self, seq, timeout=None):
+        """Bloquea hasta que llegue una muestra posterior a 'seq' (o timeout); devuelve el seq actual"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != seq, timeout)
+            return self.seq
+
+
+def run_command_server(merger, address='localhost', port=65433, rate=100.0):
+    """
+    Sirve el flujo de comandos fusionados a cada cliente que se conecta
+    (p.ej. egm_s_nav.py), enviando al menos a 'rate' Hz y en cuanto hay datos nuevos,
+    sin superar ese ritmo.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((address, port))
+    server_socket.listen(1)
+    print("Esperando conexion en %s:%d" % (address, port))
+    # reconexiones y cortes (tiempo sin ningun bucle EGM conectado)
+    stats = LinkStats("Bucle EGM (%d)" % port)
+    try:
+        while True:
+            connection, client_address = server_socket.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print("Conexion de", client_address)
+            stats.up()
+            threading.Thread(target=_serve_commands, args=(merger, connection, 1.0 / rate, stats),
+                             daemon=True).start()
+    finally:
+        server_socket.close()
+
+
+def _serve_commands(merger, connection, period, stats=None):
+    seq = None
+    next_send = time.perf_counter()
+    try:
+        while True:
+            seq = merger.wait(seq, period)
+            now = time.perf_counter()
+            if now < next_send:
+                time.sleep(next_send - now)
+            next_send = max(next_send + period, time.perf_counter())
+            message = json.dumps(merger.command()) + '\n'
+            connection.sendall(message.encode('utf-8'))
+    except OSError:
+        print("Cliente desconectado")
+        if stats is not None:
+            stats.down()
+    finally:
+        connection.close()
+
+
+def open_readers(specs, merger):
+    """Crea y arranca un lector por cada especificacion 'tipo:indice' ('xbox:0', 'spacenav:1')"""
+    readers = []
+    spacenav_devices = None
+    for spec in specs:
+        source = source_name(spec)
+        kind, index = source.split(':')
+        index = int(index)
+        if kind == 'xbox':
+            reader = XboxReader(source, merger, index)
+        elif kind == 'spacenav':
+            if spacenav_devices is None:
+                sys.path.append(os.path.join(ROOT, 'Spacenavigator'))
+                import space_navigator
+                spacenav_devices = space_navigator.open_all()
+            if index >= len(spacenav_devices):
+                raise RuntimeError("No se encuentra el dispositivo %s" % source)
+            reader = SpaceNavigatorReader(source, merger, spacenav_devices[index])
+        else:
+            raise ValueError("Tipo de dispositivo desconocido: %s" % kind)
+        reader.start()
+        readers.append(reader)
+    return readers
+
+
+def parse_deadman(text):
+    """'xbox:0x0100' o 'xbox:1:0x0100' -> ('xbox:0', 0x0100)"""
+    source, _, mask = text.rpartition(':')
+    return source_name(source), int(mask, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fusiona varios dispositivos en un flujo de comandos")
+    parser.add_argument('--device', action='append', required=True,
+                        help="dispositivo 'xbox[:n]' o 'spacenav[:n]' (repetible)")
+    parser.add_argument('--translation', help="fuentes de la traslacion, separadas por comas (por defecto, todas)")
+    parser.add_argument('--rotation', help="fuentes de la rotacion (por defecto, las de traslacion)")
+    parser.add_argument('--buttons', help="fuentes de los botones (gain/modo)")
+    parser.add_argument('--policy', default='priority', choices=ArbitrationPolicy.MODES)
+    parser.add_argument('--deadman', type=parse_deadman, help="fuente:mascara del boton de hombre muerto")
+    parser.add_argument('--port', type=int, default=65433)
+    parser.add_argument('--rate', type=float, default=100.0)
+    args = parser.parse_args(argv)
+
+    split = lambda text: text.split(',') if text else None
+    policy = ArbitrationPolicy(split(args.translation) or args.device, split(args.rotation),
+                               split(args.buttons), args.policy, args.deadman)
+    merger = CommandMerger(policy)
+    open_readers(args.device, merger)
+    run_command_server(merger, port=args.port, rate=args.rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Varios robots EGM desde un solo proceso.
+
+Cada egm_*_target de los scripts tiene su propio EGM() y su propio
+MotionProgramExecClient, asi que una celda con varios brazos necesita un
+proceso por brazo y no comparten reloj. EGMScheduler atiende varias sesiones
+EGM (cada una con su puerto UDP y la URL de su controlador) con un unico bucle
+sobre selectors: se despierta cuando llega el mensaje de cualquier robot,
+contesta a los que esten listos y vuelve a esperar. Los datagramas atrasados
+de un robot se descartan y se contesta solo al ultimo, como hace
+LatestLineReader con el mando.
+
+Las entradas (servidores de mando, JSON por lineas) se leen una vez por vuelta
+y se reparten: cada sesion tiene su propio perfil de mapeo, puede compartir la
+entrada con otras ("mirror" cambia el signo de las salidas indicadas, p.ej. dos
+brazos en espejo) o usar una entrada distinta (mandos independientes).
+
+El puerto UDP de cada robot es el que tenga configurado su controlador (UCdevice
+del EGM en SIO.cfg). Una sesion sin "url" no lanza programa: sirve para robots
+que ya estan en EGM o para el simulador de 'scale'.
+
+Celda (JSON):
+    {
+        "inputs": {"pad": "localhost:5001"},
+        "robots": [
+            {"name": "izq", "url": "http://192.168.125.1:80", "port": 6510,
+             "mode": "joint", "profile": "xbox_joint", "input": "pad"},
+            {"name": "der", "url": "http://192.168.125.2:80", "port": 6511,
+             "mode": "joint", "profile": "xbox_joint", "input": "pad", "mirror": ["J1", "J4", "J6"]}
+        ]
+    }
+
+Estadisticas por robot (cada --report s y al terminar): ciclos por segundo,
+tiempo de proceso del ciclo, espera desde que el selector despierta hasta que
+se contesta a ese robot (crece con el numero de robots atendidos en la misma
+vuelta) y datagramas descartados.
+
+Uso:
+    python -m teleop.multi_robot run celda.json [--report 5]
+    python -m teleop.multi_robot scale [--robots 1 2 4 8] [--seconds 5]
+"""
+
+import argparse
+import json
+import multiprocessing
+import selectors
+import socket
+import time
+
+import numpy as np
+
+from teleop.mapping import load_mapping
+from teleop.stream import ReconnectingReader
+from teleop.watchdog import InputWatchdog, feedback_joints, feedback_pose, poll_input
+
+# pose inicial del modo pose (la de egm_pose_target)
+POSE_START = ([400, 100, 600], [0.7071068, 0., 0.7071068, 0.])
+MODES = ('joint', 'pose')
+
+
+class InputSource(object):
+    """Ultimo mensaje de un servidor de mando, con contador para saber quien lo ha visto ya"""
+
+    def __init__(self, address):
+        host, port = address.rsplit(':', 1)
+        self.address = address
+        # si el servidor se cae o se reinicia se reconecta solo, reintentando como mucho cada ciclo EGM
+        self.reader = ReconnectingReader(host, int(port), max_delay=0.004, name="Entrada %s" % address)
+        self.state = None
+        self.seq = 0
+
+    def poll(self):
+        state = poll_input(self.reader)
+        if state is not None:
+            self.state = state
+            self.seq += 1
+
+
+class CycleStats(object):
+    """Tiempos de los ciclos de un robot en una ventana circular"""
+
+    def __init__(self, window=2000):
+        self.busy = np.zeros(window)
+        self.wait = np.zeros(window)
+        self.count = 0
+        self.dropped = 0
+        self._since = time.perf_counter()
+        self._since_count = 0
+
+    def add(self, busy, wait):
+        i = self.count % len(self.busy)
+        self.busy[i] = busy
+        self.wait[i] = wait
+        self.count += 1
+
+    def report(self, now):
+        n = min(self.count, len(self.busy))
+        hz = (self.count - self._since_count) / (now - self._since) if now > self._since else 0.0
+        self._since, self._since_count = now, self.count
+        if not n:
+            return {'hz': 0.0, 'cycles': 0, 'dropped': self.dropped}
+        busy = np.percentile(self.busy[:n], (50, 99)) * 1000.0
+        wait = np.percentile(self.wait[:n], (50, 99)) * 1000.0
+        return {'hz': round(hz, 1), 'cycles': self.count, 'dropped': self.dropped,
+                'busy_p50': round(busy[0], 3), 'busy_p99': round(busy[1], 3),
+                'wait_p50': round(wait[0], 3), 'wait_p99': round(wait[1], 3)}
+
+
+class RobotSession(object):
+    """Una sesion EGM (joint o pose) con su mapeo, su entrada y su watchdog"""
+
+    def __init__(self, name, port=6510, url=None, mode='joint', profile=None, source=None, mirror=(),
+                 gain=None, input_timeout=0.1):
+        if mode not in MODES:
+            raise ValueError("Modo %s no soportado por el planificador (%s)" % (mode, ", ".join(MODES)))
+        self.name = name
+        self.port = port
+        self.url = url
+        self.mode = mode
+        self.mapping = load_mapping(profile or 'xbox_' + mode)
+        self.source = source
+        self.gain = gain if gain is not None else (0.5 if mode == 'joint' else 10)
+        unknown = [output for output in mirror if output not in self.mapping.outputs]
+        if unknown:
+            raise ValueError("%s: salidas de mirror desconocidas: %s" % (name, ", ".join(unknown)))
+        self.signs = np.array([-1.0 if output in mirror else 1.0 for output in self.mapping.outputs])
+        self.watchdog = InputWatchdog(timeout=input_timeout)
+        self.stats = CycleStats()
+        self.client = None
+        self.lognum = None
+        self.egm = None
+        self._seen = 0
+        if mode == 'joint':
+            self.target = np.zeros(6)
+        else:
+            self.rot = np.array(POSE_START[1], dtype=float)
+            self.target = np.concatenate((POSE_START[0], self.rot[:3]))
+
+    def motion_program(self):
+        import abb_motion_program_exec as abb
+        mm = abb.egm_minmax(-1e-3, 1e-3)
+        if self.mode == 'joint':
+            mp = abb.MotionProgram(egm_config=abb.EGMJointTargetConfig(mm, mm, mm, mm, mm, mm, 1000, 1000))
+            mp.MoveAbsJ(abb.jointtarget([0, 0, 0, 0, 0, 0], [0] * 6), abb.v5000, abb.fine)
+            mp.EGMRunJoint(10, 0.05, 0.05)
+            return mp
+        frame = abb.pose([0, 0, 0], [1, 0, 0, 0])
+        wobj = abb.egmframetype.EGM_FRAME_WOBJ
+        mp = abb.MotionProgram(egm_config=abb.EGMPoseTargetConfig(frame, wobj, frame, wobj,
+                                                                  mm, mm, mm, mm, mm, mm, 1000, 1000))
+        mp.MoveJ(abb.robtarget(*POSE_START, abb.confdata(0, 0, 0, 1), [0] * 6), abb.v1000, abb.fine)
+        mp.EGMRunPose(10, 0.05, 0.05, frame)
+        return mp
+
+    def start(self):
+        from abb_robot_client.egm import EGM
+        # el socket se abre antes de lanzar el programa para no perder los primeros mensajes
+        self.egm = EGM(self.port)
+        self.watchdog.feed(time.perf_counter())
+        if self.url:
+            import abb_motion_program_exec as abb
+            self.client = abb.MotionProgramExecClient(base_url=self.url)
+            self.lognum = self.client.execute_motion_program(self.motion_program(), wait=False)
+        print("%s: EGM %s en el puerto %d%s" % (self.name, self.mode, self.port,
+                                                 " (%s)" % self.url if self.url else ""))
+        return self
+
+    def fileno(self):
+        return self.egm.socket.fileno()
+
+    def receive(self):
+        """Vacia el socket y devuelve el ultimo estado del robot (None si no habia nada)"""
+        latest = None
+        while True:
+            res, feedback = self.egm.receive_from_robot(timeout=0)
+            if not res:
+                return latest
+            if latest is not None:
+                self.stats.dropped += 1
+            latest = feedback
+
+    def cycle(self, feedback, now):
+        """Calcula y envia el objetivo; devuelve los eventos del mando de este ciclo"""
+        state = None
+        events = ()
+        source = self.source
+        if source is not None and source.seq != self._seen:
+            self._seen = source.seq
+            state = source.state
+            self.watchdog.feed(now, live=state.get('deadman', True))
+            axes, buttons = self.mapping.read(state)
+            events = self.mapping.events(buttons)
+            if 'gain_down' in events:
+                self.gain = max(0.5, self.gain - 0.5)
+                print("%s: gain %.1f" % (self.name, self.gain))
+            if 'gain_up' in events:
+                self.gain += 0.5
+                print("%s: gain %.1f" % (self.name, self.gain))
+
+        if self.watchdog.update(now):
+            if self.mode == 'joint':
+                hold = feedback_joints(feedback)
+            else:
+                hold = feedback_pose(feedback, self.rot)
+            self.target = self.mapping.clip(self.watchdog.hold(self.target, hold, now))
+        elif state is not None:
+            delta = self.mapping.delta(axes, buttons, self.gain) * self.signs
+            self.target = self.mapping.clip(self.target + delta)
+
+        if self.mode == 'joint':
+            self.egm.send_to_robot(self.target)
+        else:
+            q1, q2, q3 = self.target[3:]
+            if q1 ** 2 + q2 ** 2 + q3 ** 2 <= 1.0:
+                self.rot = np.array([q1, q2, q3, np.sqrt(1.0 - (q1 ** 2 + q2 ** 2 + q3 ** 2))])
+            self.egm.send_to_robot_cart(self.target[:3], self.rot)
+        return events
+
+    def stop(self):
+        try:
+            if self.client is not None:
+                self.client.stop_egm()
+                while self.client.is_motion_program_running():
+                    time.sleep(0.05)
+        finally:
+            if self.egm is not None:
+                self.egm.close()
+
+
+class EGMScheduler(object):
+    """Bucle unico sobre los sockets EGM de varias sesiones"""
+
+    def __init__(self, sessions, sources=(), report=5.0):
+        names = [session.name for session in sessions]
+        if len(set(names)) != len(names):
+            raise ValueError("Nombres de robot repetidos: %s" % ", ".join(names))
+        ports = [session.port for session in sessions]
+        if len(set(ports)) != len(ports):
+            raise ValueError("Cada robot necesita su propio puerto UDP")
+        self.sessions = list(sessions)
+        self.sources = list(sources)
+        self.report_period = report
+        self.selector = selectors.DefaultSelector()
+        self.wakeups = 0
+
+    def run(self, duration=None, timeout=0.05):
+        # si un robot no arranca (puerto ocupado, controlador inaccesible) se paran los que ya lo han hecho
+        started = []
+        try:
+            for session in self.sessions:
+                started.append(session)
+                session.start()
+                self.selector.register(session.fileno(), selectors.EVENT_READ, session)
+            t_start = t_report = time.perf_counter()
+            while duration is None or time.perf_counter() - t_start < duration:
+                ready = self.selector.select(timeout)
+                t_wake = time.perf_counter()
+                if self.report_period and t_wake - t_report >= self.report_period:
+                    self.print_report(t_wake)
+                    t_report = t_wake
+                if not ready:
+                    continue
+                self.wakeups += 1
+                for source in self.sources:
+                    source.poll()
+                stop = False
+                for key, _ in ready:
+                    session = key.data
+                    feedback = session.receive()
+                    if feedback is None:
+                        continue
+                    t_rx = time.perf_counter()
+                    events = session.cycle(feedback, t_rx)
+                    t_done = time.perf_counter()
+                    session.stats.add(t_done - t_rx, t_done - t_wake)
+                    if 'exit' in events:
+                        stop = True
+                if stop:
+                    print("Salida pedida desde el mando")
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # cada sesion se para aunque falle la parada de otra
+            for session in started:
+                try:
+                    if session.egm is not None and session.fileno() in self.selector.get_map():
+                        self.selector.unregister(session.fileno())
+                    session.stop()
+                except Exception as e:
+                    print("%s: error al parar: %s" % (session.name, e))
+            self.selector.close()
+        return self.print_report(time.perf_counter())
+
+    def print_report(self, now):
+        reports = {}
+        print("%-10s %8s %9s %12s %12s %8s" % ('robot', 'Hz', 'ciclos', 'proceso ms', 'espera ms', 'descart.'))
+        for session in self.sessions:
+            r = reports[session.name] = session.stats.report(now)
+            if r['cycles']:
+                print("%-10s %8.1f %9d %5.3f/%6.3f %5.3f/%6.3f %8d" % (
+                    session.name, r['hz'], r['cycles'], r['busy_p50'], r['busy_p99'],
+                    r['wait_p50'], r['wait_p99'], r['dropped']))
+            else:
+                print("%-10s %8s %9d %12s %12s %8d" % (session.name, '-', 0, '-', '-', r['dropped']))
+        for source in self.sources:
+            link = source.reader.stats.telemetry()
+            print("entrada %s: %s, %d reconexiones, corte maximo %.1f ms" % (
+                source.address, 'conectada' if link['connected'] else 'sin conexion',
+                link['reconnects'], link['max_outage']))
+        return reports
+
+
+def load_cell(path):
+    """Sesiones y entradas de un fichero de celda"""
+    with open(path) as f:
+        cell = json.load(f)
+    sources = {name: InputSource(address) for name, address in cell.get('inputs', {}).items()}
+    sessions = []
+    for i, robot in enumerate(cell['robots']):
+        sessions.append(RobotSession(robot.get('name', 'robot%d' % (i + 1)), robot.get('port', 6510 + i),
+                                     robot.get('url'), robot.get('mode', 'joint'), robot.get('profile'),
+                                     sources[robot['input']] if robot.get('input') else None,
+                                     robot.get('mirror', ()), robot.get('gain')))
+    return sessions, list(sources.values())
+
+
+def simulate_robots(ports, seconds, period=0.004, results=None):
+    """
+    Robots EGM falsos (un proceso para todos): cada 'period' mandan un EgmRobot a su
+    puerto y miden cuanto tarda en llegar la respuesta. Guarda en 'results' los
+    tiempos de ida y vuelta (ms) por puerto.
+    """
+    from abb_robot_client._egm_protobuf import egm_pb2
+    socks = []
+    for port in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        socks.append((port, sock))
+    sent = {port: 0.0 for port in ports}
+    rtt = {port: [] for port in ports}
+    selector = selectors.DefaultSelector()
+    for port, sock in socks:
+        selector.register(sock, selectors.EVENT_READ, port)
+    message = egm_pb2.EgmRobot()
+    message.header.mtype = egm_pb2.EgmHeader.MSGTYPE_DATA
+    message.feedBack.joints.joints.extend([0.0] * 6)
+    cartesian = message.feedBack.cartesian
+    cartesian.pos.x, cartesian.pos.y, cartesian.pos.z = POSE_START[0]
+    cartesian.orient.u0, cartesian.orient.u1, cartesian.orient.u2, cartesian.orient.u3 = POSE_START[1]
+    message.motorState.state = egm_pb2.EgmMotorState.MOTORS_ON
+    message.rapidExecState.state = egm_pb2.EgmRapidCtrlExecState.RAPID_RUNNING
+    t0 = next_tick = time.perf_counter()
+    seqno = 0
+    while time.perf_counter() - t0 < seconds:
+        now = time.perf_counter()
+        if now >= next_tick:
+            message.header.seqno = seqno
+            message.header.tm = int((now - t0) * 1000)
+            data = message.SerializeToString()
+            for port, sock in socks:
+                sock.sendto(data, ('127.0.0.1', port))
+                sent[port] = now
+            seqno += 1
+            next_tick += period
+        for key, _ in selector.select(max(0.0, next_tick - time.perf_counter())):
+            t_rx = time.perf_counter()
+            while True:
+                try:
+                    key.fileobj.recv(65536)
+                except BlockingIOError:
+                    break
+                rtt[key.data].append((t_rx - sent[key.data]) * 1000.0)
+    for _, sock in socks:
+        sock.close()
+    if results is not None:
+        results.update(rtt)
+    return rtt
+
+
+def scale(counts=(1, 2, 4, 8), seconds=5.0, base_port=6610):
+    """Mide el planificador contra robots simulados con 1, 2, 4... sesiones"""
+    context = multiprocessing.get_context('spawn')
+    summary = []
+    for count in counts:
+        ports = [base_port + i for i in range(count)]
+        sessions = [RobotSession('sim%d' % (i + 1), port, mode='joint') for i, port in enumerate(ports)]
+        manager = context.Manager()
+        results = manager.dict()
+        simulator = context.Process(target=simulate_robots, args=(ports, seconds, 0.004, results), daemon=True)
+        scheduler = EGMScheduler(sessions, report=0)
+        print("\n== %d robot(s) ==" % count)
+        simulator.start()
+        reports = scheduler.run(duration=seconds + 0.5)
+        simulator.join()
+        rtt = np.concatenate([results.get(port, []) or [np.nan] for port in ports])
+        manager.shutdown()
+        p50, p99 = np.nanpercentile(rtt, (50, 99))
+        worst = max(r.get('wait_p99', 0.0) for r in reports.values())
+        summary.append((count, p50, p99, worst))
+        print("ida y vuelta: p50 %.3f ms, p99 %.3f ms" % (p50, p99))
+    print("\n%8s %12s %12s %16s" % ('robots', 'rtt p50 ms', 'rtt p99 ms', 'espera p99 ms'))
+    for count, p50, p99, worst in summary:
+        print("%8d %12.3f %12.3f %16.3f" % (count, p50, p99, worst))
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Varios robots EGM desde un proceso")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run', help="teleopera los robots de una celda")
+    p_run.add_argument('cell', help="fichero JSON de la celda")
+    p_run.add_argument('--report', type=float, default=5.0, help="segundos entre informes (0: solo al final)")
+    p_scale = sub.add_parser('scale', help="estadisticas contra robots simulados segun el numero de robots")
+    p_scale.add_argument('--robots', type=int, nargs='+', default=[1, 2, 4, 8])
+    p_scale.add_argument('--seconds', type=float, default=5.0)
+    p_scale.add_argument('--port', type=int, default=6610, help="primer puerto UDP de los robots simulados")
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        sessions, sources = load_cell(args.cell)
+        EGMScheduler(sessions, sources, report=args.report).run()
+    else:
+        scale(args.robots, args.seconds, args.port)
@@ -0,0 +1,236 @@
+"""
+Lanzador de la teleoperacion con el mando Xbox en procesos separados.
+
+Cada etapa corre en su propio proceso (y por tanto con su propio GIL):
+    mando    -> xinput.run_xinput_to_shm: lee el mando, aplica las curvas y escribe el estado; vibra segun
+                el estado del bucle EGM (teleop.feedback)
+    EGM      -> egm_interface_Xbox.mix_target: bucle de control, lee el mando y escribe su estado
+    display  -> x_controller_display.run_display: dibuja el mando y la telemetria (opcional)
+    registro -> record_stage: guarda todas las muestras del bucle EGM en un .npz (opcional)
+
+Las etapas se comunican por canales de memoria compartida (teleop.shm) en lugar
+de sockets TCP con JSON: el bucle EGM no serializa ni envia nada y el trabajo
+pesado del display (pygame, percentiles de latencia) o del registro no compite
+por el GIL del bucle de control.
+
+Uso:
+    python -m teleop.pipeline [--mode pose|joint|cartesian|path] [--display] [--record fichero.npz] [--device 0]
+"""
+
+import argparse
+import os
+import sys
+import time
+import multiprocessing
+
+import numpy as np
+
+from teleop.shm import EGM_FEEDBACK, XBOX_INPUT, ShmChannel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# orden de los modos en la columna 'mode' del canal de estado ('monitor' lo escribe teleop.monitor)
+MODES = ('joint', 'pose', 'cartesian', 'path', 'monitor')
+
+
+def _xbox_path():
+    for path in (ROOT, os.path.join(ROOT, 'Xbox')):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+class FeedbackPublisher(object):
+    """
+    Sustituto de TelemetryPublisher en la etapa EGM: escribe en el canal de estado
+    una fila por ciclo (al llamar a add_latency). Misma interfaz, sin hilo ni sockets.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._latest = None
+        self._sources = {}
+        self._row = np.zeros(len(EGM_FEEDBACK))
+
+    def start(self):
+        return self
+
+    def close(self):
+        self.channel.mark_closed()
+
+    def add_source(self, name, source):
+        self._sources[name] = source
+
+    def remove_source(self, *names):
+        for name in names:
+            self._sources.pop(name, None)
+
+    def update(self, feedback, gain=None, mode=None):
+        self._latest = (feedback, gain, mode)
+
+    def add_latency(self, seconds):
+        if self._latest is None:
+            return
+        feedback, gain, mode = self._latest
+        row = self._row
+        row[0] = time.time()
+        row[1:7] = feedback.joint_angles[:6]
+        pos, quat = feedback.cartesian
+        row[7:10] = pos
+        row[10:14] = quat
+        row[14] = gain or 0.0
+        row[15] = MODES.index(mode) if mode in MODES else -1
+        row[16] = seconds
+        watchdog = self._sources.get('watchdog')
+        if watchdog is not None:
+            watchdog = watchdog()
+            row[17], row[18] = watchdog['holding'], watchdog['input_age']
+        self.channel.write(row)
+
+
+class FeedbackSubscriber(object):
+    """
+    Convierte el canal de estado del bucle EGM en mensajes con el formato de
+    teleop.telemetry para el TelemetryOverlay del display, a 'rate' Hz.
+    """
+
+    def __init__(self, channel, rate=10.0, window=1000):
+        self.channel = channel
+        self.period = 1.0 / rate
+        self._latency = np.zeros(window)
+        self._count = 0
+        self._last = None
+        self._rows = 0
+        self._since = time.perf_counter()
+        self._seq = 0
+
+    def poll(self):
+        rows = self.channel.read_new()
+        if len(rows):
+            self._last = rows[-1]
+            index = (self._count + np.arange(len(rows))) % len(self._latency)
+            self._latency[index] = rows[:, 16]
+            self._count += len(rows)
+            self._rows += len(rows)
+        now = time.perf_counter()
+        if self._last is None or now - self._since < self.period:
+            return None
+        hz = round(self._rows / (now - self._since), 1)
+        self._rows, self._since = 0, now
+        self._seq += 1
+        row = self._last
+        samples = self._latency[:min(self._count, len(self._latency))] * 1000.0
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        mode = int(row[15])
+        return {'t': row[0], 'seq': self._seq, 'gain': float(row[14]), 'hz': hz,
+                'mode': MODES[mode] if 0 <= mode < len(MODES) else None,
+                'pos': row[7:10].round(2).tolist(), 'quat': row[10:14].round(5).tolist(),
+                'joints': row[1:7].round(3).tolist(),
+                'latency': {'p50': round(p50, 3), 'p95': round(p95, 3), 'p99': round(p99, 3),
+                            'max': round(samples.max(), 3)},
+                'watchdog': {'holding': bool(row[17]), 'reason': 'watchdog', 'input_age': round(row[18], 1)}}
+
+    def close(self):
+        self.channel.close()
+
+
+# etapas (funciones de nivel de modulo para que funcionen con 'spawn' en Windows)
+def device_stage(input_name, device_number, stop, feedback_name=None):
+    _xbox_path()
+    import xinput
+    feedback = None
+    if feedback_name:
+        # vibracion segun el estado del bucle EGM, desde un hilo aparte (ver teleop.feedback)
+        from teleop.feedback import FeedbackChannel, RumbleOutput
+        subscriber = FeedbackSubscriber(ShmChannel.attach(feedback_name, EGM_FEEDBACK), rate=20.0)
+        feedback = FeedbackChannel([RumbleOutput(device_number)], subscriber).start()
+    try:
+        xinput.run_xinput_to_shm(input_name, device_number, stop=stop)
+    finally:
+        if feedback is not None:
+            feedback.close()
+
+
+def egm_stage(input_name, feedback_name, mode):
+    _xbox_path()
+    import egm_interface_Xbox
+    reader = ShmChannel.attach(input_name, XBOX_INPUT)
+    egm_interface_Xbox.telemetry = FeedbackPublisher(ShmChannel.attach(feedback_name, EGM_FEEDBACK))
+    egm_interface_Xbox.v_global = egm_interface_Xbox.MODES[mode]
+    try:
+        egm_interface_Xbox.mix_target(reader=reader)
+    finally:
+        egm_interface_Xbox.telemetry.close()
+        reader.close()
+
+
+def display_stage(input_name, feedback_name):
+    _xbox_path()
+    import x_controller_display
+    reader = ShmChannel.attach(input_name, XBOX_INPUT)
+    telemetry = FeedbackSubscriber(ShmChannel.attach(feedback_name, EGM_FEEDBACK))
+    try:
+        x_controller_display.run_display(reader, telemetry)
+    finally:
+        reader.close()
+        telemetry.close()
+
+
+def record_stage(feedback_name, path, stop, period=0.05):
+    """Guarda todas las filas del canal de estado (sin perder ciclos mientras quepan en el buffer)"""
+    channel = ShmChannel.attach(feedback_name, EGM_FEEDBACK)
+    chunks = []
+    try:
+        while not stop.is_set():
+            stop.wait(period)
+            rows = channel.read_new()
+            if len(rows):
+                chunks.append(rows)
+    finally:
+        data = np.vstack(chunks) if chunks else np.zeros((0, len(EGM_FEEDBACK)))
+        np.savez(path, data=data, fields=[name for name, _ in EGM_FEEDBACK])
+        print("Registro: %d muestras en %s (%d perdidas)" % (len(data), path, channel.lost))
+        channel.close()
+
+
+def run_pipeline(mode='pose', display=False, record=None, device_number=0):
+    context = multiprocessing.get_context('spawn')
+    prefix = 'teleop_%d' % os.getpid()
+    input_channel = ShmChannel.create(prefix + '_input', XBOX_INPUT)
+    feedback_channel = ShmChannel.create(prefix + '_feedback', EGM_FEEDBACK)
+    stop = context.Event()
+    stages = [context.Process(target=device_stage,
+                              args=(input_channel.name, device_number, stop, feedback_channel.name),
+                              name='mando', daemon=True)]
+    if display:
+        stages.append(context.Process(target=display_stage, args=(input_channel.name, feedback_channel.name),
+                                      name='display', daemon=True))
+    if record:
+        stages.append(context.Process(target=record_stage, args=(feedback_channel.name, record, stop),
+                                      name='registro'))
+    egm = context.Process(target=egm_stage, args=(input_channel.name, feedback_channel.name, mode), name='EGM')
+    try:
+        for stage in stages:
+            stage.start()
+        egm.start()
+        egm.join()
+    finally:
+        # fin del bucle EGM: se paran las demas etapas y se liberan los canales
+        stop.set()
+        input_channel.mark_closed()
+        feedback_channel.mark_closed()
+        for stage in stages:
+            stage.join(timeout=2.0)
+            if stage.is_alive():
+                stage.terminate()
+        input_channel.close()
+        feedback_channel.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teleoperacion Xbox -> EGM con una etapa por proceso")
+    parser.add_argument('--mode', choices=MODES[:-1], default='pose', help="modo inicial del bucle EGM")
+    parser.add_argument('--display', action='store_true', help="abre el display del mando con la telemetria")
+    parser.add_argument('--record', metavar='FICHERO', help="guarda el estado del bucle EGM en un .npz")
+    parser.add_argument('--device', type=int, default=0, help="numero del mando")
+    args = parser.parse_args()
+    run_pipeline(args.mode, args.display, args.record, args.device)
@@ -0,0 +1,234 @@
+"""
+Modo de tiempo real (opcional) para los bucles EGM.
+
+Durante una sesion EGM:
+- se congela y desactiva el recolector de basura (gc.freeze + gc.disable), de
+  modo que no hay pausas de recoleccion dentro del bucle; lo que ya existia pasa
+  a la generacion permanente y al terminar la sesion se reactiva;
+- se fija el hilo del bucle a una CPU (os.sched_setaffinity en Linux,
+  SetThreadAffinityMask en Windows);
+- se sube su prioridad cuando el sistema lo permite (SCHED_FIFO o nice en
+  Linux, THREAD_PRIORITY_TIME_CRITICAL y timeBeginPeriod(1) en Windows); si no
+  hay permisos se avisa y se sigue sin ello;
+- HybridEGM sustituye la espera en select() por una espera hibrida: duerme hasta
+  poco antes del siguiente paquete esperado del robot y luego sondea sin bloquear,
+  eliminando la latencia de despertar del planificador (solo con CPU fijada y mas
+  de un nucleo).
+
+Se activa con TELEOP_REALTIME=1 (y TELEOP_REALTIME_CPU=<n> para fijar la CPU).
+El efecto sobre el jitter se mide con benchmarks/bench_egm_jitter.py.
+
+Example:
+    realtime = RealtimeSession.from_env()
+    egm = realtime.wrap(EGM())
+    realtime.start()
+    while True:
+        res, feedback = egm.receive_from_robot(timeout=0.05)
+        ...
+    realtime.stop()
+"""
+
+import gc
+import os
+import sys
+import threading
+import time
+
+SCHED_PRIORITY = 50  # prioridad SCHED_FIFO en Linux (1-99)
+NICE = -10  # alternativa si no se permite SCHED_FIFO
+
+
+class RealtimeSession(object):
+    """Aplica (y deshace al terminar) los ajustes de tiempo real al hilo que llama a start()"""
+
+    def __init__(self, enabled=True, cpu=None, priority=True, freeze_gc=True, spin=0.0005):
+        self.enabled = enabled
+        self.cpu = cpu
+        self.priority = priority
+        self.freeze_gc = freeze_gc
+        self.spin = spin
+        # ajustes aplicados u omitidos, para la telemetria y los benchmarks
+        self.report = {}
+        self._restore = []
+
+    @classmethod
+    def from_env(cls):
+        enabled = os.environ.get('TELEOP_REALTIME', '0') not in ('', '0')
+        cpu = os.environ.get('TELEOP_REALTIME_CPU')
+        return cls(enabled=enabled, cpu=int(cpu) if cpu else None)
+
+    def wrap(self, egm):
+        """
+        Devuelve el cliente EGM con espera hibrida si la sesion esta activa y el bucle
+        tiene una CPU para el solo; en una maquina de un nucleo el sondeo le quitaria
+        la CPU al resto de procesos (display, servidor del mando) y se usa select normal.
+        """
+        if self.enabled and self.cpu is not None and (os.cpu_count() or 1) > 1:
+            self.report['wait'] = 'hybrid'
+            return HybridEGM(egm, spin=self.spin)
+        if self.enabled:
+            self.report['wait'] = 'select'
+        return egm
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self.freeze_gc:
+            self._freeze_gc()
+        if self.cpu is not None:
+            self._pin(self.cpu)
+        if self.priority:
+            self._raise_priority()
+        print("Modo tiempo real: %s" % ", ".join("%s=%s" % item for item in self.report.items()))
+
+    def stop(self):
+        while self._restore:
+            restore = self._restore.pop()
+            try:
+                restore()
+            except OSError:
+                pass
+
+    def _freeze_gc(self):
+        was_enabled = gc.isenabled()
+        gc.collect()
+        gc.freeze()
+        gc.disable()
+        self.report['gc'] = 'frozen'
+
+        def restore():
+            gc.unfreeze()
+            if was_enabled:
+                gc.enable()
+        self._restore.append(restore)
+
+    def _pin(self, cpu):
+        if hasattr(os, 'sched_setaffinity'):
+            previous = os.sched_getaffinity(0)
+            try:
+                os.sched_setaffinity(0, {cpu})
+            except OSError as e:
+                self.report['cpu'] = 'no (%s)' % e
+                return
+            self._restore.append(lambda: os.sched_setaffinity(0, previous))
+            self.report['cpu'] = cpu
+        elif sys.platform == 'win32':
+            kernel32 = _kernel32()
+            thread = kernel32.GetCurrentThread()
+            previous = kernel32.SetThreadAffinityMask(thread, 1 << cpu)
+            if not previous:
+                self.report['cpu'] = 'no'
+                return
+            self._restore.append(lambda: kernel32.SetThreadAffinityMask(thread, previous))
+            self.report['cpu'] = cpu
+        else:
+            self.report['cpu'] = 'no soportado'
+
+    def _raise_priority(self):
+        if hasattr(os, 'sched_setscheduler'):
+            previous_policy = os.sched_getscheduler(0)
+            previous_param = os.sched_getparam(0)
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(SCHED_PRIORITY))
+                self._restore.append(lambda: os.sched_setscheduler(0, previous_policy, previous_param))
+                self.report['priority'] = 'SCHED_FIFO %d' % SCHED_PRIORITY
+                return
+            except OSError:
+                pass
+            # sin CAP_SYS_NICE: al menos subir la prioridad del hilo con nice
+            tid = threading.get_native_id()
+            previous_nice = os.getpriority(os.PRIO_PROCESS, tid)
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, NICE)
+                self._restore.append(lambda: os.setpriority(os.PRIO_PROCESS, tid, previous_nice))
+                self.report['priority'] = 'nice %d' % NICE
+            except OSError:
+                self.report['priority'] = 'no (sin permisos)'
+        elif sys.platform == 'win32':
+            kernel32 = _kernel32()
+            thread = kernel32.GetCurrentThread()
+            previous = kernel32.GetThreadPriority(thread)
+            if kernel32.SetThreadPriority(thread, 15):  # THREAD_PRIORITY_TIME_CRITICAL
+                self._restore.append(lambda: kernel32.SetThreadPriority(thread, previous))
+                self.report['priority'] = 'TIME_CRITICAL'
+            else:
+                self.report['priority'] = 'no'
+            # resolucion de 1 ms para los sleep/select de la fase de espera
+            import ctypes
+            winmm = ctypes.windll.winmm
+            if winmm.timeBeginPeriod(1) == 0:
+                self._restore.append(lambda: winmm.timeEndPeriod(1))
+        else:
+            self.report['priority'] = 'no soportado'
+
+
+def _kernel32():
+    import ctypes
+    return ctypes.windll.kernel32
+
+
+class HybridEGM(object):
+    """
+    Envuelve un abb_robot_client.egm.EGM con una espera hibrida.
+
+    El periodo del robot se estima con los tiempos de llegada; receive_from_robot
+    duerme (select) hasta 'spin' segundos antes del paquete esperado y a partir de
+    ahi sondea sin bloquear hasta 'spin' segundos despues. Si el paquete no ha
+    llegado vuelve a esperar bloqueando el resto del timeout. El resto de metodos
+    (send_to_robot, send_to_robot_cart, ...) pasan directamente al cliente EGM.
+    """
+
+    def __init__(self, egm, spin=0.0005):
+        self.egm = egm
+        self.spin = spin
+        self.period = None
+        self._last = None
+        self._next = None
+
+    def __getattr__(self, name):
+        return getattr(self.egm, name)
+
+    def _received(self, state):
+        now = time.perf_counter()
+        if self._last is not None:
+            interval = now - self._last
+            if self.period is None:
+                self.period = interval
+            elif interval < 3.0 * self.period:
+                self.period += 0.05 * (interval - self.period)
+        self._last = now
+        self._next = now + self.period if self.period else None
+        return True, state
+
+    def receive_from_robot(self, timeout=0):
+        receive = self.egm.receive_from_robot
+        start = time.perf_counter()
+        expected = self._next
+        if expected is not None and expected - start < timeout:
+            # fase 1: dormir hasta poco antes del paquete esperado
+            sleep_for = expected - self.spin - start
+            if sleep_for > 0:
+                res, state = receive(timeout=sleep_for)
+                if res:
+                    return self._received(state)
+            # fase 2: sondeo sin bloquear alrededor del instante esperado
+            spin_until = expected + self.spin
+            while time.perf_counter() < spin_until:
+                res, state = receive(timeout=0)
+                if res:
+                    return self._received(state)
+            timeout -= time.perf_counter() - start
+            if timeout <= 0:
+                return False, None
+        # sin estimacion del periodo o paquete retrasado: espera bloqueante normal
+        res, state = receive(timeout=timeout)
+        if res:
+            return self._received(state)
+        return False, None
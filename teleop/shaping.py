@@ -0,0 +1,70 @@
+"""
+Curvas de respuesta por eje compiladas en tablas (LUT).
+
+Cada eje tiene una curva AxisCurve (zona muerta, expo, saturacion y signo)
+que se muestrea una sola vez sobre [-1, 1] al crear el ResponseShaper; despues
+aplicar las curvas a los seis ejes es un unico indexado de NumPy, sin calculos
+por muestra en Python.
+
+Curva, para a = |x|:
+    a < deadzone             -> 0
+    u = (a - deadzone) / (saturation - deadzone), limitado a [0, 1]
+    salida = sign * signo(x) * ((1 - expo) * u + expo * u**3)
+
+Con expo > 0 la respuesta es suave cerca del centro (posicionado fino) y llega
+igualmente a 1 en 'saturation' (desplazamientos rapidos).
+
+Example:
+    shaper = ResponseShaper([AxisCurve(deadzone=0.1, expo=0.4)] * 3 + [AxisCurve(expo=0.2)] * 3)
+    x, y, z, roll, pitch, yaw = shaper.apply((state['x'], state['y'], state['z'],
+                                               state['roll'], state['pitch'], state['yaw']))
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+# curva de un eje; AxisCurve() es la identidad
+AxisCurve = namedtuple("AxisCurve", ["deadzone", "expo", "saturation", "sign"], defaults=(0.0, 0.0, 1.0, 1))
+
+LUT_SIZE = 4097  # impar, para que el 0 de entrada caiga exactamente en una entrada de la tabla
+
+
+def evaluate_curve(curve, values):
+    """Evalua 'curve' sobre un array de valores (se usa para construir las tablas)"""
+    deadzone, expo, saturation, sign = curve
+    if not 0.0 <= deadzone < saturation <= 1.0:
+        raise ValueError("Se necesita 0 <= deadzone < saturation <= 1: %r" % (curve,))
+    if not 0.0 <= expo <= 1.0:
+        raise ValueError("expo debe estar en [0, 1]: %r" % (curve,))
+    values = np.asarray(values, dtype=float)
+    u = np.clip((np.abs(values) - deadzone) / (saturation - deadzone), 0.0, 1.0)
+    return sign * np.sign(values) * ((1.0 - expo) * u + expo * u ** 3)
+
+
+class ResponseShaper(object):
+    """
+    Aplica una curva por eje mediante tablas precalculadas.
+
+    apply() recibe una secuencia con un valor por eje en [-1, 1] (los valores
+    fuera de rango se saturan) y devuelve un array con los valores ya
+    conformados, en el mismo orden.
+    """
+
+    def __init__(self, curves, size=LUT_SIZE):
+        self.curves = tuple(AxisCurve(*curve) for curve in curves)
+        self.size = size
+        inputs = np.linspace(-1.0, 1.0, size)
+        # tablas de todos los ejes seguidas en un solo array plano (fila por eje)
+        self.table = np.concatenate([evaluate_curve(curve, inputs) for curve in self.curves])
+        self._half = (size - 1) / 2.0
+        # desplazamiento de la fila de cada eje (+0.5 para redondear al truncar)
+        self._offset = np.arange(len(self.curves)) * float(size) + self._half + 0.5
+
+    def apply(self, values):
+        index = np.array(values, dtype=float)
+        index *= self._half
+        np.minimum(index, self._half, out=index)
+        np.maximum(index, -self._half, out=index)
+        index += self._offset
+        return self.table.take(index.astype(np.intp))
@@ -0,0 +1,140 @@
+"""
+Canales de memoria compartida entre procesos (ver teleop.pipeline).
+
+Un canal es un buffer circular de registros de float64 en un bloque de
+multiprocessing.shared_memory con un unico escritor. El escritor copia el
+registro en la fila seq % capacity y despues incrementa seq; los lectores
+copian las filas nuevas y vuelven a leer seq para descartar las que el
+escritor haya podido sobrescribir mientras tanto. No hay locks, colas ni
+serializacion: escribir o leer un registro son un par de copias de NumPy, y
+un lector lento (display, registro) nunca frena al escritor.
+
+Cada canal se describe con una lista de campos (nombre, tipo); poll()
+devuelve el ultimo registro como dict con esos nombres, igual que
+LatestLineReader con el protocolo JSON, por lo que los bucles EGM y los
+displays pueden leer de un canal o de un socket sin cambios.
+
+Example:
+    channel = ShmChannel.create('teleop_input', XBOX_INPUT)  # proceso que lo crea
+    channel.write((time.time(), buttons, lt, rt, lx, ly, rx, ry, 1))
+    ...
+    reader = ShmChannel.attach('teleop_input', XBOX_INPUT)  # otro proceso
+    state = reader.poll()    # dict del ultimo registro o None si no hay nada nuevo
+    rows = reader.read_new()  # todas las filas nuevas (para registrar sin perder muestras)
+"""
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# campos del mensaje del servidor del mando Xbox hacia EGM (xinput.handle_client)
+XBOX_INPUT = (('t', float), ('buttons', int), ('left_trigger', float), ('right_trigger', float),
+              ('l_thumb_x', float), ('l_thumb_y', float), ('r_thumb_x', float), ('r_thumb_y', float),
+              ('cartesian_mode', bool))
+
+# estado del bucle EGM hacia display y registro
+EGM_FEEDBACK = (('t', float), ('J1', float), ('J2', float), ('J3', float), ('J4', float), ('J5', float),
+                ('J6', float), ('x', float), ('y', float), ('z', float), ('qw', float), ('qx', float),
+                ('qy', float), ('qz', float), ('gain', float), ('mode', int), ('latency', float),
+                ('holding', bool), ('input_age', float))
+
+HEADER = 2  # enteros de cabecera: [seq, cerrado]
+
+
+class ShmChannel(object):
+    """Buffer circular de registros en memoria compartida: un escritor, varios lectores"""
+
+    def __init__(self, shm, fields, capacity, owner):
+        self.shm = shm
+        self.name = shm.name
+        self.fields = tuple(fields)
+        self.names = tuple(name for name, _ in self.fields)
+        self.capacity = capacity
+        self.owner = owner
+        self._header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        self._rows = np.ndarray((capacity, len(self.fields)), dtype=np.float64, buffer=shm.buf,
+                                offset=HEADER * 8)
+        # ultimo seq leido por este lector
+        self._seen = 0
+        # filas perdidas por leer mas despacio de lo que cabe en el buffer
+        self.lost = 0
+        # lo marcan los consumidores que siguen tras cerrarse el canal (teleop.watchdog.poll_input)
+        self.closed = False
+
+    @classmethod
+    def create(cls, name, fields, capacity=256):
+        size = HEADER * 8 + capacity * len(fields) * 8
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        channel = cls(shm, fields, capacity, owner=True)
+        channel._header[:] = 0
+        return channel
+
+    @classmethod
+    def attach(cls, name, fields, capacity=256):
+        # solo el proceso que crea el canal lo borra; los procesos lanzados por el
+        # comparten su resource_tracker (Python < 3.13 no tiene track=False)
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        channel = cls(shm, fields, capacity, owner=False)
+        # los lectores empiezan en el registro actual, no en el historico
+        channel._seen = max(0, int(channel._header[0]) - 1)
+        return channel
+
+    # escritor
+    def write(self, values):
+        seq = int(self._header[0])
+        self._rows[seq % self.capacity] = values
+        self._header[0] = seq + 1
+
+    def mark_closed(self):
+        """El escritor termina: los lectores reciben ConnectionError en poll()"""
+        self._header[1] = 1
+
+    # lectores
+    @property
+    def seq(self):
+        return int(self._header[0])
+
+    def read_new(self):
+        """Copia de las filas escritas desde la ultima lectura (array de n x campos)"""
+        seq = int(self._header[0])
+        start = max(self._seen, seq - self.capacity)
+        if seq == start:
+            return self._rows[:0].copy()
+        index = np.arange(start, seq)
+        rows = self._rows[index % self.capacity]
+        # filas que el escritor ha sobrescrito mientras se copiaban
+        valid = index >= int(self._header[0]) - self.capacity + 1
+        self.lost += (start - self._seen) + int(len(index) - valid.sum())
+        self._seen = seq
+        return rows[valid]
+
+    def latest(self):
+        """Ultimo registro (array) o None si no hay nada nuevo desde la ultima lectura"""
+        seq = int(self._header[0])
+        if seq == self._seen:
+            if self._header[1]:
+                raise ConnectionError("el escritor ha cerrado el canal %s" % self.name)
+            return None
+        row = self._rows[(seq - 1) % self.capacity].copy()
+        if int(self._header[0]) - seq >= self.capacity - 1:
+            # el escritor ha dado la vuelta al buffer durante la copia: se descarta
+            return None
+        self._seen = seq
+        return row
+
+    def poll(self):
+        """Ultimo registro como dict {campo: valor}, o None (misma interfaz que LatestLineReader)"""
+        row = self.latest()
+        if row is None:
+            return None
+        return {name: kind(value) for (name, kind), value in zip(self.fields, row.tolist())}
+
+    def close(self):
+        # las vistas de NumPy bloquean el cierre del bloque mientras existan
+        self._header = self._rows = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,263 @@
+"""
+Lectura de flujos de lineas JSON (el protocolo de los servidores de mando).
+
+Los consumidores que solo necesitan el estado actual (displays, monitores)
+vacian el socket sin bloquear y decodifican unicamente el ultimo mensaje
+completo, en lugar de procesar todo el atraso de mensajes.
+
+Si el servidor se cae o se reinicia, ReconnectingReader reintenta la conexion
+con una espera creciente y acotada sin bloquear al consumidor, y serve_latest
+vuelve a aceptar clientes en los servidores de mando; los dos cuentan las
+reconexiones y la duracion de los cortes con LinkStats.
+"""
+
+import errno
+import json
+import select
+import socket
+import threading
+import time
+
+
+class LatestLineReader(object):
+    """
+    Vacia un socket de lineas JSON sin bloquear y conserva solo el ultimo mensaje.
+
+    Example:
+        reader = LatestLineReader(client_socket)
+        state = reader.poll()  # dict o None si no ha llegado nada nuevo
+    """
+
+    def __init__(self, sock, bufsize=65536):
+        sock.setblocking(False)
+        self.sock = sock
+        self.bufsize = bufsize
+        self.buffer = b""
+        # mensajes descartados por llegar otro mas reciente antes de leerlos
+        self.skipped = 0
+        # lo marcan los consumidores que siguen tras cerrarse la conexion (teleop.watchdog.poll_input)
+        self.closed = False
+        # el servidor ha cerrado: se avisa en el poll siguiente al que entrega lo que quedaba
+        self.eof = False
+
+    def poll(self):
+        """
+        Lee todo lo disponible y devuelve el ultimo mensaje completo decodificado,
+        o None si no hay ninguno nuevo. Lanza ConnectionError si el servidor cierra:
+        las lineas completas que llegaron antes del cierre se entregan primero y el
+        error sale en el poll siguiente.
+        """
+        if self.eof:
+            raise ConnectionError("el servidor ha cerrado la conexion")
+        chunks = [self.buffer]
+        while True:
+            try:
+                data = self.sock.recv(self.bufsize)
+            except (BlockingIOError, InterruptedError):
+                break
+            if not data:
+                self.eof = True
+                break
+            chunks.append(data)
+        if len(chunks) == 1:
+            if self.eof:
+                raise ConnectionError("el servidor ha cerrado la conexion")
+            return None
+        buffer = b"".join(chunks)
+        complete, _, self.buffer = buffer.rpartition(b"\n")
+        if not complete:
+            if self.eof:
+                raise ConnectionError("el servidor ha cerrado la conexion")
+            return None
+        self.skipped += complete.count(b"\n")
+        return json.loads(complete.rpartition(b"\n")[2])
+
+
+class LinkStats(object):
+    """
+    Reconexiones y cortes de un enlace (un cliente o los clientes de un servidor).
+    El corte va desde que se pierde la ultima conexion hasta que vuelve alguna.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.clients = 0
+        self.connections = 0
+        self.reconnects = 0
+        self.last_outage = None
+        self.max_outage = 0.0
+        self.total_outage = 0.0
+        self._down_since = None
+        self._lock = threading.Lock()
+
+    def up(self):
+        with self._lock:
+            now = time.perf_counter()
+            self.clients += 1
+            self.connections += 1
+            if self._down_since is None:
+                if self.connections == 1:
+                    print("%s: conectado" % self.name)
+                return
+            outage = now - self._down_since
+            self._down_since = None
+            self.reconnects += 1
+            self.last_outage = outage
+            self.max_outage = max(self.max_outage, outage)
+            self.total_outage += outage
+        print("%s: reconectado tras %.3f s (reconexion %d, corte maximo %.3f s)" % (
+            self.name, outage, self.reconnects, self.max_outage))
+
+    def down(self):
+        with self._lock:
+            self.clients = max(0, self.clients - 1)
+            if self.clients or self._down_since is not None:
+                return
+            self._down_since = time.perf_counter()
+        print("%s: conexion perdida" % self.name)
+
+    def telemetry(self):
+        """Estado para teleop.telemetry (tiempos en ms)"""
+        down = self._down_since
+        return {'connected': self.clients > 0, 'reconnects': self.reconnects,
+                'outage': None if down is None else round((time.perf_counter() - down) * 1000.0, 1),
+                'last_outage': None if self.last_outage is None else round(self.last_outage * 1000.0, 1),
+                'max_outage': round(self.max_outage * 1000.0, 1)}
+
+
+class ReconnectingReader(object):
+    """
+    LatestLineReader que se conecta (y se reconecta) solo. poll() nunca bloquea ni
+    lanza ConnectionError: sin conexion devuelve None y, como mucho una vez cada
+    'delay' segundos, intenta un connect sin bloquear. La espera empieza en
+    'min_delay' y se duplica con cada intento fallido hasta 'max_delay'; al perder
+    una conexion que funcionaba se reintenta en el siguiente poll.
+
+    En los bucles EGM se usa max_delay=0.004 (un ciclo EGM): reconectar a localhost
+    cuesta unas decenas de microsegundos, y asi el mando vuelve en el ciclo
+    siguiente a que su servidor acepte. El servidor envia el estado actual nada
+    mas aceptar (serve_latest), de modo que no hay que esperar a un mensaje nuevo.
+
+    Example:
+        reader = ReconnectingReader('localhost', 5001, max_delay=0.004)
+        telemetry.add_source('input_link', reader.stats.telemetry)
+        state = reader.poll()  # dict, o None si no hay nada nuevo o no hay conexion
+    """
+
+    def __init__(self, address, port, min_delay=0.004, max_delay=0.5, name=None, bufsize=65536):
+        self.address = address
+        self.port = port
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.bufsize = bufsize
+        self.stats = LinkStats(name or "%s:%d" % (address, port))
+        self.reader = None
+        self.skipped = 0
+        # misma interfaz que LatestLineReader para teleop.watchdog.poll_input (aqui nunca se cierra)
+        self.closed = False
+        self._pending = None
+        self._delay = min_delay
+        self._next_try = 0.0
+        self._waiting_reported = False
+
+    @property
+    def connected(self):
+        return self.reader is not None
+
+    def _retry_later(self, now):
+        self._next_try = now + self._delay
+        self._delay = min(self.max_delay, self._delay * 2.0)
+
+    def _connect(self):
+        now = time.perf_counter()
+        if self._pending is None:
+            if now < self._next_try:
+                return
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            err = sock.connect_ex((self.address, self.port))
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                sock.close()
+                self._failed(now)
+                return
+            self._pending = sock
+            if err != 0:
+                return
+        else:
+            # connect en curso: comprobar sin esperar si ya ha terminado
+            if not select.select([], [self._pending], [], 0)[1]:
+                return
+        sock, self._pending = self._pending, None
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            sock.close()
+            self._failed(now)
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = LatestLineReader(sock, self.bufsize)
+        self._delay = self.min_delay
+        self._waiting_reported = False
+        self.stats.up()
+
+    def _failed(self, now):
+        if not self._waiting_reported and self.stats.connections == 0:
+            print("%s: esperando al servidor" % self.stats.name)
+            self._waiting_reported = True
+        self._retry_later(now)
+
+    def _lost(self):
+        self.skipped += self.reader.skipped
+        self.reader.sock.close()
+        self.reader = None
+        self._delay = self.min_delay
+        self._next_try = 0.0
+        self.stats.down()
+
+    def poll(self):
+        """Ultimo mensaje completo, o None si no hay ninguno nuevo o no hay conexion"""
+        if self.reader is None:
+            self._connect()
+            if self.reader is None:
+                return None
+        try:
+            message = self.reader.poll()
+        except (ConnectionError, OSError):
+            self._lost()
+            return None
+        if self.reader.eof:
+            # lo ultimo que envio el servidor antes de cerrar se entrega, y se reconecta ya
+            self._lost()
+        return message
+
+    def close(self):
+        if self._pending is not None:
+            self._pending.close()
+            self._pending = None
+        if self.reader is not None:
+            self.reader.sock.close()
+            self.reader = None
+
+
+def serve_latest(server_socket, produce, period=0.01, stats=None):
+    """
+    Bucle de un servidor de mando de un solo cliente: acepta, envia produce() (bytes,
+    o None si no hay estado) cada 'period' segundos y, si el cliente se va, vuelve a
+    aceptar. Al aceptar se envia el estado actual en el acto, sin esperar al periodo.
+    """
+    stats = stats or LinkStats("cliente")
+    while True:
+        connection, client_address = server_socket.accept()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print("Conexion de", client_address)
+        stats.up()
+        try:
+            while True:
+                data = produce()
+                if data:
+                    try:
+                        connection.sendall(data)
+                    except OSError:
+                        stats.down()
+                        break
+                time.sleep(period)
+        finally:
+            connection.close()
@@ -0,0 +1,314 @@
+"""
+Barrido de parametros EGM contra un robot simulado.
+
+Reproduce una sesion de entrada grabada (o una sintetica) a traves del mismo
+perfil de mapeo que usa el bucle EGM, a 250 Hz, y simula la respuesta del
+controlador para cada combinacion de:
+    EGMRun:   ramp_in (ramp_in_time), condtime (\\CondTime), minmax (egm_minmax, +-)
+    MOC.cfg:  kp (ext_motion_Kp), bandwidth (ext_motion_filter_bandwidth), ramp_time
+
+Modelo del robot (aproximado, por eje y por ciclo de 4 ms):
+    - el comando se aplica con un ciclo de retraso (ida y vuelta UDP);
+    - la correccion entra con una rampa lineal de ramp_in segundos;
+    - la referencia pasa por un filtro de primer orden de 'bandwidth' Hz;
+    - el lazo de posicion pide v = Kp * error (Kp en rampa durante ramp_time),
+      limitado a max_speed, y el lazo de velocidad del eje la sigue con un
+      retraso de primer orden de axis_lag segundos (con Kp alto, sobreoscila);
+    - si el error queda dentro de +-minmax durante condtime segundos la
+      instruccion EGMRun termina (el "programa se para" del README).
+
+Para cada caso se calcula: retraso (correlacion cruzada de las velocidades
+de comando y de robot), sobreoscilacion (lo que el robot pasa del objetivo
+cuando este se para), error RMS de seguimiento, suavidad (jerk RMS) y el
+instante en que EGMRun se habria terminado, si ocurre. Los casos se reparten
+en bloques entre un pool de procesos; cada bloque se simula vectorizado.
+
+Uso:
+    python -m teleop.sweep run [--session sesion.jsonl] [--profile xbox_joint] [--kp 10,20,40] ...
+    python -m teleop.sweep record sesion.jsonl [--port 5001] [--duration 60]
+
+Una sesion es un fichero de lineas JSON con los mensajes del servidor del mando
+y su instante de llegada en 't' (segundos); 'record' la graba del servidor.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from teleop.mapping import load_mapping
+
+EGM_PERIOD = 0.004  # s, ciclo EGM del controlador
+
+# parametros de un caso del barrido
+EGMParams = namedtuple("EGMParams", ["kp", "bandwidth", "ramp_time", "ramp_in", "condtime", "minmax"])
+
+DEFAULT_GRID = {
+    'kp': (10.0, 20.0, 40.0, 80.0),
+    'bandwidth': (20.0, 50.0, 100.0),
+    'ramp_time': (0.005, 0.05, 0.5),
+    'ramp_in': (0.05,),
+    'condtime': (10.0, 60.0),
+    'minmax': (1e-3, 0.5),
+}
+
+# metricas en el orden de las columnas del informe
+METRICS = ('latency_ms', 'overshoot', 'rms_error', 'jerk_rms', 'stopped_at')
+
+
+# ///////////////////////////////////////////////
+# sesiones de entrada
+def load_session(path):
+    """Lista de (t, mensaje) con t relativo al primer mensaje"""
+    with open(path) as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    if not messages:
+        raise ValueError("La sesion %s esta vacia" % path)
+    t0 = messages[0]['t']
+    return [(message['t'] - t0, message) for message in messages]
+
+
+def synthetic_session(mapping, duration=30.0, rate=100.0):
+    """
+    Sesion sintetica para el perfil: escalones, rampas y senos en cada eje y una
+    pausa de 12 s con el mando quieto (suficiente para disparar \\CondTime 10).
+    """
+    session = []
+    buttons = [0, 0] if mapping.list_buttons else 0
+    for i in range(int(duration * rate)):
+        t = i / rate
+        message = {'t': t, 'buttons': buttons}
+        for k, axis in enumerate(mapping.axes):
+            phase = (t + 2.0 * k) % 10.0
+            if t > duration - 12.0:
+                value = 0.0
+            elif phase < 2.0:
+                value = 1.0  # escalon a fondo
+            elif phase < 4.0:
+                value = 0.0
+            elif phase < 7.0:
+                value = np.sin(2.0 * np.pi * 0.5 * phase) * 0.6
+            else:
+                value = -0.3
+            message[axis] = float(value) if k % 2 == 0 else float(value) * 0.5
+        session.append((t, message))
+    return session
+
+
+def command_trajectory(session, mapping, gain, period=EGM_PERIOD):
+    """
+    Objetivo enviado en cada ciclo EGM, como en el bucle real: en cada ciclo se usa
+    el ultimo mensaje llegado y el incremento solo se aplica si es nuevo.
+    """
+    times = np.array([t for t, _ in session])
+    n_cycles = int(times[-1] / period) + 1
+    lower, upper = mapping.lower, mapping.upper
+    bounded = np.isfinite(lower) & np.isfinite(upper)
+    target = np.where(bounded, (np.where(bounded, lower, 0.0) + np.where(bounded, upper, 0.0)) / 2.0, 0.0)
+    target = mapping.clip(target)
+    latest = np.searchsorted(times, np.arange(n_cycles) * period, side='right') - 1
+    commands = np.empty((n_cycles, len(target)))
+    last = -1
+    for i, index in enumerate(latest):
+        if index > last:
+            last = index
+            axes, buttons = mapping.read(session[index][1])
+            target = mapping.clip(target + mapping.delta(axes, buttons, gain))
+        commands[i] = target
+    return commands
+
+
+# ///////////////////////////////////////////////
+# robot simulado
+def simulate(commands, cases, max_speed=250.0, axis_lag=0.02, period=EGM_PERIOD):
+    """
+    Simula 'cases' (lista de EGMParams) a la vez. Devuelve las posiciones
+    (ciclos x casos x ejes) y el ciclo en que EGMRun termina por convergencia (-1 si no).
+    """
+    params = np.array(cases, dtype=float)
+    kp, bandwidth, ramp_time, ramp_in, condtime, minmax = (params[:, i:i + 1] for i in range(params.shape[1]))
+    n_cycles, n_axes = commands.shape
+    start = commands[0]
+    alpha = 1.0 - np.exp(-2.0 * np.pi * bandwidth * period)
+    position = np.tile(start, (len(cases), 1))
+    reference = position.copy()
+    velocity = np.zeros_like(position)
+    beta = 1.0 - np.exp(-period / axis_lag)
+    converged = np.zeros(len(cases))
+    stopped = np.full(len(cases), -1)
+    running = np.ones((len(cases), 1), dtype=bool)
+    positions = np.empty((n_cycles, len(cases), n_axes))
+    positions[0] = position
+    for i in range(1, n_cycles):
+        t = i * period
+        command = commands[i - 1]  # un ciclo de retraso
+        ramp = np.minimum(1.0, t / ramp_in)
+        reference += alpha * (start + ramp * (command - start) - reference)
+        speed = kp * np.minimum(1.0, t / ramp_time) * (reference - position)
+        np.clip(speed, -max_speed, max_speed, out=speed)
+        velocity += beta * (np.where(running, speed, 0.0) - velocity)
+        position += velocity * period
+        positions[i] = position
+        # condicion de convergencia de EGMRun
+        inside = np.all(np.abs(command - position) <= minmax, axis=1)
+        converged = np.where(inside, converged + period, 0.0)
+        done = running[:, 0] & (converged >= condtime[:, 0])
+        if done.any():
+            stopped[done] = i
+            running[done] = False
+    return positions, stopped
+
+
+def metrics(commands, positions, stopped, period=EGM_PERIOD, max_lag=100):
+    """Metricas por caso (dict de arrays, ver METRICS)"""
+    n_cycles = len(commands)
+    error = positions - commands[:, None, :]
+
+    # retraso: desplazamiento que maximiza la correlacion de las velocidades
+    command_speed = np.diff(commands, axis=0)
+    robot_speed = np.diff(positions, axis=0)
+    lags = np.arange(max_lag)
+    score = np.array([np.einsum('ta,tca->c', command_speed[:len(command_speed) - lag], robot_speed[lag:])
+                      for lag in lags])
+    latency = lags[score.argmax(axis=0)] * period * 1000.0
+
+    # sobreoscilacion: en los tramos con el objetivo parado al menos 'hold' ciclos (mas que
+    # el intervalo entre mensajes del mando), lo que el robot pasa de el en el sentido del movimiento
+    hold = 25
+    cycles = np.arange(n_cycles)
+    changed = np.any(np.abs(np.diff(commands, axis=0, prepend=commands[:1])) > 1e-9, axis=1)
+    last_change = np.maximum.accumulate(np.where(changed, cycles, 0))
+    next_change = np.minimum.accumulate(np.where(changed, cycles, n_cycles)[::-1])[::-1]
+    next_change = np.append(next_change[1:], n_cycles)
+    still = (next_change - last_change >= hold) & (cycles > last_change)
+    direction = np.sign(commands[:, None, :] - positions[last_change])
+    overshoot = np.where(still[:, None, None], error * direction, 0.0).max(axis=(0, 2)).clip(0.0)
+
+    # suavidad: jerk RMS de la trayectoria del robot
+    jerk = np.diff(positions, n=3, axis=0) / period ** 3
+    return {
+        'latency_ms': latency,
+        'overshoot': overshoot,
+        'rms_error': np.sqrt((error ** 2).mean(axis=(0, 2))),
+        'jerk_rms': np.sqrt((jerk ** 2).mean(axis=(0, 2))),
+        'stopped_at': np.where(stopped >= 0, stopped * period, np.nan),
+    }
+
+
+def _run_chunk(args):
+    commands, cases = args
+    positions, stopped = simulate(commands, cases)
+    result = metrics(commands, positions, stopped)
+    return [dict(case._asdict(), **{name: float(result[name][k]) for name in METRICS})
+            for k, case in enumerate(cases)]
+
+
+def sweep(commands, grid, workers=None, chunk=16):
+    """Simula todas las combinaciones de 'grid' en un pool de procesos; lista de dicts"""
+    cases = [EGMParams(*values) for values in itertools.product(*(grid[name] for name in EGMParams._fields))]
+    chunks = [(commands, cases[i:i + chunk]) for i in range(0, len(cases), chunk)]
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(_run_chunk, chunks)
+    return [row for rows in results for row in rows]
+
+
+def score(row):
+    """Orden del informe: sin paradas primero, despues retraso, sobreoscilacion y jerk"""
+    return (not np.isnan(row['stopped_at']), row['latency_ms'] + 100.0 * row['overshoot'] + 1e-4 * row['jerk_rms'])
+
+
+def report(rows, top=15):
+    print("%6s %6s %7s %7s %6s %7s | %8s %9s %9s %10s %9s" % (
+        'kp', 'bw', 'ramp', 'ramp_in', 'cond', 'minmax', 'lat ms', 'overshoot', 'rms err', 'jerk', 'parada s'))
+    for row in sorted(rows, key=score)[:top]:
+        print("%6g %6g %7g %7g %6g %7g | %8.1f %9.4f %9.3f %10.4g %9s" % (
+            row['kp'], row['bandwidth'], row['ramp_time'], row['ramp_in'], row['condtime'], row['minmax'],
+            row['latency_ms'], row['overshoot'], row['rms_error'], row['jerk_rms'],
+            '-' if np.isnan(row['stopped_at']) else '%.1f' % row['stopped_at']))
+    best = min(rows, key=score)
+    print("\nMOC.cfg:  -ramp_time %g -ext_motion_Kp %g -ext_motion_filter_bandwidth %g" % (
+        best['ramp_time'], best['kp'], best['bandwidth']))
+    print("EGMRun:   \\CondTime %g, \\RampInTime %g, egm_minmax(%g, %g)" % (
+        best['condtime'], best['ramp_in'], -best['minmax'], best['minmax']))
+
+
+# ///////////////////////////////////////////////
+def record_session(path, address='localhost', port=5001, duration=60.0):
+    """Graba los mensajes del servidor del mando con su instante de llegada"""
+    connection = socket.create_connection((address, port))
+    connection.settimeout(0.5)
+    buffer = b""
+    end = time.time() + duration
+    count = 0
+    with open(path, 'w') as f:
+        while time.time() < end:
+            try:
+                data = connection.recv(65536)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            now = time.time()
+            lines = (buffer + data).split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                message = json.loads(line)
+                message['t'] = now
+                f.write(json.dumps(message) + '\n')
+                count += 1
+    connection.close()
+    print("%d mensajes grabados en %s" % (count, path))
+
+
+def _values(text):
+    return tuple(float(v) for v in text.split(','))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Barrido de parametros EGM contra un robot simulado")
+    commands_parser = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands_parser.add_parser('run', help="simula la rejilla de parametros")
+    run_parser.add_argument('--session', help="sesion grabada (por defecto, una sintetica de 30 s)")
+    run_parser.add_argument('--profile', default='xbox_joint', help="perfil de mapeo (teleop/profiles)")
+    run_parser.add_argument('--gain', type=float, default=0.5)
+    for name, values in DEFAULT_GRID.items():
+        run_parser.add_argument('--' + name.replace('_', '-'), type=_values, default=values,
+                                help="valores separados por comas (por defecto %s)" % ",".join(map(str, values)))
+    run_parser.add_argument('--workers', type=int, help="procesos del pool (por defecto, uno por CPU)")
+    run_parser.add_argument('--csv', help="guarda todos los casos en un CSV")
+    run_parser.add_argument('--top', type=int, default=15)
+    record_parser = commands_parser.add_parser('record', help="graba una sesion del servidor del mando")
+    record_parser.add_argument('path')
+    record_parser.add_argument('--port', type=int, default=5001)
+    record_parser.add_argument('--duration', type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record_session(args.path, port=args.port, duration=args.duration)
+        sys.exit(0)
+
+    mapping = load_mapping(args.profile)
+    session = load_session(args.session) if args.session else synthetic_session(mapping)
+    commands = command_trajectory(session, mapping, args.gain)
+    grid = {name: getattr(args, name) for name in EGMParams._fields}
+    n_cases = int(np.prod([len(values) for values in grid.values()]))
+    print("%d casos, %.1f s de sesion (%d ciclos), perfil %s" % (
+        n_cases, len(commands) * EGM_PERIOD, len(commands), mapping.name))
+    t0 = time.perf_counter()
+    rows = sweep(commands, grid, workers=args.workers)
+    print("simulado en %.1f s\n" % (time.perf_counter() - t0))
+    report(rows, args.top)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(EGMParams._fields) + list(METRICS))
+            writer.writeheader()
+            writer.writerows(rows)
+        print("\n%d casos guardados en %s" % (len(rows), os.path.abspath(args.csv)))
@@ -0,0 +1,213 @@
+"""
+Telemetria del bucle EGM para los displays.
+
+El bucle de control solo guarda referencias a su ultimo estado (update) y el
+tiempo de cada ciclo (add_latency) en un buffer circular; un hilo aparte
+convierte y envia a 'rate' Hz el ultimo estado a los clientes conectados.
+Los sockets de los clientes no bloquean: si un display va lento se descartan
+mensajes para ese cliente, nunca se espera por el, de modo que un display
+no puede frenar el bucle de control.
+
+Formato (una linea JSON por mensaje):
+    {'t', 'seq', 'pos': [x, y, z] (mm), 'quat': [w, x, y, z], 'joints': [J1..J6] (grados),
+     'motors_on', 'rapid_running', 'gain', 'mode', 'hz',
+     'latency': {'p50', 'p95', 'p99', 'max'} (ms), <fuentes anadidas con add_source>}
+
+Example:
+    telemetry = TelemetryPublisher()
+    telemetry.start()
+    ...
+    res, feedback = egm.receive_from_robot(timeout=0.05)
+    t_rx = time.perf_counter()
+    telemetry.update(feedback, gain=gain, mode='pose')
+    egm.send_to_robot_cart(r2.trans, r2.rot)
+    telemetry.add_latency(time.perf_counter() - t_rx)
+"""
+
+import json
+import select
+import socket
+import threading
+import time
+
+import numpy as np
+
+from teleop.stream import LatestLineReader
+
+TELEMETRY_PORT = 5002
+
+
+def _as_list(values, digits):
+    return [round(float(v), digits) for v in values]
+
+
+class TelemetryPublisher(object):
+    """Publica la telemetria del bucle EGM submuestreada a 'rate' Hz"""
+
+    def __init__(self, address='localhost', port=TELEMETRY_PORT, rate=20.0, window=1000):
+        self.address = address
+        self.port = port
+        self.period = 1.0 / rate
+        # (feedback, gain, mode): se sustituye entero en cada update, sin locks
+        self._latest = None
+        self._latency = np.zeros(window)
+        self._latency_count = 0
+        self._updates = 0
+        self._seq = 0
+        self._clients = {}
+        self._sources = []
+        self._server = None
+        self.running = False
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.address, self.port))
+        self._server.listen(4)
+        self._server.setblocking(False)
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        print("Telemetria en %s:%d" % (self.address, self.port))
+        return self
+
+    def close(self):
+        self.running = False
+
+    def add_source(self, name, source):
+        """
+        Añade al mensaje la clave 'name' con source(), evaluada en el hilo de publicacion.
+        Una fuente con el mismo nombre sustituye a la anterior (p.ej. al cambiar de modo).
+        """
+        self._sources = [(n, s) for n, s in self._sources if n != name] + [(name, source)]
+
+    def remove_source(self, *names):
+        """Quita las fuentes 'names' (las de un modo, al terminar su bucle); las que no esten se ignoran"""
+        self._sources = [(n, s) for n, s in self._sources if n not in names]
+
+    # llamadas desde el bucle de control: solo guardan, no convierten ni envian
+    def update(self, feedback, gain=None, mode=None):
+        """Guarda el ultimo EGMRobotState recibido y el gain/modo activos"""
+        self._latest = (feedback, gain, mode)
+        self._updates += 1
+
+    def add_latency(self, seconds):
+        """Tiempo de un ciclo (recepcion del feedback -> envio del comando)"""
+        self._latency[self._latency_count % len(self._latency)] = seconds
+        self._latency_count += 1
+
+    def message(self, hz=None):
+        latest = self._latest
+        if latest is None:
+            return None
+        feedback, gain, mode = latest
+        self._seq += 1
+        message = {'t': time.time(), 'seq': self._seq, 'gain': gain, 'mode': mode, 'hz': hz}
+        if feedback is not None:
+            pos, quat = feedback.cartesian
+            message['pos'] = _as_list(pos, 2)
+            message['quat'] = _as_list(quat, 5)
+            message['joints'] = _as_list(feedback.joint_angles, 3)
+            message['motors_on'] = bool(feedback.motors_on)
+            message['rapid_running'] = bool(feedback.rapid_running)
+        count = min(self._latency_count, len(self._latency))
+        if count:
+            samples = self._latency[:count] * 1000.0
+            p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+            message['latency'] = {'p50': round(p50, 3), 'p95': round(p95, 3),
+                                  'p99': round(p99, 3), 'max': round(samples.max(), 3)}
+        for name, source in self._sources:
+            message[name] = source()
+        return message
+
+    def _run(self):
+        next_send = time.perf_counter() + self.period
+        last_updates, last_send = self._updates, time.perf_counter()
+        try:
+            while self.running:
+                timeout = max(0.0, next_send - time.perf_counter())
+                readable, _, _ = select.select([self._server], [], [], timeout)
+                if readable:
+                    self._accept()
+                    continue
+                now = time.perf_counter()
+                next_send = max(next_send + self.period, now)
+                updates = self._updates
+                hz = round((updates - last_updates) / (now - last_send), 1)
+                last_updates, last_send = updates, now
+                message = self.message(hz)
+                if message is not None and self._clients:
+                    self._send((json.dumps(message) + '\n').encode('utf-8'))
+        finally:
+            for connection in self._clients:
+                connection.close()
+            self._server.close()
+
+    def _accept(self):
+        try:
+            connection, client_address = self._server.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        self._clients[connection] = b""
+        print("Display de telemetria conectado", client_address)
+
+    def _send(self, data):
+        for connection, pending in list(self._clients.items()):
+            # si quedaba un mensaje a medias se termina antes de mandar el nuevo,
+            # y el nuevo se descarta para este cliente
+            buffer = pending or data
+            try:
+                sent = connection.send(buffer)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                connection.close()
+                del self._clients[connection]
+                continue
+            self._clients[connection] = buffer[sent:]
+
+
+class TelemetrySubscriber(object):
+    """
+    Cliente de telemetria para los displays. No bloquea: poll() devuelve el
+    ultimo mensaje o None, y si el servidor no esta (o se cae) se reintenta
+    la conexion cada 'retry' segundos.
+    """
+
+    def __init__(self, address='localhost', port=TELEMETRY_PORT, retry=2.0):
+        self.address = address
+        self.port = port
+        self.retry = retry
+        self.reader = None
+        self._next_try = 0.0
+
+    def _connect(self):
+        now = time.perf_counter()
+        if now < self._next_try:
+            return
+        self._next_try = now + self.retry
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        connection.settimeout(0.05)
+        try:
+            connection.connect((self.address, self.port))
+        except OSError:
+            connection.close()
+            return
+        self.reader = LatestLineReader(connection)
+        print("Telemetria conectada")
+
+    def poll(self):
+        if self.reader is None:
+            self._connect()
+            if self.reader is None:
+                return None
+        try:
+            return self.reader.poll()
+        except (ConnectionError, OSError):
+            self.close()
+            return None
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.sock.close()
+            self.reader = None
@@ -0,0 +1,121 @@
+"""
+Vigilancia de la entrada en los bucles EGM.
+
+El bucle EGM contesta al robot en cada ciclo pase lo que pase con el mando. En
+cada ciclo se mide la edad de la ultima entrada recibida; si supera 'timeout'
+(servidor del mando parado, socket caido) o si el hombre muerto esta suelto,
+el comando se lleva con una rampa de 'ramp_time' segundos desde el ultimo
+comando enviado hasta la pose que devuelve el robot, y se queda ahi hasta que
+vuelve la entrada. Al volver, el objetivo sigue desde la pose mantenida, sin
+saltos hacia el objetivo antiguo.
+
+Example:
+    watchdog = InputWatchdog(timeout=0.1)
+    watchdog.feed(time.perf_counter())
+    telemetry.add_source('watchdog', watchdog.telemetry)
+    ...
+    state = poll_input(reader)
+    if state is not None:
+        watchdog.feed(t_rx, live=state.get('deadman', True))
+    if watchdog.update(t_rx):
+        robax = watchdog.hold(robax, feedback_joints(feedback), t_rx)
+    elif state is not None:
+        robax = ...  # control normal
+    egm.send_to_robot(robax)
+"""
+
+import time
+
+import numpy as np
+
+
+def poll_input(reader):
+    """
+    Ultimo mensaje de un LatestLineReader sin bloquear. Devuelve None si no hay nada
+    nuevo o si el servidor del mando ha cerrado la conexion (el watchdog se encarga).
+    Un teleop.stream.ReconnectingReader no se cierra nunca: se reconecta solo y el
+    watchdog suelta la pose en cuanto vuelve la entrada.
+    """
+    if reader.closed:
+        return None
+    try:
+        return reader.poll()
+    except ConnectionError:
+        reader.closed = True
+        print("Conexion con el servidor del mando cerrada")
+        return None
+
+
+def feedback_joints(feedback, count=6):
+    """Articulaciones (grados) del EGMRobotState"""
+    return np.asarray(feedback.joint_angles[:count], dtype=float)
+
+
+def feedback_pose(feedback, rot):
+    """
+    Pose del EGMRobotState como [x, y, z, q1, q2, q3] (el formato de los objetivos de
+    pose), con el cuaternion en el mismo hemisferio que 'rot' para que la rampa no
+    pase por el lado contrario de la esfera.
+    """
+    pos, quat = feedback.cartesian
+    quat = np.asarray(quat, dtype=float)
+    if np.dot(quat, rot) < 0.0:
+        quat = -quat
+    return np.concatenate((np.asarray(pos, dtype=float), quat[:3]))
+
+
+class InputWatchdog(object):
+    """Detecta entrada desactualizada (o hombre muerto suelto) y genera la rampa de mantenimiento"""
+
+    def __init__(self, timeout=0.1, ramp_time=0.3):
+        self.timeout = timeout
+        self.ramp_time = ramp_time
+        self.last_input = None
+        self.live = True
+        self.age = 0.0
+        self.holding = False
+        self.trips = 0
+        self.last_trip = None
+        self.reason = None
+        self._hold_start = None
+        self._hold_from = None
+
+    def feed(self, now, live=True):
+        """Registra una entrada recibida en 'now'; live=False si el hombre muerto esta suelto"""
+        self.last_input = now
+        self.live = live
+
+    def update(self, now):
+        """Actualiza la edad de la entrada; devuelve True si hay que mantener la pose"""
+        self.age = float('inf') if self.last_input is None else now - self.last_input
+        if self.age > self.timeout:
+            reason = 'entrada sin actualizar'
+        elif not self.live:
+            reason = 'hombre muerto suelto'
+        else:
+            reason = None
+        if reason and not self.holding:
+            self.holding = True
+            self.reason = reason
+            self.trips += 1
+            self.last_trip = time.time()
+            self._hold_start = now
+            self._hold_from = None
+            print("Watchdog: %s (%.0f ms), manteniendo la pose del robot" % (reason, self.age * 1000.0))
+        elif not reason and self.holding:
+            self.holding = False
+            self.reason = None
+            print("Watchdog: entrada recuperada tras %.2f s" % (now - self._hold_start))
+        return self.holding
+
+    def hold(self, command, feedback, now):
+        """Comando durante el mantenimiento: rampa del ultimo comando a la pose de feedback"""
+        if self._hold_from is None:
+            self._hold_from = np.array(command, dtype=float)
+        alpha = min(1.0, (now - self._hold_start) / self.ramp_time) if self.ramp_time > 0 else 1.0
+        return self._hold_from + (feedback - self._hold_from) * alpha
+
+    def telemetry(self):
+        """Estado para teleop.telemetry (se llama desde el hilo de publicacion)"""
+        return {'holding': self.holding, 'reason': self.reason, 'trips': self.trips,
+                'last_trip': self.last_trip, 'input_age': round(min(self.age, 1e6) * 1000.0, 1)}